@@ -0,0 +1,2 @@
+# Benchmarks are plain scripts, run from the project root with e.g.
+# "python -m benchmarks.pool". They are not part of the test suite.
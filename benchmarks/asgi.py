@@ -0,0 +1,114 @@
+# Compares the WSGI (waitress, sync views) and ASGI (uvicorn, async views, see
+# flaskr/aioviews.py) serving modes on the blog's read views, with the page
+# cache disabled so every request queries the database. Each mode is measured
+# with more and more concurrent clients, each keeping its connection open.
+#
+#   python -m benchmarks.asgi [--concurrency 16 64 256] [--requests 50]
+#
+# Needs the optional dependencies: "pip install flaskr[async] uvicorn".
+
+import argparse
+import json
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import uvicorn
+from waitress import create_server
+
+from benchmarks.common import seed, temp_app
+from benchmarks.load import Client, summary
+from flaskr.aioviews import AsyncViews
+
+def serve_wsgi(app, args):
+    # Enough connections for every client, so none waits to be accepted
+    server = create_server(
+        app, host='127.0.0.1', port=0, threads=args.threads,
+        connection_limit=max(args.concurrency) + 10
+    )
+    # The server runs until the benchmark exits
+    threading.Thread(target=server.run, daemon=True).start()
+    return server.effective_port, lambda: None
+
+def serve_asgi(app, args):
+    app.config['ASGI_THREADS'] = args.threads
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+
+    server = uvicorn.Server(uvicorn.Config(
+        AsyncViews(app), log_level='warning', lifespan='on'
+    ))
+    serving = threading.Thread(
+        target=server.run, kwargs={'sockets': [sock]}, daemon=True
+    )
+    serving.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def close():
+        # Closes the async pools (see "AsyncViews.lifespan")
+        server.should_exit = True
+        serving.join()
+    return sock.getsockname()[1], close
+
+def run(port, concurrency, args):
+    barrier = threading.Barrier(concurrency)
+
+    def client_run(n):
+        client = Client(port)
+        latencies = []
+        # Every client is connected before the first request
+        client.request('GET', '/1')
+        barrier.wait()
+
+        for i in range(args.requests):
+            # Alternates between the index and the posts' pages
+            path = '/' if i % 2 else f'/{(n + i) % args.posts + 1}'
+            start = time.perf_counter()
+            client.request('GET', path)
+            latencies.append(time.perf_counter() - start)
+        client.close()
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = [
+            latency for result in executor.map(client_run, range(concurrency))
+            for latency in result
+        ]
+    return summary(latencies, time.perf_counter() - start)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=50,
+                        help='requests made by each client')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[16, 64, 256])
+    parser.add_argument('--threads', type=int, default=16,
+                        help='waitress threads (and ASGI_THREADS)')
+    args = parser.parse_args(argv)
+
+    # Waitress warns whenever requests wait for a thread, which is expected
+    logging.getLogger('waitress').setLevel(logging.ERROR)
+
+    results = {}
+    for mode, serve in (('wsgi', serve_wsgi), ('asgi', serve_asgi)):
+        with temp_app(PAGE_CACHE_SIZE=0) as app:
+            seed(app, posts=args.posts)
+            app.config['TESTING'] = False
+            port, close = serve(app, args)
+            try:
+                results[mode] = {
+                    concurrency: run(port, concurrency, args)
+                    for concurrency in args.concurrency
+                }
+            finally:
+                close()
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Measures the time of the index query with the author's username joined from
+# "user" (as it used to be) and read from the copy in "post.author_username",
+# and of listing the posts of one author with and without the
+# "post_author_id" index.
+#
+#   python -m benchmarks.authors [posts] [queries]
+
+import sys
+import time
+
+from benchmarks.common import seed, temp_app
+from flaskr.db import get_db
+from flaskr.repositories import page_query
+
+JOINED_QUERY = (
+    'SELECT p.id, title, body, created, author_id, username'
+    ' FROM post p JOIN user u ON p.author_id = u.id'
+    ' WHERE (p.created, p.id) < (?, ?)'
+    ' ORDER BY p.created DESC, p.id DESC LIMIT ?'
+)
+
+AUTHOR_QUERY = (
+    'SELECT id, title, created FROM post {} WHERE author_id = ?'
+    ' ORDER BY created DESC LIMIT 10'
+)
+
+def milliseconds_per_query(db, queries, sql, params):
+    start = time.perf_counter()
+    for _ in range(queries):
+        db.execute(sql, params).fetchall()
+    return (time.perf_counter() - start) * 1000 / queries
+
+def main(posts=1000000, queries=1000):
+    # The slow query log would only report the seeding
+    with temp_app(SLOW_QUERY_MS=None) as app:
+        start = time.perf_counter()
+        seed(app, users=100, posts=posts)
+        print(f'Seeded {posts} posts in {time.perf_counter() - start:.1f}s')
+
+        with app.app_context():
+            db = get_db()
+            db.execute('ANALYZE')
+
+            # A page from the middle of the index
+            middle = db.execute(
+                'SELECT created, id FROM post ORDER BY id LIMIT 1 OFFSET ?',
+                (posts // 2,)
+            ).fetchone()
+            before = (middle['created'], middle['id'])
+
+            results = {
+                'index page, joined': milliseconds_per_query(
+                    db, queries, JOINED_QUERY, (*before, 11)
+                ),
+                'index page, denormalized': milliseconds_per_query(
+                    db, queries, *page_query(before=before, limit=11)
+                ),
+                # "NOT INDEXED" keeps sqlite from using "post_author_id"
+                'author posts, no index': milliseconds_per_query(
+                    db, max(queries // 100, 1),
+                    AUTHOR_QUERY.format('NOT INDEXED'), (1,)
+                ),
+                'author posts, post_author_id': milliseconds_per_query(
+                    db, queries, AUTHOR_QUERY.format(''), (1,)
+                ),
+            }
+
+    for label, ms in results.items():
+        print(f'{label:>30}: {ms:8.3f} ms/query')
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,73 @@
+# Helpers shared by the benchmark scripts. They mirror the fixtures in
+# "tests/conftest.py": the app is created with a temporary database file,
+# initialized with "init_db" and filled with synthetic data.
+
+import contextlib
+import os
+import tempfile
+import time
+
+from flaskr import create_app
+from flaskr.db import close_pool, get_db, init_db
+
+# The hash of the password 'test' (same as in "tests/data.sql"). Every
+# synthetic user shares it so seeding doesn't spend its time hashing.
+PASSWORD_HASH = (
+    'pbkdf2:sha256:50000$TCI4GzcX$'
+    '0de171a4f4dac32e3364c7ddc7c14f3e2fa61f2d17574483f7ffbb431b4acb2f'
+)
+
+@contextlib.contextmanager
+def temp_app(admission=False, **config):
+    """
+        Yields an app using a new temporary database, removed afterwards.
+
+        The admission control (see flaskr/admission.py) is off unless
+        "admission", as the test client only closes the responses it's told
+        to, so their slots would never be given back.
+    """
+    if not admission:
+        config.setdefault('ADMISSION_CLASSES', None)
+
+    db_fd, db_path = tempfile.mkstemp()
+    app = create_app({'TESTING': True, 'DATABASE': db_path, **config})
+
+    with app.app_context():
+        init_db()
+
+    try:
+        yield app
+    finally:
+        close_pool(app)
+        os.close(db_fd)
+        os.unlink(db_path)
+
+def seed(app, users=10, posts=1000):
+    """
+        Inserts "users" users (named user0, user1, ...) with the password
+        'test' and "posts" posts spread across them
+    """
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO user (username, password) VALUES (?, ?)',
+            ((f'user{i}', PASSWORD_HASH) for i in range(users))
+        )
+        db.executemany(
+            'INSERT INTO post (title, body, author_id, created)'
+            " VALUES (?, ?, ?, datetime('2018-01-01', ? || ' seconds'))",
+            (
+                (f'title {i}', f'body of post {i}\n' * 5, i % users + 1, i)
+                for i in range(posts)
+            )
+        )
+        db.commit()
+
+def requests_per_second(func, requests):
+    """
+        Calls "func" "requests" times and returns the calls per second
+    """
+    start = time.perf_counter()
+    for _ in range(requests):
+        func()
+    return requests / (time.perf_counter() - start)
@@ -0,0 +1,58 @@
+# Measures the posts created per second by concurrent writers, each request
+# committing its own write, then with the writes grouped into shared
+# transactions by the writer thread (see "GroupCommitWriter" in flaskr/db.py).
+#
+#   python -m benchmarks.group_commit [requests] [threads]
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import requests_per_second, seed, temp_app
+from flaskr.db import get_writer
+
+def run(group_commit, requests, threads):
+    config = {
+        'SLOW_QUERY_MS': None,
+        'DATABASE_GROUP_COMMIT': group_commit,
+        # Each commit waits for the disk, as in production
+        'DATABASE_PRAGMAS': 'durable',
+    }
+
+    with temp_app(**config) as app:
+        seed(app, users=threads, posts=100)
+
+        # Each thread logs in as its own user, like the authors of a busy
+        # blog posting at the same time
+        clients = []
+        for i in range(threads):
+            client = app.test_client()
+            client.post(
+                '/auth/login', data={'username': f'user{i}', 'password': 'test'}
+            )
+            clients.append(client)
+
+        def worker(client):
+            for i in range(requests):
+                response = client.post(
+                    '/create', data={'title': f'post {i}', 'body': 'body'}
+                )
+                assert response.status_code == 302, response.status
+
+        def all_threads():
+            with ThreadPoolExecutor(threads) as executor:
+                list(executor.map(worker, clients))
+
+        rate = requests_per_second(all_threads, 1) * requests * threads
+
+        writer = get_writer(app)
+        batch = writer.writes / writer.commits if writer else 1
+        return rate, batch
+
+def main(requests=200, threads=8):
+    for label, group_commit in (('commit per write', False),
+                                ('group commit', True)):
+        rate, batch = run(group_commit, int(requests), int(threads))
+        print(f'{label:>16}: {rate:8.1f} writes/s ({batch:.1f} per commit)')
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,200 @@
+# Load test of every flaskr route against a local waitress server.
+#
+# A temporary database is seeded with synthetic users and posts, the app is
+# served by waitress on a random local port, and each route is hit by
+# "concurrency" clients at once. The latency percentiles and the throughput of
+# each route are printed as JSON, so runs can be saved and compared.
+#
+#   python -m benchmarks.load --posts 10000 --concurrency 8 > run.json
+
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from waitress import create_server
+
+from benchmarks.common import PASSWORD_HASH, seed, temp_app
+
+class Client(object):
+    """
+        A minimal HTTP client keeping its connection and session cookie, so
+        each benchmark client behaves like a logged in browser
+    """
+    def __init__(self, port):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port)
+        self.cookie = None
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if data is not None:
+            body = urllib.parse.urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        response.read()
+
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+
+        if response.status >= 400:
+            raise RuntimeError(f'{method} {path}: {response.status}')
+        return response.status
+
+    def login(self, username):
+        self.request(
+            'POST', '/auth/login', {'username': username, 'password': 'test'}
+        )
+
+    def close(self):
+        self.connection.close()
+
+def owned_posts(client_number, users, posts):
+    """
+        Returns the ids of the posts written by the user of the client (see
+        "seed" in benchmarks/common.py)
+    """
+    return list(range(client_number + 1, posts + 1, users))
+
+# Each route is a function (client, client number, request number) making one
+# request. Clients log in as user0, user1, ... so they can update and delete
+# their own posts.
+def routes(args):
+    def index(client, n, i):
+        client.request('GET', '/')
+
+    def login(client, n, i):
+        client.login(f'user{n}')
+
+    def create(client, n, i):
+        client.request('POST', '/create', {'title': f'new {i}', 'body': 'body'})
+
+    def update(client, n, i):
+        id = owned_posts(n, args.users, args.posts)[i]
+        client.request(
+            'POST', f'/{id}/update', {'title': f'updated {i}', 'body': 'body'}
+        )
+
+    def delete(client, n, i):
+        # Deletes the posts from the end of the list, so they're not the ones
+        # just updated
+        id = owned_posts(n, args.users, args.posts)[-1 - i]
+        client.request('POST', f'/{id}/delete')
+
+    return {
+        '/': index,
+        '/auth/login': login,
+        '/create': create,
+        '/<id>/update': update,
+        '/<id>/delete': delete,
+    }
+
+def summary(latencies, elapsed):
+    """
+        Returns the latency percentiles (in milliseconds) and the throughput
+    """
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50': cuts[49] * 1000,
+        'p95': cuts[94] * 1000,
+        'p99': cuts[98] * 1000,
+        'max': max(latencies) * 1000,
+    }
+
+def run(route, port, args):
+    """
+        Runs "args.requests" requests per client, with "args.concurrency"
+        clients at once, returning the latencies and the time it all took
+    """
+    def client_run(n):
+        client = Client(port)
+        client.login(f'user{n}')
+        latencies = []
+        barrier.wait()
+
+        for i in range(args.requests):
+            start = time.perf_counter()
+            route(client, n, i)
+            latencies.append(time.perf_counter() - start)
+
+        client.close()
+        return latencies
+
+    # The clients log in first and only start together, so the logins aren't
+    # part of the measurement
+    barrier = threading.Barrier(args.concurrency + 1)
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        futures = [
+            executor.submit(client_run, n) for n in range(args.concurrency)
+        ]
+        barrier.wait()
+        start = time.perf_counter()
+        latencies = [latency for f in futures for latency in f.result()]
+
+    return latencies, time.perf_counter() - start
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=100,
+                        help='requests made by each client to each route')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='clients making requests at once')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='waitress worker threads')
+    parser.add_argument('--route', action='append',
+                        help='only run this route (may be repeated)')
+    args = parser.parse_args(argv)
+
+    if args.concurrency > args.users:
+        parser.error('--concurrency must not exceed --users')
+    # Each client needs a post of its own for every update and delete
+    if 2 * args.requests > args.posts // args.users:
+        parser.error('not enough posts per user for --requests')
+
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    all_routes = routes(args)
+    results = {}
+
+    config = {'PASSWORD_HASH_METHOD': PASSWORD_HASH.split('$')[0]}
+    with temp_app(**config) as app:
+        seed(app, users=args.users, posts=args.posts)
+        app.config['TESTING'] = False
+
+        # The server runs until the benchmark exits
+        server = create_server(app, host='127.0.0.1', port=0,
+                               threads=args.threads)
+        threading.Thread(target=server.run, daemon=True).start()
+
+        for name in args.route or all_routes:
+            latencies, elapsed = run(
+                all_routes[name], server.effective_port, args
+            )
+            results[name] = summary(latencies, elapsed)
+
+    print(json.dumps({
+        'config': {
+            name: getattr(args, name)
+            for name in ('users', 'posts', 'requests', 'concurrency', 'threads')
+        },
+        'routes': results,
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
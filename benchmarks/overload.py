@@ -0,0 +1,101 @@
+# Measures the latency of the index while a flood of logins (each hashing a
+# password) hits a local waitress server, with and without the admission
+# control (see flaskr/admission.py). The shed requests are counted apart.
+#
+#   python -m benchmarks.overload [seconds] [login clients] [index clients]
+
+import logging
+import statistics
+import sys
+import threading
+import time
+
+from waitress import create_server
+
+from benchmarks.common import seed, temp_app
+from benchmarks.load import Client
+
+# The server's threads, as in app.yaml
+THREADS = 16
+
+def flood(port, path, data, stop, results):
+    """
+        Sends requests until "stop" is set, appending (status, seconds) to
+        the results
+    """
+    client = Client(port)
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            status = client.request('POST' if data else 'GET', path, data)
+        except RuntimeError as e:
+            status = int(str(e).rsplit(' ', 1)[1])
+        results.append((status, time.perf_counter() - start))
+    client.close()
+
+def measure(app, seconds, logins, readers):
+    server = create_server(app, host='127.0.0.1', port=0, threads=THREADS)
+    serving = threading.Thread(target=server.run, daemon=True)
+    serving.start()
+
+    stop = threading.Event()
+    login_results, index_results = [], []
+    threads = [
+        threading.Thread(target=flood, args=(
+            server.effective_port, '/auth/login',
+            {'username': f'user{i % 10}', 'password': 'wrong'},
+            stop, login_results
+        ))
+        for i in range(logins)
+    ] + [
+        threading.Thread(target=flood, args=(
+            server.effective_port, '/', None, stop, index_results
+        ))
+        for _ in range(readers)
+    ]
+
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    server.close()
+
+    return login_results, index_results
+
+def describe(label, results):
+    served = sorted(t for status, t in results if status != 503)
+    shed = sum(1 for status, _ in results if status == 503)
+    p50 = statistics.median(served) * 1000 if served else 0
+    p99 = served[int(len(served) * 0.99)] * 1000 if served else 0
+    print(
+        f'{label:>22}: {len(served):>6} served (p50 {p50:7.1f}ms,'
+        f' p99 {p99:7.1f}ms), {shed:>6} shed'
+    )
+
+def main(seconds=10, logins=40, readers=4):
+    # waitress warns about its queue on every request of the flood (and about
+    # the requests still running when it's closed)
+    logging.getLogger('waitress').setLevel(logging.CRITICAL)
+
+    for admission in (False, True):
+        config = {
+            'SLOW_QUERY_MS': None,
+            # Each login checks a pbkdf2 hash of 50000 iterations (see
+            # benchmarks/common.py) on the hashing processes
+            'PASSWORD_HASH_QUEUE': 64,
+        }
+
+        with temp_app(admission, **config) as app:
+            seed(app, users=10, posts=1000)
+            login_results, index_results = measure(
+                app, float(seconds), int(logins), int(readers)
+            )
+
+        print(f'admission control {"on" if admission else "off"}:')
+        describe('index', index_results)
+        describe('login', login_results)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
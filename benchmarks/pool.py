@@ -0,0 +1,34 @@
+# Measures the requests/sec of the index route with the connection pool
+# disabled (a new connection per request) and enabled.
+#
+#   python -m benchmarks.pool [requests] [threads]
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import requests_per_second, seed, temp_app
+
+def run(pool_size, requests, threads):
+    with temp_app(DATABASE_POOL_SIZE=pool_size) as app:
+        seed(app)
+
+        # Each thread has its own test client, like waitress threads serving
+        # different connections
+        def worker(_):
+            client = app.test_client()
+            for _ in range(requests):
+                client.get('/')
+
+        def all_threads():
+            with ThreadPoolExecutor(threads) as executor:
+                list(executor.map(worker, range(threads)))
+
+        return requests_per_second(all_threads, 1) * requests * threads
+
+def main(requests=500, threads=4):
+    for label, pool_size in (('no pool', 0), (f'pool of {threads}', threads)):
+        rate = run(pool_size, requests, threads)
+        print(f'{label:>12}: {rate:8.1f} requests/sec')
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,81 @@
+# Measures the cold start of the app: importing "flaskr", creating the app and
+# serving the first request to the index. Each run is a new python process,
+# so nothing is already imported or compiled, except the templates found in
+# the bytecode cache (see flaskr/templating.py). Runs without the cache, with
+# a cache filled by "flask precompile-templates", and with the cache and
+# "PRECOMPILE_TEMPLATES".
+#
+#   python -m benchmarks.startup [runs]
+
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.common import temp_app
+from flaskr.templating import precompile
+
+# Runs in the new process, printing the time of each step (in seconds)
+SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import flaskr
+imported = time.perf_counter()
+app = flaskr.create_app({'DATABASE': sys.argv[1], **json.loads(sys.argv[2])})
+created = time.perf_counter()
+app.test_client().get('/')
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'create_app': created - imported,
+    'first_request': served - created,
+}))
+'''
+
+def measure(database, runs, **config):
+    """
+        Returns the median time of each step over the runs
+    """
+    runs = [
+        json.loads(subprocess.run(
+            [sys.executable, '-c', SCRIPT, database, json.dumps(config)],
+            check=True, capture_output=True, text=True
+        ).stdout)
+        for _ in range(runs)
+    ]
+
+    return {
+        step: statistics.median(run[step] for run in runs) for step in runs[0]
+    }
+
+def main(runs=10):
+    with tempfile.TemporaryDirectory() as cache, \
+            temp_app(TEMPLATE_CACHE_DIR=cache) as app:
+        database = app.config['DATABASE']
+
+        # Fills the cache, like "flask precompile-templates"
+        precompile(app)
+
+        results = {
+            'no cache': measure(database, int(runs), TEMPLATE_CACHE_DIR=None),
+            'bytecode cache': measure(
+                database, int(runs), TEMPLATE_CACHE_DIR=cache
+            ),
+            'precompiled': measure(
+                database, int(runs), TEMPLATE_CACHE_DIR=cache,
+                PRECOMPILE_TEMPLATES=True
+            ),
+        }
+
+    steps = list(results['no cache'])
+    print(f'{"":>15}' + ''.join(f'{step:>15}' for step in steps) + f'{"total":>15}')
+    for label, medians in results.items():
+        print(
+            f'{label:>15}'
+            + ''.join(f'{medians[step] * 1000:>13.1f}ms' for step in steps)
+            + f'{sum(medians.values()) * 1000:>13.1f}ms'
+        )
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,64 @@
+# Measures the time to the first byte, the total time and the peak memory of
+# an index page with more and more posts, rendered whole and streamed (see
+# "STREAM_INDEX").
+#
+#   python -m benchmarks.streaming [posts per page...]
+
+import sys
+import time
+import tracemalloc
+
+from benchmarks.common import seed, temp_app
+
+def measure(app, requests=5):
+    """
+        Returns the median time to the first byte, the median total time and
+        the highest peak of memory allocated during a request to the index
+    """
+    client = app.test_client()
+    # Warms up the connections and the templates
+    client.get('/').close()
+
+    ttfbs, totals, peaks = [], [], []
+    for _ in range(requests):
+        tracemalloc.start()
+        start = time.perf_counter()
+
+        # "buffered=False" hands the body over as it's produced
+        response = client.get('/', buffered=False)
+        chunks = iter(response.response)
+        next(chunks)
+        ttfbs.append(time.perf_counter() - start)
+        for _ in chunks:
+            pass
+        response.close()
+        totals.append(time.perf_counter() - start)
+
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return (
+        sorted(ttfbs)[len(ttfbs) // 2], sorted(totals)[len(totals) // 2],
+        max(peaks)
+    )
+
+def main(*sizes):
+    sizes = sizes or (10, 100, 1000, 10000)
+
+    # The page cache would skip the rendering after the first request
+    with temp_app(PAGE_CACHE_SIZE=0, SLOW_QUERY_MS=None) as app:
+        seed(app, posts=max(sizes) + 1)
+
+        print(f'{"posts":>6} {"mode":>9} {"ttfb":>10} {"total":>10} {"peak":>10}')
+        for size in sizes:
+            app.config['POSTS_PER_PAGE'] = size
+            for mode in ('rendered', 'streamed'):
+                app.config['STREAM_INDEX'] = mode == 'streamed'
+                ttfb, total, peak = measure(app)
+                print(
+                    f'{size:>6} {mode:>9} {ttfb * 1000:>8.2f}ms'
+                    f' {total * 1000:>8.2f}ms {peak / 1024:>8.0f}KB'
+                )
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
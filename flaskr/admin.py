@@ -0,0 +1,32 @@
+import functools
+
+from flask import Blueprint, current_app, g, jsonify, redirect, url_for
+from werkzeug.exceptions import abort
+
+from flaskr.queries import get_stats
+
+# Creates a blueprint named "admin", for pages only shown to the users listed
+# in the "ADMIN_USERS" config
+bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+# Works like "login_required" (see flaskr/auth.py), also checking that the
+# logged in user is an admin
+def admin_required(view):
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        if not g.user:
+            return redirect(url_for('auth.login'))
+
+        if g.user['username'] not in current_app.config['ADMIN_USERS']:
+            abort(403)
+
+        return view(**kwargs)
+
+    return wrapped_view
+
+# The stats of every SQL statement run since the app started (see
+# flaskr/queries.py), the statements taking the most time first
+@bp.route('/queries')
+@admin_required
+def queries():
+    return jsonify(queries=get_stats().summary())
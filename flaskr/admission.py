@@ -0,0 +1,192 @@
+# waitress runs the requests on a fixed pool of threads, and queues the
+# others until a thread is free. A burst of slow requests (logins hashing
+# passwords, big index pages...) can take every thread, so that even the
+# cheapest requests wait behind them until they time out.
+#
+# "AdmissionControl" is a WSGI middleware deciding, before a request runs,
+# whether it's worth running. The requests are sorted into classes (see
+# "ADMISSION_CLASSES"), e.g.:
+#   - "read": GET requests, cheap and most of the traffic;
+#   - "write": the other ones (creating, updating, deleting posts);
+#   - "auth": logins and registrations, which hash passwords.
+#
+# Each class runs at most "limit" requests at once. Up to "queue" more wait
+# for one of them to finish, for at most "timeout" seconds. Anything else is
+# answered right away with "503 Service Unavailable" and a "Retry-After"
+# header: failing fast keeps the threads for the requests that can still be
+# served in time.
+#
+# The classes come in order of priority: while requests of a class are
+# waiting, the classes after it are neither admitted nor queued, so cheap
+# reads are served before any more expensive auth work is started.
+
+import math
+import threading
+import time
+
+from werkzeug.exceptions import HTTPException, ServiceUnavailable
+from werkzeug.wsgi import ClosingIterator
+
+# Never limited, so the monitoring still works when the app is overloaded
+EXEMPT_ENDPOINTS = ('static', 'metrics')
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+class Overloaded(ServiceUnavailable):
+    description = 'The server is busy, please try again shortly.'
+
+class RequestClass(object):
+    """
+        The limits and the current counts of a class of requests
+    """
+    def __init__(self, name, limit, queue=0, timeout=0.0):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        # Requests running, waiting for a slot and answered with a 503
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+
+    @property
+    def retry_after(self):
+        # Seconds (at least one) a client should wait before trying again
+        return max(1, math.ceil(self.timeout))
+
+class AdmissionControl(object):
+    def __init__(self, wsgi_app, url_map, classes, endpoints=None):
+        self.wsgi_app = wsgi_app
+        self.url_map = url_map
+        # {name: {"limit": ..., "queue": ..., "timeout": ...}}, in order of
+        # priority
+        self.classes = {
+            name: RequestClass(name, **limits)
+            for name, limits in classes.items()
+        }
+        self.priorities = list(self.classes)
+        # The class of the writes to each endpoint ("write" by default)
+        self.endpoints = endpoints or {}
+        self._condition = threading.Condition()
+
+    def classify(self, environ):
+        """
+            Returns the name of the class of the request, or None if it's
+            never limited
+        """
+        try:
+            endpoint, _ = self.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            # Not found, redirects...: answered right away by Flask
+            endpoint = None
+
+        if endpoint in EXEMPT_ENDPOINTS:
+            return None
+
+        if environ['REQUEST_METHOD'] in READ_METHODS:
+            return 'read'
+
+        return self.endpoints.get(endpoint, 'write')
+
+    def _outranked(self, request_class):
+        # True while requests of a class with a higher priority are waiting
+        index = self.priorities.index(request_class.name)
+        return any(
+            self.classes[name].waiting for name in self.priorities[:index]
+        )
+
+    def admit(self, name):
+        """
+            Takes a slot of the class, waiting for one if needed. Returns
+            False if the request must be shed.
+        """
+        request_class = self.classes[name]
+        deadline = time.monotonic() + request_class.timeout
+
+        with self._condition:
+            def blocked():
+                return (
+                    request_class.in_flight >= request_class.limit
+                    or self._outranked(request_class)
+                )
+
+            if blocked():
+                if request_class.waiting >= request_class.queue:
+                    request_class.shed += 1
+                    return False
+
+                request_class.waiting += 1
+                try:
+                    while blocked():
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            request_class.shed += 1
+                            return False
+                        self._condition.wait(remaining)
+                finally:
+                    request_class.waiting -= 1
+                    # A lower class may be able to go now
+                    self._condition.notify_all()
+
+            request_class.in_flight += 1
+            return True
+
+    def release(self, name):
+        with self._condition:
+            self.classes[name].in_flight -= 1
+            self._condition.notify_all()
+
+    def stats(self):
+        """
+            Returns the counts of each class of requests
+        """
+        with self._condition:
+            return {
+                name: {
+                    'in_flight': request_class.in_flight,
+                    'waiting': request_class.waiting,
+                    'shed': request_class.shed,
+                }
+                for name, request_class in self.classes.items()
+            }
+
+    def __call__(self, environ, start_response):
+        name = self.classify(environ)
+
+        if name is None or name not in self.classes:
+            return self.wsgi_app(environ, start_response)
+
+        if not self.admit(name):
+            error = Overloaded(retry_after=self.classes[name].retry_after)
+            return error(environ, start_response)
+
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self.release(name)
+            raise
+
+        # The slot is only given back once the whole response is sent (e.g.
+        # a streamed index page), when the server closes the response
+        return ClosingIterator(app_iter, lambda: self.release(name))
+
+def get_admission(app):
+    """
+        Returns the admission control of the app, or None
+    """
+    return app.extensions.get('flaskr.admission')
+
+def init_app(app):
+    """
+        Wraps the app in the admission control, unless "ADMISSION_CLASSES"
+        is None
+    """
+    if app.config['ADMISSION_CLASSES'] is None:
+        return
+
+    admission = AdmissionControl(
+        app.wsgi_app, app.url_map,
+        app.config['ADMISSION_CLASSES'], app.config['ADMISSION_ENDPOINTS']
+    )
+    app.wsgi_app = admission
+    app.extensions['flaskr.admission'] = admission
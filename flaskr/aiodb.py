@@ -0,0 +1,242 @@
+# The async counterpart of flaskr/db.py, used by the async views (see
+# flaskr/aioviews.py) when the app is served through ASGI.
+#
+# Each aiosqlite connection runs its queries on a thread of its own, so
+# awaiting a query doesn't block the event loop serving the other requests.
+# The connections are opened by "flaskr.db.connect" (same pragmas, row factory
+# and read-only mode) and kept in pools, like the sync ones: a request checks
+# one out on its first query ("get_db") and gives it back when it ends
+# ("close_db").
+#
+# aiosqlite is an optional dependency: "pip install flaskr[async]".
+
+import asyncio
+import collections
+import functools
+import time
+
+import aiosqlite
+from flask import current_app, g
+
+from flaskr.db import PoolTimeout, connect, get_pragmas, reads_from_primary
+from flaskr.queries import log_slow_query
+from flaskr.repositories import AsyncPostRepository, AsyncUserRepository
+
+# Rows fetched from the connection's thread at a time when iterating a cursor
+ITER_CHUNK_SIZE = 64
+
+# The pool lives on the event loop's thread, which is the only one using it,
+# so it needs no lock: the requests waiting for a connection wait on futures,
+# given a connection in turn as the others are released.
+class AsyncConnectionPool(object):
+    def __init__(self, database, size=5, timeout=10.0, pragmas=None,
+                 readonly=False):
+        self.database = database
+        self.pragmas = pragmas
+        self.readonly = readonly
+        self.size = size
+        self.timeout = timeout
+        # How many connections the pool opened (idle or checked out)
+        self.open = 0
+        self._idle = []
+        # The futures of the requests waiting for a connection, oldest first
+        self._waiters = collections.deque()
+        self._closed = False
+
+    async def acquire(self):
+        """
+            Checks out a connection, opening a new one if all of them are
+            taken and the pool is not full yet.
+
+            Raises PoolTimeout if the pool stays full for "timeout" seconds.
+        """
+        if self._idle:
+            return self._idle.pop()
+
+        if self.open < self.size:
+            self.open += 1
+            try:
+                return await aiosqlite.Connection(
+                    functools.partial(
+                        connect, self.database, self.pragmas,
+                        readonly=self.readonly
+                    ),
+                    ITER_CHUNK_SIZE
+                )
+            except BaseException:
+                self.open -= 1
+                raise
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            async with asyncio.timeout(self.timeout):
+                return await waiter
+        except TimeoutError:
+            # A connection given just as the time ran out isn't lost
+            if waiter.done() and not waiter.cancelled():
+                return waiter.result()
+            raise PoolTimeout(
+                f"No database connection available after {self.timeout}s."
+            )
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self, db):
+        """
+            Returns a connection to the pool, or to the oldest request waiting
+            for one
+        """
+        if self._closed:
+            self.open -= 1
+            asyncio.ensure_future(db.close())
+            return
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(db)
+                return
+
+        self._idle.append(db)
+
+    def stats(self):
+        """
+            Returns how many connections are open, checked out and idle
+        """
+        return {
+            'open': self.open,
+            'in_use': self.open - len(self._idle),
+            'idle': len(self._idle),
+        }
+
+    async def close(self):
+        """
+            Closes every idle connection, and the checked out ones as they're
+            given back
+        """
+        self._closed = True
+        idle, self._idle = self._idle, []
+        self.open -= len(idle)
+
+        for db in idle:
+            await db.close()
+
+def get_pool(readonly, app=None):
+    """
+        Returns the app's async pool of read-only or primary connections,
+        creating it on first use
+    """
+    if app is None:
+        app = current_app._get_current_object()
+
+    pools = app.extensions.setdefault('flaskr.aiodb.pools', {})
+    pool = pools.get(readonly)
+
+    # Only the event loop's thread creates the pools, so there is no race
+    if pool is None:
+        pool = pools[readonly] = AsyncConnectionPool(
+            app.config['DATABASE'],
+            # A pool can't be disabled here, as each connection comes with a
+            # thread (see "DATABASE_POOL_SIZE")
+            size=app.config['DATABASE_POOL_SIZE'] or 1,
+            timeout=app.config['DATABASE_POOL_TIMEOUT'],
+            pragmas=get_pragmas(app.config['DATABASE_PRAGMAS']),
+            readonly=readonly
+        )
+
+    return pool
+
+async def close_pools(app):
+    """
+        Closes the connections kept by the app's async pools, if any
+    """
+    pools = app.extensions.pop('flaskr.aiodb.pools', {})
+
+    for pool in pools.values():
+        await pool.close()
+
+async def get_db(primary=False):
+    """
+        Returns the async db connection of the request: a read-only one for
+        GET requests (see "flaskr.db.get_read_db"), unless "primary".
+
+        If it doesn't exist, checks a connection out of the pool and returns
+        it.
+    """
+    readonly = not (primary or reads_from_primary())
+    name = 'aiodb_readonly' if readonly else 'aiodb'
+
+    if name not in g:
+        pool = get_pool(readonly)
+        db = await pool.acquire()
+        # The pool is remembered with the connection, to give it back
+        setattr(g, name, (db, pool))
+
+    return getattr(g, name)[0]
+
+def close_db(e=None):
+    """
+        Gives the request's async connections back to their pools
+    """
+    for name in ('aiodb_readonly', 'aiodb'):
+        checked_out = g.pop(name, None)
+        if checked_out is not None:
+            db, pool = checked_out
+            pool.release(db)
+
+# The async counterpart of "flaskr.backends.SQLiteBackend", which the async
+# repositories (see flaskr/repositories.py) run their queries on. Only reads
+# are supported: the async views don't write.
+class AsyncSQLiteBackend(object):
+    name = 'sqlite'
+
+    async def fetchall(self, sql, params=(), primary=False):
+        """
+            Executes a query and returns its rows. Unless "primary", GET
+            requests run it on a read-only connection.
+        """
+        db = await get_db(primary)
+
+        start = time.perf_counter()
+        rows = await db.execute_fetchall(sql, params)
+        elapsed = time.perf_counter() - start
+
+        # The query runs on the connection's thread, which has no app
+        # context, so it's recorded here (see flaskr/queries.py). The time
+        # includes the hops to that thread and back.
+        g.setdefault('queries', []).append((sql, elapsed))
+
+        # The query plan would be read on the event loop's thread, so slow
+        # queries are logged without it
+        threshold = current_app.config['SLOW_QUERY_MS']
+        if threshold is not None and elapsed * 1000 >= threshold:
+            log_slow_query(None, sql, None, elapsed)
+
+        return rows
+
+    async def fetchone(self, sql, params=(), primary=False):
+        """
+            Executes a query and returns its first row, or None
+        """
+        rows = await self.fetchall(sql, params, primary)
+        return rows[0] if rows else None
+
+def get_posts():
+    """
+        Returns the async posts repository
+    """
+    return AsyncPostRepository(AsyncSQLiteBackend())
+
+def get_users():
+    """
+        Returns the async users repository
+    """
+    return AsyncUserRepository(AsyncSQLiteBackend())
+
+def init_app(app):
+    """
+        Registers the close_db function to an app
+    """
+    app.teardown_appcontext(close_db)
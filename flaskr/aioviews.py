@@ -0,0 +1,220 @@
+# Async versions of the blog's read views, which are most of the traffic, and
+# the ASGI app serving them (see flaskr/asgi.py).
+#
+# When the app is served through WSGI, each request holds one of the server's
+# threads until it's answered, including while it waits for the database. The
+# ASGI app ("AsyncViews") runs the async views on the event loop instead:
+# their queries are awaited on aiosqlite's threads (see flaskr/aiodb.py), so a
+# single thread serves any number of these requests at once, and a slow client
+# doesn't hold a thread either (the server sends the response).
+#
+# The views do the same as "index" and "detail" in flaskr/blog.py, and reuse
+# all of their non-db code (the page cache, the ETags...). Everything else
+# (the writes, the auth views, the admin...) is still served by the sync
+# views, on a pool of "ASGI_THREADS" threads, like under waitress.
+
+import asyncio
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import Body, build_environ
+from flask import current_app, g, render_template, request, session
+from werkzeug.exceptions import HTTPException
+
+from flaskr import aiodb
+from flaskr.blog import (
+    cached_index_page, check_post, decode_cursors, index_etag, post_etag,
+    render_index_page, split_page, validated_response
+)
+from flaskr.cache import get_user_cache
+from flaskr.responses import is_cacheable, not_modified
+
+async def get_user(user_id):
+    """
+        The async version of "flaskr.auth.get_user"
+    """
+    cache = get_user_cache()
+
+    user = cache.get(user_id) if cache is not None else None
+
+    if user is None:
+        user = await aiodb.get_users().get(user_id)
+
+        if user is None:
+            return None
+
+        user = dict(user)
+        if cache is not None:
+            cache.set(user_id, user)
+
+    return user
+
+async def load_user():
+    """
+        Loads the logged in user before a page is rendered.
+
+        "flaskr.auth.load_logged_in_user" makes "g.user" load the user on
+        first use, which would block the event loop on a sync query.
+    """
+    user_id = session.get('user_id')
+    g.user = await get_user(user_id) if user_id is not None else None
+
+async def index():
+    # The same as "flaskr.blog.index", except that pages are always rendered
+    # whole ("STREAM_INDEX" is a way to send large pages to slow clients
+    # without holding their thread longer, which these views don't need)
+    posts = aiodb.get_posts()
+
+    state = await posts.get_state()
+    version, modified = state['version'], state['modified']
+    etag = index_etag(version)
+    response = not_modified(etag, modified)
+    if response is not None:
+        return response
+
+    cacheable = is_cacheable()
+    page = cached_index_page(version)
+
+    if page is None:
+        before = request.args.get('before')
+        after = request.args.get('after')
+        per_page = current_app.config['POSTS_PER_PAGE']
+
+        # See "flaskr.blog.get_posts_page"
+        rows = await posts.page(
+            *decode_cursors(before, after), limit=per_page + 1
+        )
+
+        await load_user()
+        page = render_index_page(
+            *split_page(rows, per_page, before, after), version=version
+        )
+
+    return validated_response(page, cacheable, etag, modified)
+
+async def detail(id):
+    posts = aiodb.get_posts()
+
+    updated = await posts.get_updated(id)
+    updated = check_post(updated, id, check_author=False)['updated']
+
+    etag = post_etag(id, updated)
+    response = not_modified(etag, updated)
+    if response is not None:
+        return response
+
+    cacheable = is_cacheable()
+    post = check_post(await posts.get(id), id, check_author=False)
+
+    await load_user()
+    page = render_template('blog/detail.html', post=post)
+    return validated_response(page, cacheable, etag, updated)
+
+# The async views, by the endpoint of the sync views they replace
+VIEWS = {
+    'blog.index': index,
+    'blog.detail': detail,
+}
+
+class AsyncViews(object):
+    """
+        An ASGI app serving the GET requests to the async views on the event
+        loop, and every other request through the WSGI app
+    """
+    def __init__(self, app, views=VIEWS):
+        self.app = app
+        self.views = views
+        self.wsgi = WSGIMiddleware(app, workers=app.config['ASGI_THREADS'])
+        aiodb.init_app(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        if scope['type'] == 'http' and self.is_async(scope):
+            environ = build_environ(
+                scope, Body(asyncio.get_running_loop(), receive)
+            )
+            view = self.match(environ)
+            if view is not None:
+                return await self.dispatch(environ, view, send)
+
+        # The body isn't read until the WSGI app reads it
+        return await self.wsgi(scope, receive, send)
+
+    def is_async(self, scope):
+        # Only the sqlite backend has an async counterpart. The replica's
+        # copies are made while the readers wait (see "flaskr.db.Replica"),
+        # which would block the event loop, so its reads stay sync too.
+        config = self.app.config
+        return (
+            scope['method'] == 'GET' and
+            config['DATABASE_BACKEND'] == 'sqlite' and
+            config['DATABASE_READS'] != 'replica'
+        )
+
+    def match(self, environ):
+        """
+            Returns the async view of the request, or None
+        """
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            # Not found, redirected... as answered by the WSGI app
+            return None
+
+        return self.views.get(endpoint)
+
+    async def dispatch(self, environ, view, send):
+        # What "Flask.wsgi_app" and "Flask.full_dispatch_request" do, except
+        # that the view is awaited. The request context lives in the task
+        # serving the request, so each request sees its own "g", "session"...
+        app = self.app
+        ctx = app.request_context(environ)
+        error = None
+
+        try:
+            try:
+                ctx.push()
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await view(**request.view_args)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                error = e
+                response = app.handle_exception(e)
+            except BaseException as e:
+                error = e
+                raise
+        finally:
+            # Gives the connections back before the response is sent
+            ctx.pop(error)
+
+        body, status, headers = response.get_wsgi_response(environ)
+
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ],
+        })
+        try:
+            await send({'type': 'http.response.body', 'body': b''.join(body)})
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await aiodb.close_pools(self.app)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
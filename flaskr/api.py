@@ -0,0 +1,145 @@
+# A JSON API of the posts, for clients that only need the data (e.g. the
+# mobile app), without rendering the templates.
+#
+#   GET /api/posts                     the newest posts
+#   GET /api/posts?before=<cursor>     older posts (the "older" cursor)
+#   GET /api/posts?after=<cursor>      newer posts (the "newer" cursor)
+#   GET /api/posts?ids=1,2,3           the posts with these ids
+#
+# "limit" sets the number of posts of a page (up to "API_MAX_POSTS") and
+# "fields" the fields of each post (e.g. "fields=id,title" leaves the bodies
+# out, which aren't even read from the database then).
+#
+# The pages are read with the same keyset pagination as the index (see
+# blog.py), and a batch of ids with a single query. Responses are compact
+# JSON, gzipped when they're big enough (see "compress_response" in
+# responses.py), and answer conditional requests like the index does.
+
+from flask import Blueprint, current_app, request
+from werkzeug.exceptions import HTTPException, abort
+
+from flaskr.blog import get_blog_state, get_posts_page, page_cursors
+from flaskr.repositories import POST_COLUMNS, get_posts
+from flaskr.responses import not_modified, set_validators
+
+bp = Blueprint('api', __name__, url_prefix='/api')
+
+def json_response(data, status=200):
+    """
+        Returns a response with the data as JSON, without any whitespace
+    """
+    return current_app.response_class(
+        current_app.json.dumps(data, separators=(',', ':')),
+        status=status,
+        mimetype='application/json'
+    )
+
+# Errors are answered in JSON too, instead of the HTML error pages
+@bp.errorhandler(HTTPException)
+def handle_error(error):
+    return json_response({'error': error.description}, error.code)
+
+def parse_fields():
+    """
+        Returns the fields requested by the "fields" argument (every field
+        of POST_COLUMNS without it).
+
+        Aborts with 400 if a field doesn't exist.
+    """
+    fields = request.args.get('fields')
+    if fields is None:
+        return list(POST_COLUMNS)
+
+    fields = [field for field in fields.split(',') if field]
+    unknown = [field for field in fields if field not in POST_COLUMNS]
+
+    if unknown or not fields:
+        abort(400, f"Invalid fields {','.join(unknown)}.")
+
+    return query_fields(fields)
+
+def query_fields(*fields):
+    """
+        Returns the given fields once each, in the order of POST_COLUMNS.
+
+        However the client orders (or repeats) them, the same fields always
+        make the same SQL, so the query stats (see flaskr/queries.py) have
+        one entry for them.
+    """
+    wanted = {field for names in fields for field in names}
+    return [field for field in POST_COLUMNS if field in wanted]
+
+def parse_ids(ids):
+    """
+        Returns the list of ids of the "ids" argument, without duplicates.
+
+        Aborts with 400 if an id isn't a number or there are more than
+        "API_MAX_POSTS" of them.
+    """
+    ids = [id for id in ids.split(',') if id]
+
+    if not ids or not all(id.isdigit() for id in ids):
+        abort(400, f"Invalid ids {','.join(ids)}.")
+
+    if len(ids) > current_app.config['API_MAX_POSTS']:
+        abort(400, f"At most {current_app.config['API_MAX_POSTS']} ids.")
+
+    return list(dict.fromkeys(int(id) for id in ids))
+
+def serialize_post(post, fields):
+    """
+        Returns a dict with the fields of the post, and its times in ISO 8601
+    """
+    return {
+        field: post[field].isoformat(' ') if field == 'created'
+        else post[field]
+        for field in fields
+    }
+
+@bp.route('/posts')
+def posts():
+    fields = parse_fields()
+
+    # Like the index, the posts version answers conditional requests before
+    # any post is read
+    version, modified = get_blog_state()
+    etag = f'api-posts-{version}'
+    response = not_modified(etag, modified)
+    if response is not None:
+        return response
+
+    ids = request.args.get('ids')
+
+    if ids is not None:
+        ids = parse_ids(ids)
+        # "id" is always read, to put the posts in the order of the ids
+        posts = get_posts().get_many(
+            ids, fields=query_fields(['id'], fields)
+        )
+        found = {post['id'] for post in posts}
+        data = {
+            'posts': [serialize_post(post, fields) for post in posts],
+            'missing': [id for id in ids if id not in found],
+        }
+    else:
+        limit = request.args.get(
+            'limit', current_app.config['POSTS_PER_PAGE'], type=int
+        )
+        if not 1 <= limit <= current_app.config['API_MAX_POSTS']:
+            abort(400, f"Invalid limit {limit}.")
+
+        # "id" and "created" are always read, for the cursors
+        posts, has_older, has_newer, _ = get_posts_page(
+            before=request.args.get('before'),
+            after=request.args.get('after'),
+            per_page=limit,
+            fields=query_fields(['id', 'created'], fields)
+        )
+        older, newer = page_cursors(posts, has_older, has_newer)
+        data = {
+            'posts': [serialize_post(post, fields) for post in posts],
+            'older': older,
+            'newer': newer,
+        }
+
+    return set_validators(json_response(data), etag, modified)
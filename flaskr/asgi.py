@@ -0,0 +1,14 @@
+# The ASGI entry point, an alternative to the WSGI one (flaskr/wsgi.py), e.g.:
+#
+#   uvicorn flaskr.asgi:app
+#
+# The GET requests to the blog's index and posts are served by async views on
+# the event loop, the others by the sync views on a pool of threads (see
+# flaskr/aioviews.py).
+#
+# Needs the optional dependencies: "pip install flaskr[async] uvicorn".
+
+from flaskr import create_app
+from flaskr.aioviews import AsyncViews
+
+app = AsyncViews(create_app())
@@ -0,0 +1,222 @@
+# Flask's "static" view serves the files of flaskr/static with a short cache
+# lifetime, so browsers revalidate the stylesheet on every page they show.
+#
+# Instead, each static file is given a "fingerprinted" URL, with a hash of its
+# content (e.g. "/static/style.3b9f1c0a2d4e.css"), computed when the app is
+# created. As the URL changes whenever the file changes, browsers can keep the
+# file forever ("Cache-Control: immutable") and never ask for it again.
+# "url_for('static', filename='style.css')" returns the fingerprinted URL (see
+# "fingerprint_url"), so the templates don't change.
+#
+# "flask build-assets" writes gzip (and, if the "brotli" package is installed,
+# brotli) compressed copies of the files to "ASSETS_DIR", which are served to
+# the browsers accepting them, so the files aren't compressed on each request.
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+import click
+from flask import current_app, request, send_file
+from flask.cli import with_appcontext
+from werkzeug.exceptions import abort
+
+# Optional: "pip install flaskr[brotli]"
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Browsers keep the fingerprinted files for a year (the longest lifetime
+# HTTP caches are expected to honour)
+MAX_AGE = 365 * 24 * 60 * 60
+
+# A fingerprint that isn't the current one comes from a page rendered before
+# the file changed (e.g. still cached by a browser). The current file is
+# served instead, only cached briefly as it's not what the URL names.
+STALE_MAX_AGE = 5 * 60
+
+# The compressed copies, by the "Content-Encoding" they're served with, in
+# order of preference (brotli files are smaller)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Images and fonts are already compressed
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'image/svg+xml')
+
+class Manifest(object):
+    """
+        The fingerprinted name of every static file, and the other way around
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.fingerprints = {}
+        self.filenames = {}
+
+        for root, _, files in os.walk(folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, folder).replace(os.sep, '/')
+                fingerprinted = fingerprint(filename, file_digest(path))
+
+                self.fingerprints[filename] = fingerprinted
+                self.filenames[fingerprinted] = filename
+
+def file_digest(path):
+    """
+        Returns the first 12 hex digits of the sha256 of the file
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+def fingerprint(filename, digest):
+    """
+        Returns the filename with the digest before its extension
+    """
+    root, extension = os.path.splitext(filename)
+    return f'{root}.{digest}{extension}'
+
+def strip_fingerprint(filename):
+    """
+        Returns the filename without its fingerprint, or None if it has none
+    """
+    root, extension = os.path.splitext(filename)
+    root, dot, digest = root.rpartition('.')
+    if not dot or len(digest) != 12:
+        return None
+    try:
+        int(digest, 16)
+    except ValueError:
+        return None
+    return root + extension
+
+def is_compressible(filename):
+    mimetype = mimetypes.guess_type(filename)[0] or ''
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+def get_manifest(app=None):
+    if app is None:
+        app = current_app
+    return app.extensions['flaskr.assets']
+
+def build_assets(app):
+    """
+        Writes the compressed copies of the static files to "ASSETS_DIR" and
+        returns the (filename, size, {extension: compressed size}) of each
+    """
+    manifest = get_manifest(app)
+    directory = app.config['ASSETS_DIR']
+    built = []
+
+    for filename, fingerprinted in sorted(manifest.fingerprints.items()):
+        if not is_compressible(filename):
+            continue
+
+        with open(os.path.join(manifest.folder, filename), 'rb') as f:
+            data = f.read()
+
+        variants = {'.gz': gzip.compress(data, compresslevel=9)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(data, quality=11)
+
+        path = os.path.join(directory, fingerprinted)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for extension, compressed in variants.items():
+            with open(path + extension, 'wb') as f:
+                f.write(compressed)
+
+        built.append((filename, len(data), {
+            extension: len(compressed)
+            for extension, compressed in variants.items()
+        }))
+
+    return built
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """
+        Write the compressed copies of the static files.
+    """
+    for filename, size, variants in build_assets(current_app):
+        sizes = ', '.join(
+            f'{extension} {compressed} bytes'
+            for extension, compressed in variants.items()
+        )
+        click.echo(f'{filename}: {size} bytes, {sizes}')
+
+    if brotli is None:
+        click.echo('brotli is not installed, only gzip copies were written.')
+
+def fingerprint_url(endpoint, values):
+    """
+        Replaces the filename of the static URLs by its fingerprinted name
+    """
+    if endpoint == 'static':
+        filename = values.get('filename')
+        values['filename'] = get_manifest().fingerprints.get(filename, filename)
+
+def send_static_file(filename):
+    """
+        Serves the fingerprinted static files (compressed if possible) for a
+        year, and the other ones as Flask does
+    """
+    manifest = get_manifest()
+    original = manifest.filenames.get(filename)
+    max_age = MAX_AGE
+
+    if original is None:
+        original = strip_fingerprint(filename)
+        if filename in manifest.fingerprints or original is None:
+            return current_app.send_static_file(filename)
+
+        # An outdated fingerprint of a file that still exists
+        filename = manifest.fingerprints.get(original)
+        if filename is None:
+            abort(404)
+        max_age = STALE_MAX_AGE
+
+    path = os.path.join(manifest.folder, original)
+    encoding = None
+
+    for accepted, extension in ENCODINGS:
+        compressed = os.path.join(
+            current_app.config['ASSETS_DIR'], filename + extension
+        )
+        if accepted in request.accept_encodings and os.path.isfile(compressed):
+            path, encoding = compressed, accepted
+            break
+
+    if not os.path.isfile(path):
+        abort(404)
+
+    response = send_file(
+        path,
+        mimetype=mimetypes.guess_type(original)[0],
+        download_name=os.path.basename(original),
+        max_age=max_age
+    )
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+
+    response.vary.add('Accept-Encoding')
+    if max_age == MAX_AGE:
+        response.cache_control.immutable = True
+    return response
+
+def init_app(app):
+    """
+        Fingerprints the static files of the app and adds the "build-assets"
+        command
+    """
+    app.cli.add_command(build_assets_command)
+    app.extensions['flaskr.assets'] = Manifest(app.static_folder)
+
+    # In debug mode, the static files may be edited while the app runs, so
+    # they're served as usual (the fingerprints are only computed once)
+    if not app.config['STATIC_FINGERPRINTS'] or app.debug:
+        return
+
+    app.url_defaults(fingerprint_url)
+    app.view_functions['static'] = send_static_file
@@ -3,8 +3,11 @@ import functools
 from flask import (
     Blueprint, flash, g, redirect, render_template, request, session, url_for
 )
-from werkzeug.security import check_password_hash, generate_password_hash
-from flaskr.db import get_db
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.local import LocalProxy
+from flaskr.cache import get_user_cache
+from flaskr.passwords import get_hasher
+from flaskr.repositories import get_users
 
 # Creates a blueprint named "auth"
 # It needs to know where it's defined, so "__name__" is required
@@ -19,7 +22,7 @@ def register():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        db = get_db()
+        users = get_users()
         error = None
 
         if not username:
@@ -29,12 +32,10 @@ def register():
 
         if error is None:
             try:
-                db.execute(
-                    "INSERT INTO user (username, password) VALUES (?, ?)",
-                    (username, generate_password_hash(password))
-                )
-                db.commit()
-            except db.IntegrityError:
+                # The password is hashed by the worker processes (see
+                # flaskr/passwords.py)
+                users.create(username, get_hasher().hash(password))
+            except users.IntegrityError:
                 error = f"User {username} is already registered."
             else:
                 # "redirect" redirects to another URL
@@ -55,21 +56,24 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        db = get_db()
         error = None
 
-        # "fetchone" 
-        user = db.execute(
-            "SELECT * FROM user WHERE username = ?", (username,)
-        ).fetchone()
+        hasher = get_hasher()
+
+        # The user (with the password hash), or None
+        user = get_users().get_by_username(username)
 
         if user is None:
             error = 'Incorrect username.'
-        # "check_password_hash" takes a hash and a valor. If the hash of the
-        # value is equal to the hash taken as the first argument, returns True.
-        # Else, returns False.
-        elif not check_password_hash(user['password'], password):
+        # "verify" takes a hash and a valor. If the hash of the value is equal
+        # to the hash taken as the first argument, returns True. Else, returns
+        # False.
+        elif not hasher.verify(user['password'], password):
             error = 'Incorrect password.'
+        # The password is right, but its hash was made with older settings
+        # (e.g. fewer iterations), so it's replaced by an up to date one
+        elif hasher.needs_rehash(user['password']):
+            rehash_password(user['id'], password)
 
         # "session" is a dict that stores data across requests.
         # This data is stored in a cookie that is sent to the browser.
@@ -90,6 +94,58 @@ def login():
     # "render_template" renders a template containing HTML
     return render_template('auth/login.html')
 
+def get_user(user_id):
+    """
+        Returns the user (without the password hash) as a dict, or None if it
+        doesn't exist.
+
+        Users are kept in the user cache, so most requests don't query the db.
+    """
+    cache = get_user_cache()
+
+    user = cache.get(user_id) if cache is not None else None
+
+    if user is None:
+        user = get_users().get(user_id)
+
+        # Missing users aren't cached, so they're found as soon as they exist
+        if user is None:
+            return None
+
+        user = dict(user)
+        if cache is not None:
+            cache.set(user_id, user)
+
+    return user
+
+def forget_user(user_id):
+    """
+        Removes the user from the user cache.
+
+        Nothing calls it for now, as the app never changes what's cached (the
+        password hash isn't, so "set_password" doesn't need it). Whatever
+        renames or deletes a user (a view, a command, a script on the
+        database) must call it afterwards, or the old user is still served
+        until "USER_CACHE_TTL" runs out.
+    """
+    cache = get_user_cache()
+
+    if cache is not None:
+        cache.delete(user_id)
+
+def rehash_password(user_id, password):
+    """
+        Stores a new hash of the password, made with the current settings
+    """
+    try:
+        pwhash = get_hasher().hash(password)
+    except ServiceUnavailable:
+        # The login itself already succeeded, so it's not refused just
+        # because the workers are busy. The rehash waits for the next login.
+        return
+
+    get_users().set_password(user_id, pwhash)
+
 # Functions annotated with "before_app_request" run before the view function,
 # no matter what URL is requested
 @bp.before_app_request
@@ -104,11 +160,19 @@ def load_logged_in_user():
     # the user is logged, i.e. if the user info is in the session data.
     if user_id is None:
         g.user = None
-    # If the "user_id" exists, retrieves from the db the entire "user" dict
+    # If the "user_id" exists, "g.user" is a "LocalProxy" that only loads the
+    # user when it's first used (e.g. by "login_required" or by a template).
+    # Requests that never look at the user (e.g. a "304 Not Modified") don't
+    # load it at all.
     else:
-        g.user = get_db().execute(
-            "SELECT * FROM user WHERE id = ?", (user_id,)
-        ).fetchone()
+        loaded = []
+
+        def load():
+            if not loaded:
+                loaded.append(get_user(user_id))
+            return loaded[0]
+
+        g.user = LocalProxy(load)
 
 # To logout, just remove the user id from the session.
 # This way, when any route is activated, the "load_logged_in_user" function
@@ -120,17 +184,17 @@ def logout():
 
 # Creating, editing and deleting blog posts will require a user to be logged
 # in. A decorator can be used to check this for each view it's applied to.
-# This way, the "if g.user is None" block won't need to be repeatedly used
+# This way, the "if not g.user" block won't need to be repeatedly used
 # in every view.
 #
 # In other words, every view that "subscribes" to the "login_required" function
-# will check wether "g.user is None", in which case the function redirects to
-# the login page. Otherwise, the original view is called and continues
-# normally.
+# will check wether "g.user" is empty (None, or a proxy to a user that doesn't
+# exist anymore), in which case the function redirects to the login page.
+# Otherwise, the original view is called and continues normally.
 def login_required(view):
     @functools.wraps(view)
     def wrapped_view(**kwargs):
-        if g.user is None:
+        if not g.user:
             return redirect(url_for('auth.login'))
 
         return view(**kwargs)
@@ -0,0 +1,195 @@
+# The database backends the repositories (see flaskr/repositories.py) run
+# their queries on. "DATABASE_BACKEND" in the app config picks one of them:
+#   - "sqlite": the database file at "DATABASE", through flaskr/db.py (its
+#     connection pool, pragmas and retries on a locked database);
+#   - "postgresql": the server at "DATABASE_URL", through a pool of psycopg2
+#     connections, so several instances of the app can share the same data.
+#
+# Both take the same SQL, with "?" placeholders, and return rows that behave
+# like dicts ("row['title']").
+
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, has_app_context
+
+from flaskr.db import (
+    PoolTimeout, close_pool, execute_write, get_db, get_read_db, init_db
+)
+
+class SQLiteBackend(object):
+    name = 'sqlite'
+
+    IntegrityError = sqlite3.IntegrityError
+
+    def __init__(self, app):
+        self.app = app
+
+    def execute(self, sql, params=(), primary=False):
+        """
+            Executes a query and returns the cursor. Unless "primary", GET
+            requests run it on a read-only connection (see "get_read_db").
+        """
+        db = get_db() if primary else get_read_db()
+        return db.execute(sql, params)
+
+    def write(self, sql, params=()):
+        """
+            Executes a statement that changes the database and commits it
+        """
+        return execute_write(sql, params)
+
+    def init_schema(self):
+        init_db()
+
+    def close(self):
+        close_pool(self.app)
+
+class PostgreSQLBackend(object):
+    name = 'postgresql'
+
+    def __init__(self, app):
+        # psycopg2 is an optional dependency, only needed by this backend
+        # (installed with "pip install flaskr[postgresql]")
+        import psycopg2
+        import psycopg2.extras
+        import psycopg2.pool
+
+        self.IntegrityError = psycopg2.IntegrityError
+        self.PoolError = psycopg2.pool.PoolError
+        self.cursor_factory = psycopg2.extras.RealDictCursor
+        self.app = app
+        self.timeout = app.config['DATABASE_POOL_TIMEOUT']
+
+        # "DATABASE_POOL_SIZE" is the most connections kept open by each
+        # instance of the app. Connections are opened when first needed.
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            0, app.config['DATABASE_POOL_SIZE'] or 1,
+            app.config['DATABASE_URL']
+        )
+
+    def connection(self):
+        """
+            Returns the connection of the request, taking it from the pool on
+            first use.
+
+            Raises PoolTimeout if the pool stays full for
+            "DATABASE_POOL_TIMEOUT" seconds.
+        """
+        if 'pg_db' not in g:
+            g.pg_db = self._getconn()
+        return g.pg_db
+
+    def _getconn(self):
+        # psycopg2's pool raises an error right away when it's full instead of
+        # waiting, so it's polled until a connection is given back
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            try:
+                return self.pool.getconn()
+            except self.PoolError:
+                if time.monotonic() >= deadline:
+                    raise PoolTimeout(
+                        f"No database connection available after {self.timeout}s."
+                    )
+                time.sleep(0.01)
+
+    def release(self, e=None):
+        """
+            Gives the request's connection back to the pool
+        """
+        db = g.pop('pg_db', None)
+
+        if db is not None:
+            # Whatever wasn't committed is undone, so the next request starts
+            # from a clean transaction
+            db.rollback()
+            self.pool.putconn(db)
+
+    def execute(self, sql, params=(), primary=False):
+        # Reads and writes share the connections to the server
+        #
+        # psycopg2 uses "%s" placeholders, so any literal "%" is doubled
+        sql = sql.replace('%', '%%').replace('?', '%s')
+
+        start = time.perf_counter()
+        cursor = self.connection().cursor(cursor_factory=self.cursor_factory)
+        cursor.execute(sql, params)
+
+        # Recorded like the sqlite queries (see flaskr/queries.py)
+        if has_app_context():
+            g.setdefault('queries', []).append(
+                (sql, time.perf_counter() - start)
+            )
+
+        return cursor
+
+    def write(self, sql, params=()):
+        db = self.connection()
+
+        try:
+            cursor = self.execute(sql, params)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        return cursor
+
+    def init_schema(self):
+        db = self.connection()
+
+        with current_app.open_resource('schema_postgres.sql') as f:
+            db.cursor().execute(f.read().decode('utf8'))
+        db.commit()
+
+    def close(self):
+        self.pool.closeall()
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'postgresql': PostgreSQLBackend,
+}
+
+_backend_lock = threading.Lock()
+
+def get_backend(app=None):
+    """
+        Returns the database backend of the app, creating it on first use
+    """
+    if app is None:
+        app = current_app._get_current_object()
+
+    # The backend is created lazily (instead of in "init_app") so tests can
+    # still change the config after the app is created
+    with _backend_lock:
+        backend = app.extensions.get('flaskr.backend')
+        if backend is None:
+            backend = BACKENDS[app.config['DATABASE_BACKEND']](app)
+            app.extensions['flaskr.backend'] = backend
+
+    return backend
+
+def close_backend(app):
+    """
+        Closes the connections kept by the app's backend, if any
+    """
+    backend = app.extensions.pop('flaskr.backend', None)
+
+    if backend is not None:
+        backend.close()
+
+def release_connection(e=None):
+    backend = current_app.extensions.get('flaskr.backend')
+
+    # The sqlite connections are released by flaskr/db.py
+    if backend is not None and hasattr(backend, 'release'):
+        backend.release(e)
+
+def init_app(app):
+    """
+        Gives the backend's connection back at the end of every request
+    """
+    app.teardown_appcontext(release_connection)
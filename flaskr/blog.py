@@ -1,11 +1,18 @@
 import functools
+from datetime import datetime
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, current_app, flash, g, make_response, redirect,
+    render_template, request, session, stream_template, url_for
 )
 from werkzeug.security import check_password_hash, generate_password_hash
+from markupsafe import Markup, escape
 from werkzeug.exceptions import abort
-from flaskr.db import get_db
+from werkzeug.wsgi import ClosingIterator
+from flaskr.cache import get_page_cache
+from flaskr.db import detach_connections
+from flaskr.repositories import MATCH_END, MATCH_START, get_posts
+from flaskr.responses import is_cacheable, not_modified, set_validators
 
 from flaskr.auth import login_required
 
@@ -15,15 +22,342 @@ from flaskr.auth import login_required
 # main index.
 bp = Blueprint('blog', __name__)
 
+# The index is paginated with a "cursor" (also known as "keyset pagination"):
+# instead of an OFFSET, each page link carries the (created, id) pair of the
+# last (or first) post shown, and the next query starts right after it. With
+# the "post_created_id" index (see migrations/0002_post_created_id.sql), each
+# page is a short index range scan, no matter how many posts exist.
+def encode_cursor(post):
+    """
+        Returns the cursor string pointing at the given post
+    """
+    return f"{post['created']}_{post['id']}"
+
+def decode_cursor(cursor):
+    """
+        Returns the (created, id) pair stored in a cursor string.
+
+        Aborts with 400 if the cursor is malformed.
+    """
+    created, _, id = cursor.rpartition('_')
+
+    # "created" is compared with the stored timestamps as a string, so it
+    # must be one (in UTC, without a time zone), written the way they are
+    try:
+        created = datetime.fromisoformat(created)
+    except ValueError:
+        created = None
+
+    if created is None or created.tzinfo is not None or not id.isdigit():
+        abort(400, f"Invalid cursor {cursor}.")
+
+    return str(created), int(id)
+
+def decode_cursors(before, after):
+    """
+        Returns the (created, id) pairs of the "before" and "after" cursors
+        (None for a missing cursor)
+    """
+    return (
+        decode_cursor(before) if before is not None else None,
+        decode_cursor(after) if after is not None else None
+    )
+
+def split_page(posts, per_page, before=None, after=None):
+    """
+        Returns a (posts, has_older, has_newer, ids) tuple from the rows read
+        for a page (see "get_posts_page")
+    """
+    ids = [post['id'] for post in posts]
+    has_more = len(posts) > per_page
+    posts = list(posts[:per_page])
+
+    if after is not None:
+        posts.reverse()
+        # Coming from an older page, there is always an older page to go back
+        return posts, True, has_more, ids
+
+    return posts, has_more, before is not None, ids
+
+def get_posts_page(before=None, after=None, per_page=None, fields=None):
+    """
+        Returns a (posts, has_older, has_newer, ids) tuple for the page of
+        posts older than the "before" cursor or newer than the "after" cursor.
+        "ids" are the ids of every post read, including the one fetched to
+        know whether there is another page.
+
+        Without a cursor, the newest posts are returned. "fields" are the
+        ones read (see "posts_query"), which must include "id" and "created".
+    """
+    if per_page is None:
+        per_page = current_app.config['POSTS_PER_PAGE']
+
+    # One extra row is fetched just to know whether there is another page
+    posts = get_posts().page(
+        *decode_cursors(before, after), limit=per_page + 1, fields=fields
+    )
+    return split_page(posts, per_page, before, after)
+
+def page_cursors(posts, has_older, has_newer):
+    """
+        Returns the (older, newer) cursors of the neighbour pages of a page
+        of posts (None when there is no such page)
+    """
+    # The links to the neighbour pages carry the cursor of the posts at the
+    # edges of the current page
+    older = encode_cursor(posts[-1]) if posts and has_older else None
+    newer = encode_cursor(posts[0]) if posts and has_newer else None
+    return older, newer
+
+# Rendered index pages are kept in the page cache (see flaskr/cache.py), keyed
+# by the page cursors and the logged in user (the "Edit" links and the
+# navigation bar depend on who is viewing the page), and by the posts version
+# the page was read at. A page rendered from older data (a lagging replica, or
+# a render racing a write) is never served under a newer version's ETag.
+#
+# Each page is tagged with the ids of the posts it read and, if it shows the
+# newest post, with "newest". This way:
+#   - updating or deleting a post only drops the pages that read it;
+#   - creating a post (which becomes the newest one) only drops the pages
+#     showing the newest posts.
+def index_cache_key(version):
+    return (
+        'blog.index',
+        version,
+        request.args.get('before'),
+        request.args.get('after'),
+        session.get('user_id')
+    )
+
+def invalidate_index(*tags):
+    """
+        Drops the cached index pages with any of the tags
+    """
+    cache = get_page_cache()
+
+    if cache is not None:
+        cache.invalidate(*tags)
+
+def get_blog_state():
+    """
+        Returns the (version, modified) pair that changes whenever any post
+        changes (see migrations/0003_blog_state.sql)
+    """
+    state = get_posts().get_state()
+    return state['version'], state['modified']
+
+def index_etag(version):
+    # The ETag only depends on the posts version and on who is viewing the
+    # page (the page URL, with its cursors, is already part of what the ETag
+    # is for)
+    return f"index-{version}-{session.get('user_id', 0)}"
+
+def cached_index_page(version):
+    """
+        Returns the cached page for the request at the posts version, or None
+    """
+    cache = get_page_cache()
+
+    # Pages with flashed messages are neither cached nor validated, as the
+    # messages are only shown once
+    if cache is None or not is_cacheable():
+        return None
+
+    return cache.get(index_cache_key(version))
+
+def render_index_page(posts, has_older, has_newer, ids, version):
+    """
+        Renders the page of posts (see "get_posts_page") and caches it for
+        the posts version it was read at
+    """
+    older, newer = page_cursors(posts, has_older, has_newer)
+
+    # Checked before rendering, which consumes the flashed messages
+    cache = get_page_cache() if is_cacheable() else None
+
+    page = render_template(
+        'blog/index.html', posts=posts, older=older, newer=newer
+    )
+
+    if cache is not None:
+        tags = [('post', id) for id in ids]
+        if not has_newer:
+            tags.append('newest')
+        cache.set(index_cache_key(version), page, tags)
+
+    return page
+
+# With "STREAM_INDEX", the index is sent while it's rendered, as the posts are
+# read from the cursor, instead of being rendered whole before its first byte
+# is sent. The time to the first byte and the memory used don't depend on the
+# number of posts on the page anymore.
+#
+# Streamed pages aren't kept in the page cache, which would hold them whole.
+# Pages of newer posts (the "after" cursor) are read from the oldest post up,
+# so they're still rendered whole, as their posts must be reversed.
+class PostsStream(object):
+    """
+        Iterates over the posts of a page as they're read from the cursor,
+        remembering what the pagination needs
+    """
+    def __init__(self, cursor, per_page, before=None):
+        self.cursor = cursor
+        self.per_page = per_page
+        self.before = before
+        self.first = None
+        self.last = None
+        self.has_older = False
+
+    def __iter__(self):
+        count = 0
+        for post in self.cursor:
+            # The extra row only tells there is an older page
+            if count == self.per_page:
+                self.has_older = True
+                break
+
+            count += 1
+            if self.first is None:
+                self.first = post
+            self.last = post
+            yield post
+
+    # Called by the template after the posts are rendered (see index.html)
+    def older(self):
+        return encode_cursor(self.last) if self.has_older else None
+
+    def newer(self):
+        if self.first is None or self.before is None:
+            return None
+        return encode_cursor(self.first)
+
+def buffered(chunks, size=8192):
+    """
+        Joins the small pieces of text rendered by jinja into chunks of about
+        "size" characters, so they aren't sent one by one
+    """
+    buffer = []
+    length = 0
+
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+
+    if buffer:
+        yield ''.join(buffer)
+
+def stream_index_page(before=None, per_page=None):
+    """
+        Returns the page of posts older than the "before" cursor (or of the
+        newest posts) as chunks of HTML, rendered as they're sent
+    """
+    if per_page is None:
+        per_page = current_app.config['POSTS_PER_PAGE']
+
+    # One extra row is read just to know whether there is another page
+    cursor = get_posts().page_cursor(
+        before=decode_cursor(before) if before is not None else None,
+        limit=per_page + 1
+    )
+    posts = PostsStream(cursor, per_page, before)
+
+    # "stream_template" keeps the request around while the page is sent,
+    # but the request is torn down (and its db connections given back to the
+    # pool) as soon as the view returns. The cursor's connection is kept out
+    # of the pool until the response is closed, whether the whole page was
+    # sent or not.
+    release = detach_connections()
+    return ClosingIterator(buffered(stream_template(
+        'blog/index.html', posts=posts, older=posts.older, newer=posts.newer
+    )), release)
+
+def validated_response(page, cacheable, etag, last_modified):
+    """
+        Returns a response with the page, with validators unless it showed
+        flashed messages ("cacheable" is False)
+    """
+    response = make_response(page)
+    if cacheable:
+        set_validators(response, etag, last_modified)
+    return response
+
 @bp.route('/')
 def index():
-    db = get_db()
-    posts = db.execute(
-        'SELECT p.id, title, body, created, author_id, username'
-        ' FROM post p JOIN user u ON p.author_id = u.id'
-        ' ORDER BY created DESC'
-    ).fetchall()
-    return render_template('blog/index.html', posts=posts)
+    # The index answers conditional requests before touching the posts
+    version, modified = get_blog_state()
+    etag = index_etag(version)
+    response = not_modified(etag, modified)
+    if response is not None:
+        return response
+
+    cacheable = is_cacheable()
+    page = cached_index_page(version)
+
+    if page is None:
+        before = request.args.get('before')
+        after = request.args.get('after')
+
+        if current_app.config['STREAM_INDEX'] and after is None:
+            page = stream_index_page(before)
+        else:
+            page = render_index_page(
+                *get_posts_page(before=before, after=after), version=version
+            )
+
+    return validated_response(page, cacheable, etag, modified)
+
+# Search results are ranked by relevance (with matches in the title weighing
+# more than in the body, see "PostRepository.search"), so they can't be
+# paginated by a cursor like the index. As only the first pages of results are
+# usually seen, a page number (an OFFSET) is good enough here.
+def highlight(text):
+    """
+        Returns the text escaped, with the matches wrapped in <mark> tags
+    """
+    return Markup(
+        str(escape(text))
+        .replace(MATCH_START, '<mark>')
+        .replace(MATCH_END, '</mark>')
+    )
+
+def search_posts(q, page=1, per_page=None):
+    """
+        Returns a (posts, has_more) tuple with the page of posts matching
+        the query, best matches first
+    """
+    if per_page is None:
+        per_page = current_app.config['POSTS_PER_PAGE']
+
+    # One extra row is fetched just to know whether there is another page
+    posts = get_posts().search(
+        q, limit=per_page + 1, offset=(page - 1) * per_page
+    )
+
+    posts = [
+        dict(post, title=highlight(post['title']),
+             excerpt=highlight(post['excerpt']))
+        for post in posts
+    ]
+
+    return posts[:per_page], len(posts) > per_page
+
+@bp.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+
+    if page < 1:
+        abort(400, f"Invalid page {page}.")
+
+    posts, has_more = search_posts(q, page) if q else ([], False)
+
+    return render_template(
+        'blog/search.html', q=q, posts=posts, page=page, has_more=has_more
+    )
 
 @bp.route('/create', methods=('GET', 'POST'))
 @login_required
@@ -39,32 +373,26 @@ def create():
         if error is not None:
             flash(error)
         else:
-            db = get_db()
             # The "g" object is unique for each request, and holds data that might be 
             # reused throughout the request lifespan (e.g. the db connection)
             # This is useful here because this function will be called for every single
             # app route. Thus, g.user will be checked constantly by routes to verify if
             # the user is logged, i.e. if the user info is in the session data.
-            db.execute(
-                'INSERT INTO post (title, body, author_id)'
-                ' VALUES (?, ?, ?)',
-                (title, body, g.user['id'])
-            )
-            db.commit()
+            #
+            # The repository commits the insert (see flaskr/repositories.py)
+            get_posts().create(title, body, g.user['id'])
+            invalidate_index('newest')
             return redirect(url_for('blog.index'))
 
     return render_template('blog/create.html')
 
 # As both "update" and "delete" functionalities need to validate if the user is
 # the owner of the post, it makes sense to have a "get_post" function
-def get_post(id, check_author=True):
-    post = get_db().execute(
-        'SELECT p.id, title, body, created, author_id, username'
-        ' FROM post p JOIN user u ON p.author_id = u.id'
-        ' WHERE p.id = ?',
-        (id,)
-    ).fetchone()
-
+def check_post(post, id, check_author=True):
+    """
+        Aborts if the post doesn't exist or (if "check_author") if it's not
+        from the logged in user
+    """
     # The "abort()" function raises a special exception that returns a HTTP
     # status code
     if post is None:
@@ -75,6 +403,31 @@ def get_post(id, check_author=True):
 
     return post
 
+def get_post(id, check_author=True):
+    post = get_posts().get(id)
+    return check_post(post, id, check_author)
+
+# Shows a single post. Like the index, it answers conditional requests with a
+# single lookup of the post's "updated" timestamp.
+def post_etag(id, updated):
+    return f"post-{id}-{updated.timestamp()}-{session.get('user_id', 0)}"
+
+@bp.route('/<int:id>')
+def detail(id):
+    updated = get_posts().get_updated(id)
+    updated = check_post(updated, id, check_author=False)['updated']
+
+    etag = post_etag(id, updated)
+    response = not_modified(etag, updated)
+    if response is not None:
+        return response
+
+    cacheable = is_cacheable()
+    page = render_template(
+        'blog/detail.html', post=get_post(id, check_author=False)
+    )
+    return validated_response(page, cacheable, etag, updated)
+
 # If the "id" in the route is not specified as "int", it will be treated as a
 # string
 @bp.route('/<int:id>/update', methods=('GET', 'POST'))
@@ -97,13 +450,8 @@ def update(id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
-                'UPDATE post SET title = ?, body = ?'
-                ' WHERE id = ?',
-                (title, body, id)
-            )
-            db.commit()
+            get_posts().update(id, title, body)
+            invalidate_index(('post', id))
             return redirect(url_for('blog.index'))
 
     return render_template('blog/update.html', post=post)
@@ -115,7 +463,6 @@ def delete(id):
     # keeps the post ownership check, i.e. a post will be returned by the
     # function only if the user is the author
     get_post(id)
-    db = get_db()
-    db.execute('DELETE FROM post WHERE id = ?', (id,))
-    db.commit()
+    get_posts().delete(id)
+    invalidate_index(('post', id))
     return redirect(url_for('blog.index'))
\ No newline at end of file
@@ -0,0 +1,231 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+# A cache backend stores values by key. Anything implementing these methods
+# can be used as the page cache backend (e.g. one backed by a shared server),
+# by setting "PAGE_CACHE_BACKEND" in the app config.
+class CacheBackend(object):
+    def get(self, key):
+        """
+            Returns the value stored for the key, or None
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """
+            Stores the value for the key
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+            Removes the key, if it's stored
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+            Removes every key
+        """
+        raise NotImplementedError
+
+# The default backend keeps up to "maxsize" values in the process memory,
+# dropping the least recently used one when full. Values older than "ttl"
+# seconds are treated as missing, which bounds how stale a value can get when
+# it's changed by something that doesn't invalidate it (e.g. another process).
+#
+# "on_evict" is called with the key of each value dropped that way (full or
+# expired), e.g. so the page cache forgets its tags.
+class LRUCache(CacheBackend):
+    def __init__(self, maxsize=256, ttl=60, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        # key -> (expiry time, value), from the least to the most recently used
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Reads that found (or didn't find) a value, shown by "/metrics"
+        self.hits = 0
+        self.misses = 0
+
+    def _evicted(self, key):
+        # Called once the lock is released, so "on_evict" can use the cache
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            expires, value = item
+            if expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+
+            del self._data[key]
+            self.misses += 1
+
+        self._evicted(key)
+        return None
+
+    def __len__(self):
+        return len(self._data)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+
+            if len(self._data) <= self.maxsize:
+                return
+            evicted, _ = self._data.popitem(last=False)
+
+        self._evicted(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+# The page cache stores rendered pages in a backend and remembers the "tags"
+# of each page (e.g. the posts shown in it), so a change only invalidates the
+# pages that depend on what changed.
+#
+# The tags are only remembered for the last "max_keys" pages stored, as the
+# page keys come from the requests (e.g. the cursors of the index). An older
+# page is removed from the backend when its tags are forgotten, since nothing
+# could invalidate it anymore. With the default backend, the tags of the pages
+# it drops are forgotten right away.
+class PageCache(object):
+    def __init__(self, backend, max_keys=1024):
+        self.backend = backend
+        self.max_keys = max_keys
+        # key -> tags of each page, from the oldest to the newest one stored
+        self._keys = OrderedDict()
+        # tag -> keys of the pages with that tag
+        self._tags = {}
+        self._lock = threading.Lock()
+
+        if isinstance(backend, LRUCache):
+            backend.on_evict = self.forget
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def _forget(self, key):
+        # Removes the page from the tags index (the lock must be held)
+        for tag in self._keys.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def forget(self, key):
+        """
+            Forgets the tags of a page the backend doesn't have anymore
+        """
+        with self._lock:
+            self._forget(key)
+
+    def set(self, key, page, tags=()):
+        with self._lock:
+            # The page replaces any other one stored with the same key
+            self._forget(key)
+            self._keys[key] = tags = tuple(tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            dropped = []
+            while len(self._keys) > self.max_keys:
+                oldest = next(iter(self._keys))
+                self._forget(oldest)
+                dropped.append(oldest)
+
+        self.backend.set(key, page)
+        for oldest in dropped:
+            self.backend.delete(oldest)
+
+    def invalidate(self, *tags):
+        """
+            Removes every page with any of the tags
+        """
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self._tags.get(tag, ()))
+            for key in keys:
+                self._forget(key)
+
+        for key in keys:
+            self.backend.delete(key)
+
+    def __len__(self):
+        # Pages whose tags are remembered
+        return len(self._keys)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+            self._tags.clear()
+        self.backend.clear()
+
+_cache_lock = threading.Lock()
+
+def _get_cache(app, name, factory):
+    # Caches are created lazily (instead of in "create_app") so tests can still
+    # change the config after the app is created
+    if app is None:
+        app = current_app._get_current_object()
+
+    with _cache_lock:
+        cache = app.extensions.get(name)
+        if cache is None:
+            cache = factory(app.config)
+            if cache is None:
+                return None
+            app.extensions[name] = cache
+
+    return cache
+
+def _make_page_cache(config):
+    backend = config['PAGE_CACHE_BACKEND']
+    if backend is None:
+        if not config['PAGE_CACHE_SIZE']:
+            return None
+        backend = LRUCache(config['PAGE_CACHE_SIZE'], config['PAGE_CACHE_TTL'])
+        return PageCache(backend, max_keys=config['PAGE_CACHE_SIZE'])
+    return PageCache(backend)
+
+def get_page_cache(app=None):
+    """
+        Returns the page cache of the app, creating it on first use.
+
+        Returns None if the cache is disabled ("PAGE_CACHE_SIZE" is 0 and
+        there is no "PAGE_CACHE_BACKEND").
+    """
+    return _get_cache(app, 'flaskr.cache.pages', _make_page_cache)
+
+def _make_user_cache(config):
+    if not config['USER_CACHE_SIZE']:
+        return None
+    return LRUCache(config['USER_CACHE_SIZE'], config['USER_CACHE_TTL'])
+
+def get_user_cache(app=None):
+    """
+        Returns the cache of logged in users (by id), creating it on first
+        use.
+
+        Returns None if the cache is disabled ("USER_CACHE_SIZE" is 0).
+    """
+    return _get_cache(app, 'flaskr.cache.users', _make_user_cache)
@@ -1,4 +1,17 @@
+import contextlib
+import csv
+import functools
+import io
+import itertools
+import json
+import os
+import pathlib
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime, timezone
 
 import click
 
@@ -7,45 +20,1016 @@ from flask import current_app
 # The "g" object is unique for each request, and holds data that might be 
 # reused throughout the request lifespan (e.g. the db connection)
 from flask import g
+from flask import has_request_context, request, session
+# "with_appcontext" makes a command run inside an app context, so it can use
+# "get_db" (also when invoked by the tests' "runner" fixture)
+from flask.cli import with_appcontext
+
+from flaskr.queries import InstrumentedConnection
+from flaskr.rendering import RENDER_VERSION, render_body
+
+# Pragmas applied to every connection when it's opened. "DATABASE_PRAGMAS" in
+# the app config is either the name of one of these profiles or a dict of
+# pragmas.
+#
+# Both profiles use the "WAL" journal, so readers don't wait for writers (and
+# vice versa). "durable" syncs every commit to disk, while "fast" only syncs at
+# checkpoints (a power loss may lose the last commits, but never corrupts the
+# database) and trades memory for speed.
+#
+# "busy_timeout" is how long (in ms) a statement waits for a lock before
+# failing. It's kept short, as "retry_on_busy" then tries the write again a
+# few times, and the whole wait must fit in "DATABASE_BUSY_DEADLINE".
+PRAGMA_PROFILES = {
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 250,
+    },
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        # bytes of the database file read through memory mapping
+        'mmap_size': 256 * 1024 * 1024,
+        # negative values are in KiB instead of pages
+        'cache_size': -16 * 1024,
+        'busy_timeout': 250,
+        'temp_store': 'MEMORY',
+    },
+}
+
+def get_pragmas(value):
+    """
+        Returns the pragmas dict for a profile name or a dict of pragmas
+    """
+    if isinstance(value, str):
+        return PRAGMA_PROFILES[value]
+    return value or {}
+
+# Pragmas that change the database file, which only the writers set
+WRITER_PRAGMAS = ('journal_mode', 'synchronous')
+
+def connect(database, pragmas=None, readonly=False, immutable=False):
+    """
+        Opens a new connection to the database and applies the pragmas to it.
+
+        A "readonly" connection can't change the database. If the file is
+        also "immutable" (nothing changes it while it's open), sqlite doesn't
+        even lock it.
+    """
+    uri = readonly or immutable
+    if uri:
+        database = pathlib.Path(database).absolute().as_uri()
+        database += '?immutable=1' if immutable else '?mode=ro'
+
+    db = sqlite3.connect(
+        database,
+        uri=uri,
+        # Converts the values of columns declared as e.g. "TIMESTAMP" to the
+        # equivalent python types (e.g. "datetime")
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        # The connection is created on one thread but may be checked out by
+        # another one later on (see "ConnectionPool")
+        check_same_thread=False,
+        # Times every query (see flaskr/queries.py)
+        factory=InstrumentedConnection
+    )
+    # tells the connection to return rows that behave like dicts
+    db.row_factory = sqlite3.Row
+
+    # The connection's own setup isn't one of the request's queries, so it
+    # bypasses the instrumentation (see flaskr/queries.py)
+    execute = functools.partial(sqlite3.Connection.execute, db)
+
+    # Pragma values can't be bound as parameters, but they only come from
+    # the app config
+    for name, value in (pragmas or {}).items():
+        if not (uri and name in WRITER_PRAGMAS):
+            execute(f'PRAGMA {name} = {value}')
+
+    # Any statement trying to write fails, whatever the file permissions
+    if uri:
+        execute('PRAGMA query_only = ON')
+
+    return db
+
+class PoolTimeout(Exception):
+    """
+        Raised when no connection could be checked out of the pool in time
+    """
+
+# Opening a sqlite3 connection means opening the file, parsing the schema and
+# warming up the page cache, all of which would otherwise be paid on every
+# request. The pool keeps up to "size" connections open and hands them out to
+# requests.
+#
+# Each thread (waitress serves requests from a pool of threads) gets back the
+# connection it used last whenever it's idle, so a connection tends to stay on
+# the same thread and keep its cache warm for that thread's requests.
+class ConnectionPool(object):
+    def __init__(self, database, size=5, timeout=10.0, pragmas=None,
+                 readonly=False, immutable=False):
+        self.database = database
+        self.pragmas = pragmas
+        self.readonly = readonly
+        self.immutable = immutable
+        self.size = size
+        self.timeout = timeout
+        # All the connections opened by the pool (idle or checked out)
+        self._connections = set()
+        # The connections that can be checked out
+        self._idle = []
+        self._cond = threading.Condition()
+        # Remembers the last connection used by each thread
+        self._local = threading.local()
+
+    def acquire(self):
+        """
+            Checks out a healthy connection, opening a new one if all of them
+            are taken and the pool is not full yet.
+
+            Raises PoolTimeout if the pool stays full for "timeout" seconds.
+        """
+        with self._cond:
+            while True:
+                db = self._take_idle()
+                if db is not None:
+                    break
+
+                if len(self._connections) < self.size:
+                    db = connect(
+                        self.database, self.pragmas,
+                        readonly=self.readonly, immutable=self.immutable
+                    )
+                    self._connections.add(db)
+                    break
+
+                if not self._cond.wait(self.timeout):
+                    raise PoolTimeout(
+                        f"No database connection available after {self.timeout}s."
+                    )
+
+        # The health check runs outside the lock, as it touches the database
+        if not self._is_healthy(db):
+            self._discard(db)
+            return self.acquire()
+
+        self._local.last = db
+        return db
+
+    def release(self, db):
+        """
+            Returns a connection to the pool
+        """
+        # A request that failed half-way may leave a transaction open, which
+        # must not leak into the next request using this connection
+        try:
+            if db.in_transaction:
+                db.rollback()
+        except sqlite3.Error:
+            self._discard(db)
+            return
+
+        with self._cond:
+            # The pool was closed while the connection was checked out
+            if db not in self._connections:
+                db.close()
+                return
+
+            self._idle.append(db)
+            self._cond.notify()
+
+    def stats(self):
+        """
+            Returns how many connections are open, checked out and idle
+        """
+        with self._cond:
+            return {
+                'open': len(self._connections),
+                'in_use': len(self._connections) - len(self._idle),
+                'idle': len(self._idle),
+            }
+
+    def close(self):
+        """
+            Closes every idle connection and forgets the checked out ones
+        """
+        with self._cond:
+            for db in self._idle:
+                db.close()
+            self._idle.clear()
+            self._connections.clear()
+
+    def _take_idle(self):
+        # Prefers the connection this thread used last, then the one returned
+        # most recently (its pages are the most likely to still be cached)
+        last = getattr(self._local, 'last', None)
+        if last is not None and last in self._idle:
+            self._idle.remove(last)
+            return last
+
+        if self._idle:
+            return self._idle.pop()
+
+        return None
+
+    def _is_healthy(self, db):
+        # Not recorded as one of the request's queries
+        try:
+            sqlite3.Connection.execute(db, 'SELECT 1').fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def _discard(self, db):
+        with self._cond:
+            self._connections.discard(db)
+            self._cond.notify()
+        try:
+            db.close()
+        except sqlite3.Error:
+            pass
+
+_pool_lock = threading.Lock()
+
+def get_pool(app=None):
+    """
+        Returns the connection pool of the app, creating it on first use.
+
+        Returns None if pooling is disabled ("DATABASE_POOL_SIZE" is 0).
+    """
+    if app is None:
+        app = current_app._get_current_object()
+
+    if not app.config['DATABASE_POOL_SIZE']:
+        return None
+
+    # The pool is created lazily (instead of in "init_app") so tests can still
+    # change the config after the app is created
+    with _pool_lock:
+        pool = app.extensions.get('flaskr.db.pool')
+        if pool is None:
+            pool = ConnectionPool(
+                app.config['DATABASE'],
+                size=app.config['DATABASE_POOL_SIZE'],
+                timeout=app.config['DATABASE_POOL_TIMEOUT'],
+                pragmas=get_pragmas(app.config['DATABASE_PRAGMAS'])
+            )
+            app.extensions['flaskr.db.pool'] = pool
+
+    return pool
+
+def close_pool(app):
+    """
+        Closes the connections kept by the app's pool, if any
+    """
+    # The writes still queued are committed first
+    writer = app.extensions.pop('flaskr.db.writer', None)
+    if writer is not None:
+        writer.close()
+
+    pool = app.extensions.pop('flaskr.db.pool', None)
+
+    if pool is not None:
+        pool.close()
+
+    # and the read-only ones (see "get_read_pool")
+    for name in ('flaskr.db.read_pool', 'flaskr.db.replica'):
+        pool = app.extensions.pop(name, None)
+        if pool is not None:
+            pool.close()
 
 def get_db():
     """
         Returns the current db connection of the request.
 
-        If it doesn't exist, creates a connection and returns it.
+        If it doesn't exist, checks a connection out of the pool (or creates
+        one if pooling is disabled) and returns it.
     """
 
-    # In case the request has no connection (g.db), creates a connection object
+    # In case the request has no connection (g.db), takes one from the pool
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            # Use the "config['DATABASE']" as the db location (see the application factory)
-            current_app.config['DATABASE'],
-            # ?
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        # tells the connection to return rows that behave like dicts
-        g.db.row_factory = sqlite3.Row
+        pool = get_pool()
+
+        if pool is None:
+            # Use the "config['DATABASE']" as the db location (see the
+            # application factory)
+            g.db = connect(
+                current_app.config['DATABASE'],
+                get_pragmas(current_app.config['DATABASE_PRAGMAS'])
+            )
+        else:
+            g.db = pool.acquire()
 
     return g.db
 
 def close_db(e=None):
     """
-        Closes the connection if it exists
+        Gives the connection back to the pool (or closes it if pooling is
+        disabled)
     """
+    release_read_db()
+
     db = g.pop('db', None)
 
-    if db is not None:
+    if db is None:
+        return
+
+    pool = get_pool()
+
+    if pool is None:
         db.close()
+    else:
+        pool.release(db)
+
+# GET requests only read, so they're served by read-only connections (kept in
+# their own pool) instead of the ones that write. "DATABASE_READS" in the app
+# config picks what they read:
+#   - "readonly": the database file itself, opened read-only;
+#   - "replica": a copy of the database (at "DATABASE_REPLICA"), made with the
+#     sqlite backup API and replaced by a new copy every
+#     "DATABASE_REPLICA_INTERVAL" seconds (if the database changed). The copy
+#     is never written to, so its readers don't even lock it;
+#   - "primary": the same connections as the writes.
+#
+# Other requests (e.g. a POST that reads a post before updating it) read from
+# the primary connections, so they see the latest data. As a replica lags
+# behind the database, a user who just wrote something also reads from the
+# primary connections for a while (see "execute_write"), to see the change.
+READ_METHODS = ('GET', 'HEAD')
+
+class Replica(object):
+    def __init__(self, database, path, interval=5.0, size=5, timeout=10.0,
+                 pragmas=None):
+        self.database = database
+        self.path = path
+        self.interval = interval
+        self.pool_options = {
+            'size': size, 'timeout': timeout, 'pragmas': pragmas,
+            'immutable': True
+        }
+        # The pool of connections to the current copy
+        self.pool = None
+        self.refreshed = None
+        # "data_version" of the database when it was copied
+        self._version = None
+        self._source = None
+        self._lock = threading.Lock()
+
+    def get_pool(self):
+        """
+            Returns the pool of connections to the current copy, copying the
+            database first if the copy is older than "interval" seconds.
+
+            Only one thread makes the copy, while the others keep reading the
+            previous one.
+        """
+        if self.pool is None or self._is_stale():
+            # Without a copy yet, the threads have to wait for the first one
+            if self._lock.acquire(blocking=self.pool is None):
+                try:
+                    if self.pool is None or self._is_stale():
+                        self.refresh()
+                finally:
+                    self._lock.release()
+
+        return self.pool
+
+    def refresh(self):
+        """
+            Replaces the copy by a new one if the database changed since the
+            last copy. Returns True if it did.
+        """
+        if self._source is None:
+            self._source = sqlite3.connect(
+                self.database, check_same_thread=False
+            )
+
+        self.refreshed = time.monotonic()
+
+        # "data_version" changes whenever another connection commits
+        version = self._source.execute('PRAGMA data_version').fetchone()[0]
+        if self.pool is not None and version == self._version:
+            return False
+
+        # The copy is made aside, then moved over the current one, which its
+        # readers keep reading until they're given back to the old pool
+        path = self.path + '.tmp'
+        if os.path.exists(path):
+            os.remove(path)
+        copy = sqlite3.connect(path)
+        self._source.backup(copy)
+        copy.execute('PRAGMA journal_mode = DELETE')
+        copy.close()
+        os.replace(path, self.path)
+
+        old, self.pool = self.pool, ConnectionPool(
+            self.path, **self.pool_options
+        )
+        self._version = version
+
+        if old is not None:
+            old.close()
+
+        return True
+
+    def close(self):
+        with self._lock:
+            if self.pool is not None:
+                self.pool.close()
+            if self._source is not None:
+                self._source.close()
+                self._source = None
+
+    def _is_stale(self):
+        return time.monotonic() - self.refreshed >= self.interval
+
+def get_read_pool(app=None):
+    """
+        Returns the pool of read-only connections of the app, creating it on
+        first use.
+
+        Returns None if GET requests read from the primary connections, or
+        if pooling is disabled.
+    """
+    if app is None:
+        app = current_app._get_current_object()
+
+    reads = app.config['DATABASE_READS']
+
+    if reads == 'primary':
+        return None
+
+    with _pool_lock:
+        if reads == 'replica':
+            replica = app.extensions.get('flaskr.db.replica')
+            if replica is None:
+                replica = Replica(
+                    app.config['DATABASE'],
+                    app.config['DATABASE_REPLICA'],
+                    interval=app.config['DATABASE_REPLICA_INTERVAL'],
+                    size=app.config['DATABASE_POOL_SIZE'] or 1,
+                    timeout=app.config['DATABASE_POOL_TIMEOUT'],
+                    pragmas=get_pragmas(app.config['DATABASE_PRAGMAS'])
+                )
+                app.extensions['flaskr.db.replica'] = replica
+        elif not app.config['DATABASE_POOL_SIZE']:
+            return None
+        else:
+            pool = app.extensions.get('flaskr.db.read_pool')
+            if pool is None:
+                pool = ConnectionPool(
+                    app.config['DATABASE'],
+                    size=app.config['DATABASE_POOL_SIZE'],
+                    timeout=app.config['DATABASE_POOL_TIMEOUT'],
+                    pragmas=get_pragmas(app.config['DATABASE_PRAGMAS']),
+                    readonly=True
+                )
+                app.extensions['flaskr.db.read_pool'] = pool
+            return pool
+
+    # Outside of the lock, as it may copy the database
+    return replica.get_pool()
+
+def get_pools(app):
+    """
+        Returns the pools the app opened so far, by name: "primary",
+        "readonly" and "replica" (see "get_pool" and "get_read_pool")
+    """
+    replica = app.extensions.get('flaskr.db.replica')
+    pools = {
+        'primary': app.extensions.get('flaskr.db.pool'),
+        'readonly': app.extensions.get('flaskr.db.read_pool'),
+        'replica': replica.pool if replica is not None else None,
+    }
+    return {name: pool for name, pool in pools.items() if pool is not None}
+
+def reads_from_primary():
+    """
+        Returns True if the request must read from the primary connections
+    """
+    if current_app.config['DATABASE_READS'] == 'primary':
+        return True
+
+    # Outside of requests (e.g. the CLI commands) and in requests that write
+    if not has_request_context() or request.method not in READ_METHODS:
+        return True
+
+    # The user wrote recently, and the replica may not have the change yet
+    written = session.get('_db_written')
+    return (
+        written is not None and
+        time.time() - written < current_app.config['DATABASE_REPLICA_INTERVAL']
+    )
+
+def get_read_db():
+    """
+        Returns the connection the request reads from: a read-only one for
+        GET requests, the primary one (see "get_db") otherwise
+    """
+    if reads_from_primary():
+        return get_db()
+
+    if 'read_db' not in g:
+        pool = get_read_pool()
+
+        if pool is None:
+            g.read_db = connect(
+                current_app.config['DATABASE'],
+                get_pragmas(current_app.config['DATABASE_PRAGMAS']),
+                readonly=True
+            )
+        else:
+            g.read_db = pool.acquire()
+        # Remembered, as a replica may have a new pool by the time the
+        # connection is given back
+        g.read_pool = pool
+
+    return g.read_db
+
+def release_read_db():
+    db = g.pop('read_db', None)
+    pool = g.pop('read_pool', None)
+
+    if db is None:
+        return
+
+    if pool is None:
+        db.close()
+    else:
+        pool.release(db)
+
+def detach_connections():
+    """
+        Takes the request's connections (see "get_db" and "get_read_db") away
+        from it, so they aren't given back when the request ends, and returns
+        a function giving them back.
+
+        Used by the responses that keep reading from the database after the
+        view returns (see "flaskr.blog.stream_index_page"): Flask tears the
+        request down before the response is sent.
+    """
+    db = g.pop('db', None)
+    checked_out = [
+        (db, get_pool() if db is not None else None),
+        (g.pop('read_db', None), g.pop('read_pool', None)),
+    ]
+    released = []
+
+    # Called when the response is closed, outside of the request
+    def release():
+        if released:
+            return
+        released.append(True)
+
+        for db, pool in checked_out:
+            if db is None:
+                continue
+            if pool is None:
+                db.close()
+            else:
+                pool.release(db)
+
+    return release
+
+def is_busy(error):
+    """
+        Returns True if the error means another connection holds the lock
+    """
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        # The extended error codes keep the primary code in the lowest byte
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+    return 'locked' in str(error) or 'busy' in str(error)
+
+def retry_on_busy(func, *args, **kwargs):
+    """
+        Calls "func" and returns its result, calling it again (waiting a bit
+        longer every time) while it fails because the database is locked.
+
+        Gives up after "DATABASE_BUSY_RETRIES" retries, or when waiting
+        again would go past "DATABASE_BUSY_DEADLINE" seconds, raising the
+        error.
+    """
+    retries = current_app.config['DATABASE_BUSY_RETRIES']
+    delay = current_app.config['DATABASE_BUSY_BACKOFF']
+    # The request holds a server thread (and an admission slot) while it
+    # waits, so the wait is bounded however long the lock is held
+    deadline = time.monotonic() + current_app.config['DATABASE_BUSY_DEADLINE']
+
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if not is_busy(e) or attempt == retries:
+                raise
+            if time.monotonic() + delay * 2 ** attempt >= deadline:
+                raise
+
+            # Whatever was done before the error is undone, so the next
+            # attempt starts from a clean transaction
+            get_db().rollback()
+            time.sleep(delay * 2 ** attempt)
+
+# Each commit of the "durable" pragmas waits for the disk to sync, and only
+# one connection can write at a time. Under a burst of writes, the requests
+# queue for the lock one sync after the other, until they time out.
+#
+# With "DATABASE_GROUP_COMMIT", the requests hand their writes to a single
+# writer thread instead. It runs the writes waiting for it (and those coming
+# in during the next "DATABASE_GROUP_COMMIT_WINDOW" seconds) in a single
+# transaction, so a burst of writes pays for one lock and one sync. Each write
+# runs in a savepoint of its own: a failing write (e.g. a username already
+# taken) is undone on its own and its error raised in the request that made
+# it, while the others are still committed.
+class WriteTimeout(Exception):
+    """
+        Raised when the writer thread didn't commit a write in time. The write
+        may still be committed if the writer had already started it.
+    """
+
+class WriteResult(object):
+    """
+        What a write made by the writer thread returns, in place of its
+        cursor
+    """
+    def __init__(self, lastrowid, rowcount):
+        self.lastrowid = lastrowid
+        self.rowcount = rowcount
+
+class GroupCommitWriter(object):
+    def __init__(self, database, pragmas=None, window=0.002, batch_size=100):
+        self.database = database
+        self.pragmas = pragmas
+        self.window = window
+        self.batch_size = batch_size
+        # (sql, params, future) of the writes waiting for the writer thread,
+        # and None to stop it
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Transactions committed, and writes they held
+        self.commits = 0
+        self.writes = 0
+
+    def submit(self, sql, params=()):
+        """
+            Queues a write and returns the Future of its WriteResult
+        """
+        future = Future()
+
+        # The thread is only started when the first write comes
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='flaskr-writer', daemon=True
+                )
+                self._thread.start()
+
+            self._queue.put((sql, params, future))
+
+        return future
+
+    def close(self):
+        """
+            Commits the writes already queued, then stops the writer thread
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        batch = []
+
+        try:
+            db = connect(self.database, self.pragmas)
+        except BaseException as e:
+            self._fail(batch, e)
+            return
+
+        stopping = False
+
+        try:
+            while not stopping:
+                batch, stopping = self._next_batch()
+                if batch:
+                    self._commit(db, batch)
+                    batch = []
+        except BaseException as e:
+            self._fail(batch, e)
+        finally:
+            db.close()
+
+    def _fail(self, batch, error):
+        # The thread is dying: the writes it holds and the ones still queued
+        # fail with the error, rather than leaving their requests waiting.
+        # The next write starts a new thread.
+        with self._lock:
+            if self._thread is threading.current_thread():
+                self._thread = None
+
+            while True:
+                try:
+                    write = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                # "close" may have queued its None meanwhile
+                if write is not None:
+                    batch.append(write)
+
+        for _, _, future in batch:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def _next_batch(self):
+        # Waits for a write, then for the others coming during the window
+        first = self._queue.get()
+        if first is None:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.batch_size:
+            try:
+                write = self._queue.get(
+                    timeout=max(0, deadline - time.monotonic())
+                )
+            except queue.Empty:
+                break
+            if write is None:
+                return batch, True
+            batch.append(write)
+
+        return batch, False
+
+    def _commit(self, db, batch):
+        # The writes given up by their requests (see "execute_write") are
+        # skipped, and the others can't be given up anymore
+        batch = [
+            write for write in batch
+            if write[2].set_running_or_notify_cancel()
+        ]
+        if not batch:
+            return
+
+        results = []
+
+        try:
+            # Takes the write lock right away (waiting for it up to the
+            # "busy_timeout" pragma), rather than at the first write
+            db.execute('BEGIN IMMEDIATE')
+
+            for sql, params, future in batch:
+                db.execute('SAVEPOINT write')
+                try:
+                    cursor = db.execute(sql, params)
+                except sqlite3.Error as e:
+                    db.execute('ROLLBACK TO write')
+                    results.append((future, None, e))
+                else:
+                    results.append((
+                        future, WriteResult(cursor.lastrowid, cursor.rowcount),
+                        None
+                    ))
+                db.execute('RELEASE write')
+
+            db.commit()
+        except BaseException as e:
+            # Nothing was committed: every write of the batch fails (the
+            # requests retry them if the database was locked)
+            if db.in_transaction:
+                db.rollback()
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.writes += len(batch)
+
+        # The requests only get their results once they're committed
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+_writer_lock = threading.Lock()
+
+def get_writer(app=None):
+    """
+        Returns the group commit writer of the app, creating it on first use.
+
+        Returns None if "DATABASE_GROUP_COMMIT" is off.
+    """
+    if app is None:
+        app = current_app._get_current_object()
+
+    if not app.config['DATABASE_GROUP_COMMIT']:
+        return None
+
+    with _writer_lock:
+        writer = app.extensions.get('flaskr.db.writer')
+        if writer is None:
+            writer = GroupCommitWriter(
+                app.config['DATABASE'],
+                get_pragmas(app.config['DATABASE_PRAGMAS']),
+                window=app.config['DATABASE_GROUP_COMMIT_WINDOW']
+            )
+            app.extensions['flaskr.db.writer'] = writer
+
+    return writer
+
+def execute_write(sql, params=()):
+    """
+        Executes a statement that changes the database and commits it,
+        retrying while the database is locked by another writer.
+
+        Returns the cursor, e.g. to read its "lastrowid" (a WriteResult with
+        "DATABASE_GROUP_COMMIT", which raises WriteTimeout if the writer
+        thread doesn't commit it in time).
+    """
+    writer = get_writer()
+
+    if writer is None:
+        db = get_db()
+
+        def write():
+            cursor = db.execute(sql, params)
+            db.commit()
+            return cursor
+    else:
+        # Long enough for the writer's own wait for the lock (see
+        # "busy_timeout"), but bounded in case the writer is stuck
+        timeout = (
+            current_app.config['DATABASE_BUSY_DEADLINE'] + writer.window
+        )
+
+        def write():
+            # The writer thread has no app context, so the time the request
+            # waited for its write is recorded here (see flaskr/queries.py)
+            start = time.perf_counter()
+            future = writer.submit(sql, params)
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeout:
+                # Not committed if the writer didn't start it yet
+                future.cancel()
+                raise WriteTimeout(
+                    f"The write wasn't committed after {timeout}s."
+                )
+            finally:
+                g.setdefault('queries', []).append(
+                    (sql, time.perf_counter() - start)
+                )
+
+    cursor = retry_on_busy(write)
+
+    # The user's next requests read from the primary connections until the
+    # replica has the change (see "reads_from_primary")
+    if (current_app.config['DATABASE_READS'] == 'replica' and
+            has_request_context()):
+        session['_db_written'] = time.time()
+
+    return cursor
+
+# The schema is built by the migrations in the "flaskr/migrations" directory,
+# applied in order by "flask migrate". Each database records the ones it has
+# in "schema_version", so updating the app only applies the new ones, without
+# touching the data.
+#
+# Each migration comes with a query finding whether a database created before
+# the migrations existed (by the old "schema.sql") already has its changes.
+MIGRATIONS = (
+    ('0001_initial',
+     "SELECT 1 FROM sqlite_master WHERE name = 'post'"),
+    ('0002_post_created_id',
+     "SELECT 1 FROM sqlite_master WHERE name = 'post_created_id'"),
+    ('0003_blog_state',
+     "SELECT 1 FROM sqlite_master WHERE name = 'blog_state'"),
+    ('0004_post_search',
+     "SELECT 1 FROM sqlite_master WHERE name = 'post_search'"),
+    ('0005_post_authors',
+     "SELECT 1 FROM pragma_table_info('post')"
+     " WHERE name = 'author_username'"),
+    ('0006_post_body_html',
+     "SELECT 1 FROM pragma_table_info('post') WHERE name = 'body_html'"),
+    ('0007_user_renamed_state',
+     "SELECT 1 FROM sqlite_master WHERE name = 'user_renamed'"
+     " AND sql LIKE '%blog_state%'"),
+)
+
+def get_schema_version():
+    """
+        Returns the number of the last migration applied to the database (0
+        for an empty database)
+    """
+    db = get_db()
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        ' version INTEGER PRIMARY KEY,'
+        ' name TEXT NOT NULL,'
+        ' applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,'
+        # None for the migrations found in a database created without them
+        ' seconds REAL'
+        ')'
+    )
+
+    version = db.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    if version[0] is not None:
+        return version[0]
+
+    # A database without migrations (empty or created by the old
+    # "schema.sql"): the migrations it already has are recorded as applied
+    version = 0
+    for number, (name, applied_query) in enumerate(MIGRATIONS, 1):
+        if db.execute(applied_query).fetchone() is None:
+            break
+        db.execute(
+            'INSERT INTO schema_version (version, name) VALUES (?, ?)',
+            (number, name)
+        )
+        version = number
+
+    db.commit()
+    return version
+
+def pending_migrations(target=None):
+    """
+        Returns the (version, name) pairs of the migrations the database
+        doesn't have yet, up to the "target" version (the last one if None)
+    """
+    version = get_schema_version()
+
+    return [
+        (number, name)
+        for number, (name, _) in enumerate(MIGRATIONS, 1)
+        if number > version and (target is None or number <= target)
+    ]
+
+def migrate(target=None):
+    """
+        Applies the pending migrations (see "pending_migrations") in order,
+        yielding the (version, name, seconds) of each one once it's applied.
+
+        Each migration runs in its own transaction, so a failed migration
+        leaves the database as it was after the previous one.
+    """
+    db = get_db()
+
+    for number, name in pending_migrations(target):
+        # open_resource opens a file relative to the flaskr package
+        with current_app.open_resource(f'migrations/{name}.sql') as f:
+            script = f.read().decode('utf8')
+
+        start = time.perf_counter()
+        try:
+            # "IMMEDIATE" takes the write lock right away (waiting for the
+            # current writers), instead of failing halfway through if another
+            # connection writes first
+            db.executescript('BEGIN IMMEDIATE;\n' + script)
+            seconds = time.perf_counter() - start
+            db.execute(
+                'INSERT INTO schema_version (version, name, seconds)'
+                ' VALUES (?, ?, ?)',
+                (number, name, seconds)
+            )
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+
+        yield number, name, seconds
 
 def init_db():
     """
-        Initizalizes (or recreates) the database running the schemas.sql file
+        Recreates the database from scratch: drops every table, then applies
+        every migration
     """
+    # Other backends have their own schema (see flaskr/backends.py)
+    if current_app.config['DATABASE_BACKEND'] != 'sqlite':
+        from flaskr.backends import get_backend
+        return get_backend().init_schema()
+
     db = get_db()
 
-    # open_resource opens a file relative to the flaskr package
-    with current_app.open_resource('schema.sql') as f:
-        db.executescript(f.read().decode('utf8'))
+    # The full-text index is dropped first, which also drops its own tables
+    tables = db.execute(
+        "SELECT name FROM sqlite_master"
+        " WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        " ORDER BY sql LIKE 'CREATE VIRTUAL TABLE%' DESC"
+    ).fetchall()
+    for table in tables:
+        db.execute(f'DROP TABLE IF EXISTS "{table[0]}"')
+    db.commit()
+
+    for _ in migrate():
+        pass
 
 # the @click.command annotation defines a command line command called "init-db"
 # that calls the "init_db" function and shows a success message to the user
@@ -57,6 +1041,256 @@ def init_db_command():
     init_db()
     click.echo('Initialized the database.')
 
+# Unlike "init-db", "migrate" keeps the data, so it's the one used to update
+# the production database. It prints how long each migration took, as some of
+# them copy or index whole tables (see the comment atop each migration).
+@click.command('migrate')
+@click.option('--target', type=int,
+              help='Version to migrate to (defaults to the last one).')
+@click.option('--dry-run', is_flag=True,
+              help='Only list the migrations that would be applied.')
+@with_appcontext
+def migrate_command(target, dry_run):
+    """
+        Apply the migrations the database doesn't have yet.
+    """
+    if current_app.config['DATABASE_BACKEND'] != 'sqlite':
+        raise click.ClickException('Migrations only run on sqlite databases.')
+
+    if dry_run:
+        for number, name in pending_migrations(target):
+            click.echo(f'Pending {name}.')
+    else:
+        for number, name, seconds in migrate(target):
+            click.echo(f'Applied {name} in {seconds:.2f}s.')
+
+    click.echo(f'The database is at version {get_schema_version()}.')
+
+def rebuild_search_index():
+    """
+        Rebuilds the full-text index of the posts (see
+        migrations/0004_post_search.sql) from the "post" table
+    """
+    db = get_db()
+    db.execute("INSERT INTO post_search (post_search) VALUES ('rebuild')")
+    db.commit()
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """
+        Rebuild the full-text index of the posts.
+    """
+    rebuild_search_index()
+    click.echo('Rebuilt the search index.')
+
+# Posts are imported and exported as one record per line (JSON lines) or per
+# row (CSV), with these fields. The author is referred to by username, so the
+# files can move between databases with different user ids.
+POST_FIELDS = ('title', 'body', 'author', 'created')
+
+def get_format(file, format):
+    """
+        Returns the given format, or the one matching the file extension
+    """
+    if format is not None:
+        return format
+    # stdin/stdout ("-") may have no name
+    name = getattr(file, 'name', '')
+    return 'csv' if isinstance(name, str) and name.endswith('.csv') else 'jsonl'
+
+def read_posts(file, format):
+    """
+        Yields the posts in the file as dicts, one at a time.
+
+        Raises a ClickException with the line number if the file is malformed.
+    """
+    if format == 'csv':
+        # "strict" refuses malformed quoting instead of guessing the fields
+        reader = csv.DictReader(file, strict=True)
+        try:
+            yield from reader
+        except csv.Error as e:
+            # "line_num" counts the lines read up to the record that failed
+            raise click.ClickException(f'Line {reader.line_num + 1}: {e}.')
+        return
+
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            post = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise click.ClickException(f'Line {number}: {e}.')
+        if not isinstance(post, dict):
+            raise click.ClickException(f'Line {number}: not a JSON object.')
+        yield post
+
+def parse_created(value):
+    """
+        Returns the ISO 8601 date or time as stored by sqlite (UTC, as
+        "YYYY-MM-DD HH:MM:SS"), or None for an empty value.
+
+        Anything else stored in the "created" column would make every read of
+        the post fail (see "detect_types" in "connect"), so it's refused.
+    """
+    if not value:
+        return None
+
+    try:
+        # "Z" (UTC) is only understood by Python 3.11 and later
+        created = datetime.fromisoformat(
+            value[:-1] + '+00:00' if value.endswith('Z') else value
+        )
+    except (TypeError, ValueError):
+        raise click.ClickException(f'Invalid created time {value!r}.')
+
+    # Times without a time zone are already in UTC
+    if created.tzinfo is not None:
+        created = created.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return created.strftime('%Y-%m-%d %H:%M:%S')
+
+def import_posts(posts, batch_size=1000):
+    """
+        Inserts the posts (dicts with the POST_FIELDS) and returns how many
+        were inserted.
+
+        The posts are inserted "batch_size" at a time, each batch with a single
+        "executemany" in its own transaction, so only one batch is ever held in
+        memory and the db isn't synced to disk after every post.
+    """
+    db = get_db()
+    # username -> id of the authors already looked up
+    authors = {}
+
+    def author_id(username):
+        if username not in authors:
+            user = db.execute(
+                'SELECT id FROM user WHERE username = ?', (username,)
+            ).fetchone()
+            if user is None:
+                raise click.ClickException(f'Unknown author {username}.')
+            authors[username] = user['id']
+        return authors[username]
+
+    def row(post):
+        if not post.get('title'):
+            raise click.ClickException(f'Post without a title: {post}.')
+        body = post.get('body') or ''
+        return (
+            post['title'], body, render_body(body), RENDER_VERSION,
+            author_id(post.get('author')), parse_created(post.get('created'))
+        )
+
+    count = 0
+    posts = iter(posts)
+
+    while True:
+        batch = [row(post) for post in itertools.islice(posts, batch_size)]
+        if not batch:
+            return count
+
+        def insert():
+            db.executemany(
+                'INSERT INTO post'
+                ' (title, body, body_html, render_version, author_id, created)'
+                ' VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+                batch
+            )
+            db.commit()
+
+        retry_on_busy(insert)
+        count += len(batch)
+
+def export_posts(file, format, batch_size=1000):
+    """
+        Writes every post to the file, oldest first, and returns how many
+        were written.
+
+        Rows are fetched "batch_size" at a time, so the whole table is never
+        held in memory.
+    """
+    cursor = get_db().execute(
+        'SELECT title, body, author_username AS author, created'
+        ' FROM post ORDER BY id'
+    )
+
+    if format == 'csv':
+        writer = csv.DictWriter(file, POST_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(post):
+            file.write(json.dumps(post) + '\n')
+
+    count = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return count
+
+        for row in rows:
+            write(dict(row, created=str(row['created'])))
+        count += len(rows)
+
+@contextlib.contextmanager
+def text_file(file):
+    """
+        Yields the binary file as UTF-8 text, with its line endings untouched
+        (the "csv" module needs them to keep the "\\r\\n" of quoted fields,
+        e.g. the bodies posted from a textarea)
+    """
+    text = io.TextIOWrapper(file, encoding='utf8', newline='')
+    try:
+        yield text
+    finally:
+        text.flush()
+        # Leaves the file (maybe stdin/stdout) to be closed by click
+        text.detach()
+
+def report(action, count, start):
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed else 0
+    click.echo(
+        f'{action} {count} posts in {elapsed:.2f}s ({rate:.0f} rows/sec).',
+        err=True
+    )
+
+@click.command('import-posts')
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', type=click.Choice(['jsonl', 'csv']),
+              help='Defaults to the file extension (jsonl if unknown).')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Posts inserted per transaction.')
+@with_appcontext
+def import_posts_command(file, format, batch_size):
+    """
+        Import posts from a JSON lines or CSV file ("-" for stdin).
+    """
+    start = time.perf_counter()
+    with text_file(file) as file:
+        count = import_posts(
+            read_posts(file, get_format(file, format)), batch_size
+        )
+    report('Imported', count, start)
+
+@click.command('export-posts')
+@click.argument('file', type=click.File('wb'))
+@click.option('--format', type=click.Choice(['jsonl', 'csv']),
+              help='Defaults to the file extension (jsonl if unknown).')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Posts fetched at a time.')
+@with_appcontext
+def export_posts_command(file, format, batch_size):
+    """
+        Export every post to a JSON lines or CSV file ("-" for stdout).
+    """
+    start = time.perf_counter()
+    with text_file(file) as file:
+        count = export_posts(file, get_format(file, format), batch_size)
+    report('Exported', count, start)
+
 # The "close_db" and "init_db_command" functions need to be registered in the
 # app. Since the app is created by a factory function, the instance isn't
 # available when writing functions here. So, the following function takes an
@@ -73,5 +1307,9 @@ def init_app(app):
     # the "cli.add_command" adds a new command that can be called with the
     # "flask" command
     app.cli.add_command(init_db_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(import_posts_command)
+    app.cli.add_command(export_posts_command)
 
     # init_db_command()
\ No newline at end of file
@@ -0,0 +1,287 @@
+# Request metrics exposed at "/metrics" in the Prometheus text format:
+#   - a histogram of the request latency, per endpoint (e.g. "blog.index");
+#   - a histogram of the time spent on queries, per endpoint;
+#   - the count of responses per endpoint and status class (2xx, 5xx, ...);
+#   - the number of requests being handled;
+#   - the database connections and the page/user caches' hits and misses;
+#   - the requests running, waiting and shed by the admission control.
+#
+# Recording a request must cost next to nothing, so threads never wait for
+# each other: each thread only updates its own "shard" of counters, and the
+# shards are only added up when "/metrics" is read.
+#
+# Servers may start a thread per request (e.g. "flask run"), so the shard of a
+# thread that ended is added to a "retired" shard and dropped.
+
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+from flask import current_app, g, request
+
+from flaskr.admission import get_admission
+from flaskr.cache import get_page_cache, get_user_cache
+from flaskr.db import get_pool, get_pools
+
+# Upper bounds (in seconds) of the histogram buckets
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+def new_shard():
+    return {
+        'duration': {},
+        'db': {},
+        'responses': {},
+        'in_flight': [0],
+    }
+
+class ThreadOwner(object):
+    """
+        Kept in a thread's locals only, so it's freed when the thread ends
+    """
+
+class Metrics(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The shards of the live threads that recorded something
+        self._shards = []
+        # The totals of the threads that ended
+        self._retired = new_shard()
+        # Only taken when a thread creates or retires its shard
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = new_shard()
+            self._local.shard = shard
+            self._local.owner = owner = ThreadOwner()
+            # Called when the thread's locals are freed
+            weakref.finalize(owner, self._retire, shard)
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            # "is" rather than "list.remove", as shards with the same counts
+            # are equal
+            self._shards = [
+                other for other in self._shards if other is not shard
+            ]
+            self._add(self._retired, shard)
+
+    @staticmethod
+    def _add(total, shard):
+        # Adds the counts of the shard to the "total" shard. "list" copies the
+        # items at once, so a thread adding a new key meanwhile doesn't break
+        # the loops.
+        total['in_flight'][0] += shard['in_flight'][0]
+        for name in ('duration', 'db'):
+            for key, histogram in list(shard[name].items()):
+                counts = total[name].setdefault(key, [0] * len(histogram))
+                for i, value in enumerate(list(histogram)):
+                    counts[i] += value
+        for key, count in list(shard['responses'].items()):
+            total['responses'][key] = total['responses'].get(key, 0) + count
+
+    def _observe(self, histograms, key, value):
+        # A histogram is a list with the count of each bucket (plus one for
+        # the values above the last bucket) followed by the sum of the values
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def started(self):
+        self._shard()['in_flight'][0] += 1
+
+    def finished(self, endpoint, status, duration, db_time):
+        shard = self._shard()
+        shard['in_flight'][0] -= 1
+        self._observe(shard['duration'], endpoint, duration)
+        self._observe(shard['db'], endpoint, db_time)
+
+        key = (endpoint, f'{status // 100}xx')
+        shard['responses'][key] = shard['responses'].get(key, 0) + 1
+
+    def collect(self):
+        """
+            Returns the totals of every shard
+        """
+        totals = new_shard()
+
+        with self._lock:
+            shards = list(self._shards)
+            self._add(totals, self._retired)
+
+        for shard in shards:
+            self._add(totals, shard)
+
+        totals['in_flight'] = totals['in_flight'][0]
+        return totals
+
+    def render(self, extra=()):
+        """
+            Returns the metrics in the Prometheus text format. "extra" are
+            (name, type, help, [(labels, value)]) tuples of other metrics.
+        """
+        totals = self.collect()
+        lines = []
+
+        def header(name, type, help):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {type}')
+
+        def histogram(name, help, histograms):
+            header(name, 'histogram', help)
+            for endpoint, values in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} '
+                        f'{cumulative}'
+                    )
+                lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {values[-1]}')
+                lines.append(f'{name}_count{{endpoint="{endpoint}"}} {cumulative}')
+
+        histogram(
+            'flaskr_request_duration_seconds',
+            'Time spent handling requests.', totals['duration']
+        )
+        histogram(
+            'flaskr_request_db_seconds',
+            'Time spent on queries by each request.', totals['db']
+        )
+
+        header('flaskr_responses_total', 'counter',
+               'Responses sent, by status class.')
+        for (endpoint, status), count in sorted(totals['responses'].items()):
+            lines.append(
+                f'flaskr_responses_total{{endpoint="{endpoint}",'
+                f'status="{status}"}} {count}'
+            )
+
+        header('flaskr_requests_in_flight', 'gauge',
+               'Requests being handled.')
+        lines.append(f'flaskr_requests_in_flight {totals["in_flight"]}')
+
+        for name, type, help, samples in extra:
+            header(name, type, help)
+            for labels, value in samples:
+                labels = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f'{name}{{{labels}}} {value}' if labels
+                             else f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+def get_metrics(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+    return app.extensions['flaskr.metrics']
+
+def resource_metrics(app):
+    """
+        Returns the metrics of the database pool and of the caches
+    """
+    extra = []
+
+    # The primary pool is always reported (when pooling is on), the read
+    # pools once the GET requests opened them
+    get_pool(app)
+    samples = []
+    for name, pool in get_pools(app).items():
+        stats = pool.stats()
+        samples.extend(
+            ({'pool': name, 'state': state}, stats[state])
+            for state in ('in_use', 'idle')
+        )
+    if samples:
+        extra.append((
+            'flaskr_db_connections', 'gauge', 'Pooled database connections.',
+            samples
+        ))
+
+    samples = []
+    caches = (
+        ('page', get_page_cache(app)),
+        ('user', get_user_cache(app)),
+    )
+    for name, cache in caches:
+        # A custom page cache backend may not count its hits
+        cache = getattr(cache, 'backend', cache)
+        if hasattr(cache, 'hits'):
+            samples.append(({'cache': name, 'result': 'hit'}, cache.hits))
+            samples.append(({'cache': name, 'result': 'miss'}, cache.misses))
+    extra.append((
+        'flaskr_cache_requests_total', 'counter', 'Cache reads.', samples
+    ))
+
+    admission = get_admission(app)
+    if admission is not None:
+        stats = admission.stats()
+        extra.append((
+            'flaskr_admission_requests', 'gauge',
+            'Requests running and waiting, per class.',
+            [
+                ({'class': name, 'state': state}, counts[state])
+                for name, counts in stats.items()
+                for state in ('in_flight', 'waiting')
+            ]
+        ))
+        extra.append((
+            'flaskr_admission_shed_total', 'counter',
+            'Requests answered with a 503 by the admission control.',
+            [({'class': name}, counts['shed']) for name, counts in stats.items()]
+        ))
+
+    return extra
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+    get_metrics().started()
+
+def record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+def finish_request(e=None):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return
+
+    # Unhandled errors don't go through "after_request"
+    status = g.pop('metrics_status', 500)
+    if e is not None:
+        status = 500
+
+    # "queries" are recorded by flaskr/queries.py
+    db_time = sum(elapsed for _, elapsed in g.get('queries', ()))
+
+    get_metrics().finished(
+        request.endpoint or 'none', status,
+        time.perf_counter() - start, db_time
+    )
+
+def metrics():
+    app = current_app._get_current_object()
+    return get_metrics(app).render(resource_metrics(app)), {
+        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'
+    }
+
+def init_app(app):
+    """
+        Registers the metrics hooks and the "/metrics" endpoint to an app
+    """
+    app.extensions['flaskr.metrics'] = Metrics(
+        app.config['METRICS_BUCKETS'] or DEFAULT_BUCKETS
+    )
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
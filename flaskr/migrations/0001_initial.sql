@@ -1,17 +1,17 @@
-DROP TABLE IF EXISTS user;
-DROP TABLE IF EXISTS post;
+-- The users and their posts, as created by the first "schema.sql". Databases
+-- created by it already have these tables, so they're only created if missing.
 
-CREATE TABLE user (
+CREATE TABLE IF NOT EXISTS user (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   username TEXT UNIQUE NOT NULL,
   password TEXT NOT NULL
 );
 
-CREATE TABLE post (
+CREATE TABLE IF NOT EXISTS post (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   author_id INTEGER NOT NULL,
   created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   title TEXT NOT NULL,
   body TEXT NOT NULL,
   FOREIGN KEY (author_id) REFERENCES user (id)
-);
\ No newline at end of file
+);
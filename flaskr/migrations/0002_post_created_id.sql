@@ -0,0 +1,8 @@
+-- The index lists posts newest first, paginated by (created, id). This index
+-- matches that order, so each page is read as a range of the index instead of
+-- sorting the whole table.
+--
+-- Online: in WAL mode, readers keep reading while the index is built. Writers
+-- wait for it (up to their "busy_timeout", then the retries of
+-- "execute_write").
+CREATE INDEX IF NOT EXISTS post_created_id ON post (created DESC, id DESC);
@@ -0,0 +1,52 @@
+-- Adds "post.updated" and "blog_state", which let the blog answer conditional
+-- requests (ETag / Last-Modified) without reading the posts.
+--
+-- Offline: sqlite can't add a column with a non-constant default, so "post" is
+-- copied to a new table with the column. Writers wait for the whole copy.
+
+CREATE TABLE post_new (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  author_id INTEGER NOT NULL,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  -- in milliseconds, so two quick edits still give different validators
+  updated TIMESTAMP NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+  title TEXT NOT NULL,
+  body TEXT NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id)
+);
+
+INSERT INTO post_new (id, author_id, created, updated, title, body)
+SELECT id, author_id, created, created, title, body FROM post;
+
+DROP TABLE post;
+ALTER TABLE post_new RENAME TO post;
+
+-- Dropped with the old table
+CREATE INDEX post_created_id ON post (created DESC, id DESC);
+
+-- A single row tracking when any post last changed. "version" grows with every
+-- change (the timestamps only have a precision of seconds). It lets the index
+-- answer conditional requests (ETag / Last-Modified) with one lookup, without
+-- reading the posts.
+CREATE TABLE blog_state (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL,
+  modified TIMESTAMP NOT NULL
+);
+
+INSERT INTO blog_state (id, version, modified) VALUES (1, 0, CURRENT_TIMESTAMP);
+
+-- The triggers keep "blog_state" and "post.updated" up to date whatever changes
+-- the posts (the views, the tests or a manual change)
+CREATE TRIGGER post_inserted AFTER INSERT ON post BEGIN
+  UPDATE blog_state SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER post_updated AFTER UPDATE OF author_id, created, title, body ON post BEGIN
+  UPDATE post SET updated = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+  UPDATE blog_state SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER post_deleted AFTER DELETE ON post BEGIN
+  UPDATE blog_state SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
@@ -0,0 +1,29 @@
+-- Full-text index of the posts' titles and bodies, used by the search page.
+-- It's an "external content" table: the text itself is only stored in "post",
+-- while "post_search" only keeps the index, kept in sync by the triggers below.
+-- "flask rebuild-search-index" rebuilds it from scratch.
+--
+-- Online: readers keep reading while the existing posts are indexed.
+
+CREATE VIRTUAL TABLE post_search USING fts5(
+  title, body, content='post', content_rowid='id'
+);
+
+INSERT INTO post_search (post_search) VALUES ('rebuild');
+
+CREATE TRIGGER post_search_inserted AFTER INSERT ON post BEGIN
+  INSERT INTO post_search (rowid, title, body)
+  VALUES (NEW.id, NEW.title, NEW.body);
+END;
+
+CREATE TRIGGER post_search_updated AFTER UPDATE OF title, body ON post BEGIN
+  INSERT INTO post_search (post_search, rowid, title, body)
+  VALUES ('delete', OLD.id, OLD.title, OLD.body);
+  INSERT INTO post_search (rowid, title, body)
+  VALUES (NEW.id, NEW.title, NEW.body);
+END;
+
+CREATE TRIGGER post_search_deleted AFTER DELETE ON post BEGIN
+  INSERT INTO post_search (post_search, rowid, title, body)
+  VALUES ('delete', OLD.id, OLD.title, OLD.body);
+END;
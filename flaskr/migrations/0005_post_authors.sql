@@ -0,0 +1,33 @@
+-- A copy of the author's username in each post, so listing posts doesn't need
+-- to join them with "user", and an index listing the posts of an author.
+--
+-- Online: the column is added without copying the table (readers keep reading
+-- while it's filled and the index is built).
+
+ALTER TABLE post ADD COLUMN author_username TEXT;
+
+UPDATE post SET author_username = (
+  SELECT username FROM user WHERE id = post.author_id
+);
+
+-- Lists the posts of an author (newest first), and finds them when the author
+-- is renamed
+CREATE INDEX post_author_id ON post (author_id, created DESC);
+
+-- The triggers copy the author's username to the new posts, to the posts given
+-- to another author and to the posts of a renamed author
+CREATE TRIGGER post_author_inserted AFTER INSERT ON post BEGIN
+  UPDATE post SET author_username = (
+    SELECT username FROM user WHERE id = NEW.author_id
+  ) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER post_author_updated AFTER UPDATE OF author_id ON post BEGIN
+  UPDATE post SET author_username = (
+    SELECT username FROM user WHERE id = NEW.author_id
+  ) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER user_renamed AFTER UPDATE OF username ON user BEGIN
+  UPDATE post SET author_username = NEW.username WHERE author_id = NEW.id;
+END;
@@ -0,0 +1,20 @@
+-- The HTML of each post's body, rendered when the post is written (see
+-- flaskr/rendering.py), so showing a post doesn't format its body again.
+-- "render_version" is the version of the renderer that made "body_html":
+-- "flask render-posts" renders again the posts made by older versions (0 for
+-- the posts written before this migration, which the pages show from "body"
+-- until then).
+--
+-- Online: the columns are added without copying the table.
+
+ALTER TABLE post ADD COLUMN body_html TEXT;
+ALTER TABLE post ADD COLUMN render_version INTEGER NOT NULL DEFAULT 0;
+
+-- A post rendered again looks different, so it also changes "post.updated"
+-- and "blog_state" (and the pages' validators)
+DROP TRIGGER post_updated;
+
+CREATE TRIGGER post_updated AFTER UPDATE OF author_id, created, title, body, body_html ON post BEGIN
+  UPDATE post SET updated = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+  UPDATE blog_state SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
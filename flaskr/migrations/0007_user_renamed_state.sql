@@ -0,0 +1,19 @@
+-- Renaming a user changes the author's username shown by their posts (see
+-- 0005_post_authors.sql), so it also changes "post.updated" and "blog_state"
+-- (and the pages' validators), as any other change of the posts.
+--
+-- "post_updated" isn't given "author_username" instead, as the triggers
+-- filling it on every insert would then count each new post twice.
+--
+-- Online: only the trigger is replaced.
+
+DROP TRIGGER user_renamed;
+
+CREATE TRIGGER user_renamed AFTER UPDATE OF username ON user
+WHEN NEW.username IS NOT OLD.username BEGIN
+  UPDATE post SET
+    author_username = NEW.username,
+    updated = strftime('%Y-%m-%d %H:%M:%f', 'now')
+  WHERE author_id = NEW.id;
+  UPDATE blog_state SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
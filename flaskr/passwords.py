@@ -0,0 +1,131 @@
+# Password hashing is deliberately slow (that's what makes stolen hashes hard
+# to crack), so running it on waitress's request threads lets a burst of
+# logins starve every other route. Here, hashes are computed by a pool of
+# worker processes instead, and when too many of them are waiting the request
+# fails right away with "503 Service Unavailable".
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash
+
+class HashPoolFull(ServiceUnavailable):
+    """
+        Raised when every worker is busy and the queue of pending hashes is
+        full
+    """
+    description = 'Too many logins in progress, please try again shortly.'
+
+    def __init__(self):
+        super().__init__(retry_after=1)
+
+class PasswordHasher(object):
+    def __init__(self, method, workers=2, queue_size=16):
+        # The werkzeug hash method with all of its parameters, e.g.
+        # "scrypt:32768:8:1" or "pbkdf2:sha256:600000". Hashes made with
+        # anything else are outdated.
+        self.method = method
+        # 0 hashes on the calling thread
+        self.workers = workers
+        # Hashes being computed plus hashes waiting for a worker
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        """
+            Returns the hash of the password, using the configured method
+        """
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """
+            Returns True if the password matches the hash
+        """
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """
+            Returns True if the hash wasn't made with the configured method
+            (e.g. the number of iterations was raised since)
+        """
+        return pwhash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+
+        # Doesn't wait for a slot: a request that can't even be queued is
+        # better answered with a 503 now than with a timeout later
+        if not self._slots.acquire(blocking=False):
+            raise HashPoolFull()
+
+        try:
+            # A worker that died (e.g. killed when out of memory) breaks the
+            # whole pool: it's replaced by a new one, and the hash tried once
+            # more on it
+            for attempt in range(2):
+                executor = self._get_executor()
+                try:
+                    return executor.submit(func, *args).result()
+                except BrokenProcessPool:
+                    self._drop_executor(executor)
+            raise HashPoolFull()
+        finally:
+            self._slots.release()
+
+    def _get_executor(self):
+        # The processes are only started when the first hash is needed, from
+        # a process running the request threads. "fork" would copy the locks
+        # held by the other threads at that moment, which would never be
+        # released in the workers, so they're started by a clean "forkserver"
+        # process instead (or from scratch where there is none).
+        with self._lock:
+            if self._executor is None:
+                method = (
+                    'forkserver'
+                    if 'forkserver' in multiprocessing.get_all_start_methods()
+                    else 'spawn'
+                )
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context(method)
+                )
+            return self._executor
+
+    def _drop_executor(self, executor):
+        # Another thread may have replaced the broken pool already
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+_hasher_lock = threading.Lock()
+
+def get_hasher(app=None):
+    """
+        Returns the password hasher of the app, creating it on first use
+    """
+    if app is None:
+        app = current_app._get_current_object()
+
+    with _hasher_lock:
+        hasher = app.extensions.get('flaskr.passwords')
+        if hasher is None:
+            hasher = PasswordHasher(
+                app.config['PASSWORD_HASH_METHOD'],
+                workers=app.config['PASSWORD_HASH_WORKERS'],
+                queue_size=app.config['PASSWORD_HASH_QUEUE']
+            )
+            app.extensions['flaskr.passwords'] = hasher
+
+    return hasher
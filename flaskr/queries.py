@@ -0,0 +1,166 @@
+# Instrumentation of the SQL queries. Every connection opened by flaskr.db is
+# an "InstrumentedConnection", which times the statements it executes and
+# records them in the current request. At the end of the request:
+#   - the "Server-Timing" header tells how many queries were made and how long
+#     they took (browsers show it in their developer tools);
+#   - the statements are added to the app-wide stats, shown by the
+#     "/admin/queries" page (see flaskr/admin.py).
+# Statements slower than "SLOW_QUERY_MS" are logged with their query plan.
+#
+# Only the time spent in "execute" is measured. For a SELECT, that's the time
+# sqlite takes to find the first row, not the time spent fetching the rest.
+
+import re
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, has_app_context
+
+class InstrumentedConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        self._record(sql, parameters, time.perf_counter() - start)
+        return cursor
+
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+        cursor = super().executemany(sql, parameters)
+        self._record(sql, None, time.perf_counter() - start)
+        return cursor
+
+    def executescript(self, script):
+        start = time.perf_counter()
+        cursor = super().executescript(script)
+        self._record(script, None, time.perf_counter() - start)
+        return cursor
+
+    def _record(self, sql, parameters, elapsed):
+        # Queries made outside of the app (e.g. by a plain script) aren't
+        # recorded
+        if not has_app_context():
+            return
+
+        g.setdefault('queries', []).append((sql, elapsed))
+
+        threshold = current_app.config['SLOW_QUERY_MS']
+        if threshold is not None and elapsed * 1000 >= threshold:
+            log_slow_query(self, sql, parameters, elapsed)
+
+def log_slow_query(db, sql, parameters, elapsed):
+    """
+        Logs the statement with its query plan, if it has one
+    """
+    plan = ''
+    # The plan of an "executemany" or "executescript" can't be explained with
+    # the parameters
+    if parameters is not None:
+        try:
+            rows = sqlite3.Connection.execute(
+                db, 'EXPLAIN QUERY PLAN ' + sql, parameters
+            ).fetchall()
+            plan = '\n'.join('  ' + row[3] for row in rows)
+        except sqlite3.Error:
+            pass
+
+    current_app.logger.warning(
+        'Slow query (%.1fms): %s\n%s', elapsed * 1000, sql, plan
+    )
+
+# Lists of parameters whose length depends on the request: "IN (?, ?, ?)"
+# and the "WHEN ? THEN ?" of a CASE
+PARAMETER_LISTS = (
+    (re.compile(r'\bIN \(\?(?:\s*,\s*\?)*\)', re.IGNORECASE),
+     'IN (?, ...)'),
+    (re.compile(r'WHEN \? THEN \?(?:\s+WHEN \? THEN \?)+'),
+     'WHEN ? THEN ? ...'),
+)
+
+def normalize_sql(sql):
+    """
+        Returns the statement with its lists of parameters collapsed, so the
+        same query reading 2 or 100 rows is counted once
+    """
+    for pattern, replacement in PARAMETER_LISTS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+# The app-wide stats of each statement (its SQL text, with the parameters as
+# "?" and their lists collapsed): how many times it ran, the total time spent
+# and the slowest run.
+class QueryStats(object):
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, queries):
+        # Done before taking the lock, which is taken once for every query of
+        # a request
+        queries = [(normalize_sql(sql), elapsed) for sql, elapsed in queries]
+
+        with self._lock:
+            for sql, elapsed in queries:
+                stats = self._stats.get(sql)
+                if stats is None:
+                    stats = self._stats[sql] = [0, 0.0, 0.0]
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+
+    def summary(self):
+        """
+            Returns the stats of each statement, those taking the most time
+            in total first
+        """
+        with self._lock:
+            stats = [
+                {
+                    'sql': sql,
+                    'count': count,
+                    'total_ms': total * 1000,
+                    'mean_ms': total / count * 1000,
+                    'max_ms': slowest * 1000,
+                }
+                for sql, (count, total, slowest) in self._stats.items()
+            ]
+        return sorted(stats, key=lambda s: s['total_ms'], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+def get_stats(app=None):
+    """
+        Returns the query stats of the app
+    """
+    if app is None:
+        app = current_app._get_current_object()
+    return app.extensions['flaskr.queries']
+
+def add_server_timing(response):
+    """
+        Adds the time spent on queries by the request to the response
+    """
+    queries = g.get('queries', ())
+    total = sum(elapsed for _, elapsed in queries) * 1000
+    response.headers.add(
+        'Server-Timing', f'db;dur={total:.2f};desc="{len(queries)} queries"'
+    )
+    return response
+
+def flush_queries(e=None):
+    """
+        Adds the queries of the request to the app-wide stats
+    """
+    queries = g.pop('queries', None)
+    if queries:
+        get_stats().add(queries)
+
+def init_app(app):
+    """
+        Registers the query instrumentation hooks to an app
+    """
+    app.extensions['flaskr.queries'] = QueryStats()
+    app.after_request(add_server_timing)
+    app.teardown_appcontext(flush_queries)
@@ -0,0 +1,68 @@
+# Post bodies are rendered to HTML once, when the post is written, and stored
+# in "post.body_html" (see migrations/0006_post_body_html.sql), so the pages
+# showing them do no formatting work at all, however costly the formatting
+# becomes (e.g. Markdown, then sanitizing its HTML).
+#
+# Each post also stores the "RENDER_VERSION" it was rendered with. Whenever
+# "render_body" changes the HTML it makes, "RENDER_VERSION" must be raised,
+# then "flask render-posts" renders again the posts made by older versions, a
+# batch at a time.
+
+import time
+
+import click
+from flask.cli import with_appcontext
+from markupsafe import escape
+
+# Raise it whenever "render_body" changes its output
+RENDER_VERSION = 1
+
+def render_body(body):
+    """
+        Returns the HTML of a post's body: the text, escaped (its line breaks
+        are kept by the "white-space: pre-line" of style.css)
+    """
+    return str(escape(body))
+
+def render_posts(batch_size=500):
+    """
+        Renders again the bodies of the posts made by an older renderer
+        version, "batch_size" at a time, and returns how many there were
+    """
+    # Imported here, as the repositories render the posts they write with
+    # this module
+    from flaskr.repositories import get_posts
+
+    posts = get_posts()
+    count = 0
+    after = 0
+
+    while True:
+        batch = posts.stale_bodies(RENDER_VERSION, after, batch_size)
+        if not batch:
+            return count
+
+        posts.set_bodies_html(
+            [(post['id'], render_body(post['body'])) for post in batch],
+            RENDER_VERSION
+        )
+        count += len(batch)
+        after = batch[-1]['id']
+
+@click.command('render-posts')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Posts rendered per transaction.')
+@with_appcontext
+def render_posts_command(batch_size):
+    """
+        Render again the posts made by an older renderer version.
+    """
+    start = time.perf_counter()
+    count = render_posts(batch_size)
+    click.echo(
+        f'Rendered {count} posts in {time.perf_counter() - start:.2f}s'
+        f' (renderer version {RENDER_VERSION}).'
+    )
+
+def init_app(app):
+    app.cli.add_command(render_posts_command)
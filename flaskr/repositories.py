@@ -0,0 +1,355 @@
+# The repositories hold all the SQL read and written by the views, so the views
+# don't depend on the database they run on (see flaskr/backends.py).
+#
+# The SQL is written once for both backends whenever possible ("?"
+# placeholders, the row values comparisons of the pagination...). "user" is
+# quoted as it's a reserved word in PostgreSQL. Only the search differs, as
+# each database has its own full-text search.
+
+from flaskr.backends import get_backend
+from flaskr.rendering import RENDER_VERSION, render_body
+
+# The columns the posts are read with, by the name they're read as.
+#
+# The author's username is read from the copy kept in "post" (see
+# migrations/0005_post_authors.sql), so the posts aren't joined with "user".
+POST_COLUMNS = {
+    'id': 'p.id',
+    'title': 'title',
+    'body': 'body',
+    # See migrations/0006_post_body_html.sql
+    'body_html': 'body_html',
+    'created': 'created',
+    'author_id': 'author_id',
+    'username': 'author_username AS username',
+}
+
+def posts_query(fields=None):
+    """
+        Returns the query reading the given fields (see POST_COLUMNS) of the
+        posts, every one of them by default
+    """
+    if fields is None:
+        fields = POST_COLUMNS
+
+    return (
+        'SELECT ' + ', '.join(POST_COLUMNS[field] for field in fields)
+        + ' FROM post p'
+    )
+
+# The posts of a page, newest first. See "page_query".
+POSTS_QUERY = posts_query()
+
+POST_QUERY = POSTS_QUERY + ' WHERE p.id = ?'
+
+POST_UPDATED_QUERY = 'SELECT updated FROM post WHERE id = ?'
+
+BLOG_STATE_QUERY = 'SELECT version, modified FROM blog_state WHERE id = 1'
+
+def page_query(before=None, after=None, limit=10, fields=None):
+    """
+        Returns the (query, params) pair reading up to "limit" posts older
+        than the "before" (created, id) pair, or newer than the "after" one
+        (the newest posts without either). "fields" are the ones read (see
+        "posts_query").
+    """
+    query = posts_query(fields)
+
+    if after is not None:
+        # Going to newer posts walks the index in the opposite direction, so
+        # these rows come oldest first
+        query += (
+            ' WHERE (p.created, p.id) > (?, ?)'
+            ' ORDER BY p.created ASC, p.id ASC LIMIT ?'
+        )
+        params = (*after, limit)
+    elif before is not None:
+        query += (
+            ' WHERE (p.created, p.id) < (?, ?)'
+            ' ORDER BY p.created DESC, p.id DESC LIMIT ?'
+        )
+        params = (*before, limit)
+    else:
+        query += ' ORDER BY p.created DESC, p.id DESC LIMIT ?'
+        params = (limit,)
+
+    return query, params
+
+# Matches in the title weigh more than in the body when ranking the results
+SEARCH_TITLE_WEIGHT = 10.0
+
+# The matches in the search results are marked with these control characters,
+# so they can be turned into <mark> tags after the rest of the text is escaped
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+def fts5_query(q):
+    """
+        Turns what the user typed into an FTS5 query matching posts that
+        contain every word, without letting FTS5 operators through
+    """
+    return ' '.join(
+        '"' + word.replace('"', '""') + '"' for word in q.split()
+    )
+
+class UserRepository(object):
+    def __init__(self, backend):
+        self.backend = backend
+        # Raised by "create" when the username is taken
+        self.IntegrityError = backend.IntegrityError
+
+    def get(self, id):
+        """
+            Returns the user (without the password hash), or None
+        """
+        query = 'SELECT id, username FROM "user" WHERE id = ?'
+        user = self.backend.execute(query, (id,)).fetchone()
+
+        # A user who just registered may not be in the database's replica
+        # yet (see "DATABASE_READS")
+        if user is None:
+            user = self.backend.execute(query, (id,), primary=True).fetchone()
+
+        return user
+
+    def get_by_username(self, username):
+        """
+            Returns the user (with the password hash), or None
+        """
+        return self.backend.execute(
+            'SELECT * FROM "user" WHERE username = ?', (username,)
+        ).fetchone()
+
+    def create(self, username, password):
+        self.backend.write(
+            'INSERT INTO "user" (username, password) VALUES (?, ?)',
+            (username, password)
+        )
+
+    def set_password(self, id, password):
+        self.backend.write(
+            'UPDATE "user" SET password = ? WHERE id = ?', (password, id)
+        )
+
+class PostRepository(object):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def page(self, before=None, after=None, limit=10, fields=None):
+        """
+            Returns up to "limit" posts (see "page_query")
+        """
+        return self.page_cursor(before, after, limit, fields).fetchall()
+
+    def page_cursor(self, before=None, after=None, limit=10, fields=None):
+        """
+            Returns a cursor over up to "limit" posts (see "page_query").
+
+            On sqlite, the rows are only read as the cursor is iterated (the
+            "postgresql" backend still fetches them all at once).
+        """
+        return self.backend.execute(*page_query(before, after, limit, fields))
+
+    def get(self, id):
+        """
+            Returns the post with its author's username, or None
+        """
+        return self.backend.execute(POST_QUERY, (id,)).fetchone()
+
+    def get_many(self, ids, fields=None):
+        """
+            Returns the posts with the given ids, in the same order, in a
+            single query. Ids of posts that don't exist are skipped.
+
+            "fields" (see "posts_query") must include "id".
+        """
+        if not ids:
+            return []
+
+        posts = self.backend.execute(
+            posts_query(fields)
+            + ' WHERE p.id IN (' + ', '.join('?' * len(ids)) + ')',
+            tuple(ids)
+        ).fetchall()
+
+        by_id = {post['id']: post for post in posts}
+        return [by_id[id] for id in ids if id in by_id]
+
+    def get_updated(self, id):
+        """
+            Returns the row with the time the post last changed, or None
+        """
+        return self.backend.execute(POST_UPDATED_QUERY, (id,)).fetchone()
+
+    def get_state(self):
+        """
+            Returns the row with the "version" and "modified" time of the
+            posts, which change whenever any post changes (see
+            migrations/0003_blog_state.sql)
+        """
+        return self.backend.execute(BLOG_STATE_QUERY).fetchone()
+
+    # The bodies are rendered to HTML as they're written (see
+    # flaskr/rendering.py)
+    def create(self, title, body, author_id):
+        self.backend.write(
+            'INSERT INTO post'
+            ' (title, body, author_id, body_html, render_version)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            (title, body, author_id, render_body(body), RENDER_VERSION)
+        )
+
+    def update(self, id, title, body):
+        self.backend.write(
+            'UPDATE post SET title = ?, body = ?, body_html = ?,'
+            ' render_version = ? WHERE id = ?',
+            (title, body, render_body(body), RENDER_VERSION, id)
+        )
+
+    def stale_bodies(self, version, after=0, limit=500):
+        """
+            Returns the id and body of up to "limit" posts rendered by a
+            renderer older than "version", with an id greater than "after",
+            by id
+        """
+        return self.backend.execute(
+            'SELECT id, body FROM post'
+            ' WHERE render_version < ? AND id > ?'
+            ' ORDER BY id LIMIT ?',
+            (version, after, limit),
+            primary=True
+        ).fetchall()
+
+    def set_bodies_html(self, bodies, version):
+        """
+            Stores the (id, body_html) pairs rendered by the "version" of the
+            renderer, in a single statement
+        """
+        if not bodies:
+            return
+
+        # Posts written meanwhile were already rendered by the current
+        # version, so they're left alone
+        cases = ' '.join('WHEN ? THEN ?' for _ in bodies)
+        self.backend.write(
+            f'UPDATE post SET body_html = CASE id {cases} END,'
+            ' render_version = ?'
+            ' WHERE id IN (' + ', '.join('?' * len(bodies)) + ')'
+            ' AND render_version < ?',
+            (
+                *(value for pair in bodies for value in pair),
+                version, *(id for id, _ in bodies), version
+            )
+        )
+
+    def delete(self, id):
+        self.backend.write('DELETE FROM post WHERE id = ?', (id,))
+
+    def search(self, q, limit=10, offset=0):
+        """
+            Returns up to "limit" posts containing every word of "q", best
+            matches first. The "title" and "excerpt" of each post have the
+            matches between MATCH_START and MATCH_END.
+        """
+        if self.backend.name == 'postgresql':
+            return self._search_postgresql(q, limit, offset)
+
+        # bm25 ranks the rows of the FTS5 table (see
+        # migrations/0004_post_search.sql)
+        return self.backend.execute(
+            'SELECT p.id, created, author_id, author_username AS username,'
+            ' highlight(post_search, 0, ?, ?) AS title,'
+            " snippet(post_search, 1, ?, ?, '...', 32) AS excerpt"
+            ' FROM post_search s'
+            ' JOIN post p ON p.id = s.rowid'
+            ' WHERE post_search MATCH ?'
+            ' ORDER BY bm25(post_search, ?, 1.0)'
+            ' LIMIT ? OFFSET ?',
+            (
+                MATCH_START, MATCH_END, MATCH_START, MATCH_END,
+                fts5_query(q), SEARCH_TITLE_WEIGHT, limit, offset
+            )
+        ).fetchall()
+
+    def _search_postgresql(self, q, limit, offset):
+        # "post.search" weighs the title as "A" and the body as "D", which
+        # "ts_rank" counts 10 times less (see schema_postgres.sql)
+        options = f'StartSel={MATCH_START}, StopSel={MATCH_END}'
+
+        return self.backend.execute(
+            'SELECT p.id, created, author_id, author_username AS username,'
+            " ts_headline('english', title, query, ?) AS title,"
+            " ts_headline('english', body, query, ?) AS excerpt"
+            ' FROM post p,'
+            " plainto_tsquery('english', ?) query"
+            ' WHERE p.search @@ query'
+            ' ORDER BY ts_rank(p.search, query) DESC, p.id DESC'
+            ' LIMIT ? OFFSET ?',
+            (
+                options + ', HighlightAll=true',
+                options + ', MaxWords=32, MinWords=16',
+                q, limit, offset
+            )
+        ).fetchall()
+
+# The reads of the async views (see flaskr/aioviews.py), on an async backend
+# (see flaskr/aiodb.py). They run the same SQL as their sync counterparts, but
+# their methods are coroutines, and return lists of rows instead of cursors.
+class AsyncUserRepository(object):
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def get(self, id):
+        """
+            Returns the user (without the password hash), or None
+        """
+        query = 'SELECT id, username FROM "user" WHERE id = ?'
+        user = await self.backend.fetchone(query, (id,))
+
+        # See "UserRepository.get"
+        if user is None:
+            user = await self.backend.fetchone(query, (id,), primary=True)
+
+        return user
+
+class AsyncPostRepository(object):
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def page(self, before=None, after=None, limit=10, fields=None):
+        """
+            Returns up to "limit" posts (see "page_query")
+        """
+        return await self.backend.fetchall(
+            *page_query(before, after, limit, fields)
+        )
+
+    async def get(self, id):
+        """
+            Returns the post with its author's username, or None
+        """
+        return await self.backend.fetchone(POST_QUERY, (id,))
+
+    async def get_updated(self, id):
+        """
+            Returns the row with the time the post last changed, or None
+        """
+        return await self.backend.fetchone(POST_UPDATED_QUERY, (id,))
+
+    async def get_state(self):
+        """
+            Returns the row with the "version" and "modified" time of the
+            posts (see "PostRepository.get_state")
+        """
+        return await self.backend.fetchone(BLOG_STATE_QUERY)
+
+def get_users():
+    """
+        Returns the users repository of the app's backend
+    """
+    return UserRepository(get_backend())
+
+def get_posts():
+    """
+        Returns the posts repository of the app's backend
+    """
+    return PostRepository(get_backend())
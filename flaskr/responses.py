@@ -0,0 +1,155 @@
+# Helpers for conditional GET requests. A response carries "validators" (an
+# ETag and/or a Last-Modified date) and clients send them back in the
+# "If-None-Match" and "If-Modified-Since" headers. When they still match, the
+# view answers "304 Not Modified" with no body, before doing any rendering.
+#
+# Every ETag starts with the "build id", a hash of the templates and of the
+# static files' fingerprints. A page only depends on the data as long as the
+# same code renders it: after a deploy changing them, the pages kept by the
+# browsers (e.g. linking the previous stylesheet URL) don't match anymore.
+
+import gzip
+import hashlib
+from datetime import timezone
+
+from flask import current_app, request, session
+
+def is_cacheable():
+    """
+        Returns False if the page about to be rendered will show flashed
+        messages, which are only shown once, so the page must not be reused
+    """
+    return '_flashes' not in session
+
+def compute_build_id(app):
+    """
+        Returns a hash of the app's templates and static files
+    """
+    digest = hashlib.sha256()
+
+    # The fingerprints already hash the content of the static files
+    manifest = app.extensions.get('flaskr.assets')
+    if manifest is not None:
+        for fingerprinted in sorted(manifest.filenames):
+            digest.update(fingerprinted.encode() + b'\0')
+
+    env = app.jinja_env
+    for name in sorted(env.list_templates()):
+        source, _, _ = env.loader.get_source(env, name)
+        digest.update(f'{name}\0{source}\0'.encode())
+
+    return digest.hexdigest()[:12]
+
+def build_etag(etag):
+    """
+        Returns the ETag of the view, prefixed with the build id
+    """
+    return f"{current_app.extensions['flaskr.build']}-{etag}"
+
+def set_validators(response, etag, last_modified=None):
+    """
+        Adds the validators to the response and tells clients (and caches) to
+        check them with the server before reusing the response
+    """
+    # Weak ETags, as the same page may be compressed, streamed, etc.
+    response.set_etag(build_etag(etag), weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+
+    response.cache_control.no_cache = True
+    # Pages of logged in users must not be stored by shared caches (e.g. a CDN)
+    if 'user_id' in session:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.vary.add('Cookie')
+
+    return response
+
+def not_modified(etag, last_modified=None):
+    """
+        Returns a "304 Not Modified" response if the request's validators
+        match the given ones, otherwise None.
+
+        "last_modified" is a naive UTC datetime (as stored by sqlite).
+    """
+    if not is_cacheable():
+        return None
+
+    # "If-None-Match" takes precedence, as it's more precise
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(build_etag(etag))
+    elif last_modified is not None and request.if_modified_since:
+        # HTTP dates have no fractions of a second
+        last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+        matched = request.if_modified_since >= last_modified
+    else:
+        matched = False
+
+    if not matched:
+        return None
+
+    return set_validators(
+        current_app.response_class(status=304), etag, last_modified
+    )
+
+
+# Text compresses very well (JSON and HTML often to a fifth of their size), so
+# compressing responses saves much more time on slow networks (e.g. mobile
+# clients) than it costs. Small responses aren't worth it: they already fit in
+# a few packets.
+#
+# The pages and the JSON API are compressed as they're sent (see
+# "compress_response"). The static files are compressed ahead of time (see
+# flaskr/assets.py).
+COMPRESSED_MIMETYPES = ('text/html', 'application/json')
+
+def compress(response, min_size=None):
+    """
+        Compresses the body of the response with gzip if the client accepts
+        it and it has at least "min_size" bytes ("COMPRESS_MIN_SIZE" by
+        default, None never compresses)
+    """
+    if min_size is None:
+        min_size = current_app.config['COMPRESS_MIN_SIZE']
+
+    # Caches must keep the compressed and uncompressed responses apart
+    response.vary.add('Accept-Encoding')
+
+    if (
+        min_size is None
+        or response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or 'Content-Encoding' in response.headers
+        or 'gzip' not in request.accept_encodings
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    # Level 6 (the default of the gzip tool) compresses almost as well as 9,
+    # several times faster
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def compress_response(response):
+    """
+        Compresses the pages and the JSON responses (see "compress")
+    """
+    if response.mimetype in COMPRESSED_MIMETYPES:
+        compress(response)
+    return response
+
+def init_app(app):
+    """
+        Computes the build id (after the static files are fingerprinted) and
+        compresses the responses
+    """
+    app.extensions['flaskr.build'] = (
+        app.config['BUILD_ID'] or compute_build_id(app)
+    )
+    app.after_request(compress_response)
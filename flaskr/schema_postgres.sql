@@ -0,0 +1,96 @@
+-- The same schema the migrations (see flaskr/migrations) build on sqlite, for
+-- the "postgresql" backend (see flaskr/backends.py). Times are stored in UTC,
+-- like sqlite's CURRENT_TIMESTAMP.
+
+DROP TABLE IF EXISTS post;
+DROP TABLE IF EXISTS "user";
+DROP TABLE IF EXISTS blog_state;
+
+CREATE TABLE "user" (
+  id SERIAL PRIMARY KEY,
+  username TEXT UNIQUE NOT NULL,
+  password TEXT NOT NULL
+);
+
+CREATE TABLE post (
+  id SERIAL PRIMARY KEY,
+  author_id INTEGER NOT NULL REFERENCES "user" (id),
+  created TIMESTAMP NOT NULL DEFAULT date_trunc('second', now() AT TIME ZONE 'utc'),
+  -- in milliseconds, so two quick edits still give different validators
+  updated TIMESTAMP NOT NULL DEFAULT date_trunc('milliseconds', now() AT TIME ZONE 'utc'),
+  title TEXT NOT NULL,
+  body TEXT NOT NULL,
+  -- See migrations/0005_post_authors.sql
+  author_username TEXT,
+  -- See migrations/0006_post_body_html.sql
+  body_html TEXT,
+  render_version INTEGER NOT NULL DEFAULT 0,
+  -- The full-text index of the post, used by the search page. Matches in the
+  -- title ("A") weigh 10 times more than in the body ("D") with "ts_rank".
+  search tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', title), 'A') ||
+    setweight(to_tsvector('english', body), 'D')
+  ) STORED
+);
+
+-- See migrations/0002_post_created_id.sql
+CREATE INDEX post_created_id ON post (created DESC, id DESC);
+
+CREATE INDEX post_author_id ON post (author_id, created DESC);
+
+CREATE INDEX post_search ON post USING GIN (search);
+
+-- See migrations/0003_blog_state.sql
+CREATE TABLE blog_state (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL,
+  modified TIMESTAMP NOT NULL
+);
+
+INSERT INTO blog_state (id, version, modified)
+VALUES (1, 0, date_trunc('second', now() AT TIME ZONE 'utc'));
+
+-- The triggers keep "blog_state" and "post.updated" up to date whatever changes
+-- the posts
+CREATE OR REPLACE FUNCTION post_touch() RETURNS trigger AS $$
+BEGIN
+  NEW.updated := date_trunc('milliseconds', clock_timestamp() AT TIME ZONE 'utc');
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION post_changed() RETURNS trigger AS $$
+BEGIN
+  UPDATE blog_state SET
+    version = version + 1,
+    modified = date_trunc('second', now() AT TIME ZONE 'utc');
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION post_author() RETURNS trigger AS $$
+BEGIN
+  SELECT username INTO NEW.author_username FROM "user" WHERE id = NEW.author_id;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_renamed() RETURNS trigger AS $$
+BEGIN
+  UPDATE post SET author_username = NEW.username WHERE author_id = NEW.id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER post_author BEFORE INSERT OR UPDATE OF author_id
+ON post FOR EACH ROW EXECUTE FUNCTION post_author();
+
+CREATE TRIGGER user_renamed AFTER UPDATE OF username
+ON "user" FOR EACH ROW EXECUTE FUNCTION user_renamed();
+
+-- "author_username" changes when the author is renamed (see "user_renamed")
+CREATE TRIGGER post_updated BEFORE UPDATE OF author_id, created, title, body, body_html, author_username
+ON post FOR EACH ROW EXECUTE FUNCTION post_touch();
+
+CREATE TRIGGER post_changed AFTER INSERT OR UPDATE OR DELETE
+ON post FOR EACH STATEMENT EXECUTE FUNCTION post_changed();
@@ -0,0 +1,84 @@
+# Compiling a template (parsing it and turning it into python code) takes much
+# longer than rendering it. Jinja only keeps the compiled templates in memory,
+# so every new process (e.g. a new instance of the app) compiled them again on
+# its first requests.
+#
+# The compiled templates are now also kept on disk, in "TEMPLATE_CACHE_DIR",
+# and loaded from there by the next processes (jinja checks they still match
+# the template sources). "flask precompile-templates" fills that directory
+# ahead of time (e.g. before deploying), and "PRECOMPILE_TEMPLATES" compiles
+# (or loads) every template when the app is created, instead of on the first
+# requests.
+#
+# Outside of debug mode, Flask doesn't check whether the template files
+# changed ("TEMPLATES_AUTO_RELOAD"), so a loaded template is never read again.
+
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """
+        A FileSystemBytecodeCache that keeps working if its directory can't
+        be written (e.g. a read-only deployment): the templates are then
+        compiled in memory as before
+    """
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+def precompile(app):
+    """
+        Compiles (or loads from the bytecode cache) every template of the
+        app and returns how many there are
+    """
+    names = [
+        name for name in app.jinja_env.list_templates()
+        if name.endswith('.html')
+    ]
+
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    return len(names)
+
+@click.command('precompile-templates')
+@with_appcontext
+def precompile_command():
+    """
+        Compile every template into the template cache.
+    """
+    start = time.perf_counter()
+    count = precompile(current_app)
+    click.echo(
+        f'Compiled {count} templates in {time.perf_counter() - start:.2f}s.'
+    )
+
+def init_app(app):
+    """
+        Sets up the bytecode cache of the templates and the
+        "precompile-templates" command
+    """
+    directory = app.config['TEMPLATE_CACHE_DIR']
+
+    if directory is not None:
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            pass
+
+        # Used by Flask when it creates "app.jinja_env", on first use
+        app.jinja_options = dict(
+            app.jinja_options, bytecode_cache=BytecodeCache(directory)
+        )
+
+    app.cli.add_command(precompile_command)
+
+    if app.config['PRECOMPILE_TEMPLATES']:
+        precompile(app)
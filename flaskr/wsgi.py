@@ -0,0 +1,10 @@
+# The WSGI entry point used by the servers (see "app.yaml"), e.g.:
+#
+#   waitress-serve --listen=*:8080 flaskr.wsgi:app
+#
+# The app is only created when this module is imported, so importing "flaskr"
+# itself (the tests, the "flask" command) doesn't build an extra app.
+
+from flaskr import create_app
+
+app = create_app()
@@ -1,7 +1,8 @@
 from setuptools import find_packages, setup
 
 # "packages" tells Python what package directories (and its .py files) to
-# include. "find_packages()" finds these directories automatically.
+# include. "find_packages()" finds these directories automatically (the
+# "benchmarks" scripts are left out of the distribution).
 # "include_package_data" is set to "True" to include other files (like the
 # "static" and "templates" directories). Thus, it's expected to have another
 # file named "MANIFEST.in" to tell what these files are.
@@ -10,9 +11,18 @@ from setuptools import find_packages, setup
 setup(
     name='flaskr',
     version='1.0.0',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     include_package_data=True,
     install_requires=[
         'flask'
     ],
+    # Optional dependencies, installed with e.g. "pip install flaskr[brotli]"
+    extras_require={
+        # the ASGI entry point (flaskr/asgi.py) and its async views
+        'async': ['a2wsgi', 'aiosqlite'],
+        # the "postgresql" database backend (flaskr/backends.py)
+        'postgresql': ['psycopg2'],
+        # brotli compressed static files (flaskr/assets.py)
+        'brotli': ['brotli'],
+    },
 )
\ No newline at end of file
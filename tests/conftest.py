@@ -6,7 +6,7 @@ import tempfile
 
 import pytest
 from flaskr import create_app
-from flaskr.db import get_db, init_db
+from flaskr.db import close_pool, get_db, init_db
 
 # Opens the "data.sql" in the "tests" directory and saves the testing SQL
 # script in the "_data_sql" variable
@@ -31,9 +31,22 @@ def app():
     # development configuration)
     #
     # "'TESTING': True" tells Flask that the app is in test mode
+    #
+    # Passwords are hashed on the test's thread, with the same method used by
+    # "tests/data.sql" (so logging in doesn't rehash them)
+    #
+    # The compiled templates aren't written to the instance folder
+    #
+    # The test client only closes the responses it's told to, so the slots
+    # of the admission control would never be given back (it's tested on its
+    # own in "tests/test_admission.py")
     app = create_app({
         'TESTING': True,
-        'DATABASE': db_path
+        'DATABASE': db_path,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:50000',
+        'PASSWORD_HASH_WORKERS': 0,
+        'TEMPLATE_CACHE_DIR': None,
+        'ADMISSION_CLASSES': None,
     })
 
     # "app.app_context()" creates a context that will make "current_app" point
@@ -50,7 +63,9 @@ def app():
     # "yield" produces a value, returns it and carry on with the remaining code
     yield app
 
-    # After the test is over, the temporary database file is closed and removed
+    # After the test is over, the pooled connections and the temporary database
+    # file are closed and the file is removed
+    close_pool(app)
     os.close(db_fd)
     os.unlink(db_path)
 
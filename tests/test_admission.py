@@ -0,0 +1,136 @@
+import threading
+
+from flaskr import create_app
+from flaskr.admission import AdmissionControl
+
+def make_app(**classes):
+    app = create_app({
+        'TESTING': True,
+        'TEMPLATE_CACHE_DIR': None,
+        'ADMISSION_CLASSES': classes,
+    })
+    return app, app.extensions['flaskr.admission']
+
+def test_classify():
+    app, admission = make_app(read={'limit': 1})
+
+    def classify(path, method='GET'):
+        return admission.classify({
+            'REQUEST_METHOD': method, 'PATH_INFO': path,
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+            'wsgi.url_scheme': 'http',
+        })
+
+    assert classify('/') == 'read'
+    assert classify('/auth/login') == 'read'
+    assert classify('/auth/login', 'POST') == 'auth'
+    assert classify('/1/update', 'POST') == 'write'
+    assert classify('/missing', 'POST') == 'write'
+    # The static files and the metrics are never limited
+    assert classify('/static/style.css') is None
+    assert classify('/metrics') is None
+
+def test_shed():
+    app, admission = make_app(read={'limit': 1, 'timeout': 2.5})
+    client = app.test_client()
+
+    # The first request holds the only slot until its response is closed
+    response = client.get('/hello')
+    assert admission.stats()['read']['in_flight'] == 1
+
+    # Without a queue, the next one is answered right away
+    shed = client.get('/hello')
+    assert shed.status_code == 503
+    assert shed.headers['Retry-After'] == '3'
+    assert admission.stats()['read']['shed'] == 1
+
+    # The metrics are still served, and count the shed requests
+    metrics = client.get('/metrics').data
+    assert b'flaskr_admission_shed_total{class="read"} 1' in metrics
+    assert b'flaskr_admission_requests{class="read",state="in_flight"} 1' in metrics
+
+    response.close()
+    assert client.get('/hello', buffered=True).status_code == 200
+    assert admission.stats()['read']['in_flight'] == 0
+
+def test_queue():
+    # A WSGI app whose requests only finish when told to
+    started = threading.Semaphore(0)
+    finish = threading.Event()
+
+    def wsgi_app(environ, start_response):
+        started.release()
+        finish.wait()
+        start_response('200 OK', [])
+        return [b'']
+
+    app, _ = make_app()
+    admission = AdmissionControl(
+        wsgi_app, app.url_map,
+        {'read': {'limit': 1, 'queue': 1, 'timeout': 5.0}}
+    )
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': '/',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+        'wsgi.url_scheme': 'http',
+    }
+    statuses = []
+
+    def request():
+        def start_response(status, headers):
+            statuses.append(status)
+        # Like a WSGI server: the response is read, then closed
+        response = admission(dict(environ), start_response)
+        list(response)
+        if hasattr(response, 'close'):
+            response.close()
+
+    first = threading.Thread(target=request)
+    first.start()
+    started.acquire()
+
+    # The second request waits for the first one...
+    second = threading.Thread(target=request)
+    second.start()
+    while admission.stats()['read']['waiting'] == 0:
+        pass
+
+    # ...and the third one doesn't fit in the queue
+    request()
+    assert statuses == ['503 SERVICE UNAVAILABLE']
+
+    finish.set()
+    first.join()
+    second.join()
+    assert statuses.count('200 OK') == 2
+
+def test_priority():
+    app, admission = make_app(
+        read={'limit': 1, 'queue': 1, 'timeout': 5.0},
+        auth={'limit': 1, 'queue': 1, 'timeout': 5.0},
+    )
+
+    assert admission.admit('read')
+    waiting = threading.Thread(target=admission.admit, args=('read',))
+    waiting.start()
+    while admission.stats()['read']['waiting'] == 0:
+        pass
+
+    # While reads wait, auth requests aren't admitted, even with free slots
+    # (with a queue, they'd wait for the reads first)
+    admission.classes['auth'].queue = 0
+    assert not admission.admit('auth')
+
+    admission.release('read')
+    waiting.join()
+    assert admission.admit('auth')
+
+def test_timeout():
+    app, admission = make_app(read={'limit': 1, 'queue': 1, 'timeout': 0.05})
+
+    assert admission.admit('read')
+    # Waits for the slot until the deadline, then gives up
+    assert not admission.admit('read')
+    assert admission.stats()['read'] == {
+        'in_flight': 1, 'waiting': 0, 'shed': 1
+    }
@@ -0,0 +1,126 @@
+import gzip
+
+import pytest
+from flaskr.db import get_db
+from flaskr.queries import get_stats
+
+@pytest.fixture
+def posts(app):
+    # Inserts 4 more posts, all of them newer than the one of "tests/data.sql"
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id, created)'
+            ' VALUES (?, ?, 1, ?)',
+            [(f'post {i}', 'body', f'2018-01-0{i} 00:00:00')
+             for i in range(2, 6)]
+        )
+        db.commit()
+
+def test_post(client):
+    response = client.get('/api/posts')
+
+    assert response.get_json() == {
+        'posts': [{
+            'id': 1,
+            'title': 'test title',
+            'body': 'test\nbody',
+            # Not rendered yet (see "tests/data.sql")
+            'body_html': None,
+            'created': '2018-01-01 00:00:00',
+            'author_id': 1,
+            'username': 'test',
+        }],
+        'older': None,
+        'newer': None,
+    }
+    # Compact JSON, without whitespace between the values
+    assert b'", "' not in response.data
+
+def test_pages(client, posts):
+    # The same cursors as the index (see "test_index_pagination")
+    response = client.get('/api/posts?limit=2&fields=title')
+    assert response.get_json() == {
+        'posts': [{'title': 'post 5'}, {'title': 'post 4'}],
+        'older': '2018-01-04 00:00:00_4',
+        'newer': None,
+    }
+
+    data = client.get(
+        '/api/posts?limit=2&fields=title&before=2018-01-04 00:00:00_4'
+    ).get_json()
+    assert [post['title'] for post in data['posts']] == ['post 3', 'post 2']
+    assert data['newer'] == '2018-01-03 00:00:00_3'
+
+    data = client.get(
+        '/api/posts?limit=2&fields=title&after=2018-01-03 00:00:00_3'
+    ).get_json()
+    assert [post['title'] for post in data['posts']] == ['post 5', 'post 4']
+    assert data['newer'] is None
+
+def test_ids(client, posts):
+    response = client.get('/api/posts?ids=3,1,42,3&fields=id,title')
+
+    # The posts come in the order of the ids, once each
+    assert response.get_json() == {
+        'posts': [
+            {'id': 3, 'title': 'post 3'},
+            {'id': 1, 'title': 'test title'},
+        ],
+        'missing': [42],
+    }
+
+def test_fields_not_read(app, client):
+    get_stats(app).clear()
+
+    # Leaving the body out of the fields leaves it out of the query too
+    client.get('/api/posts?fields=id,title')
+
+    statements = [stat['sql'] for stat in get_stats(app).summary()]
+    assert any('FROM post' in sql for sql in statements)
+    assert not any('body' in sql for sql in statements)
+
+@pytest.mark.parametrize(('query', 'message'), (
+    ('fields=id,password', b'Invalid fields password.'),
+    ('ids=1,a', b'Invalid ids 1,a.'),
+    ('ids=' + ','.join(map(str, range(101))), b'At most 100 ids.'),
+    ('limit=0', b'Invalid limit 0.'),
+    ('before=nope', b'Invalid cursor nope.'),
+))
+def test_invalid(client, query, message):
+    response = client.get(f'/api/posts?{query}')
+    assert response.status_code == 400
+    assert response.is_json
+    assert message in response.data
+
+def test_not_modified(client, app):
+    response = client.get('/api/posts')
+    etag = response.headers['ETag']
+
+    response = client.get('/api/posts', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    # Any change to the posts changes the ETag
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'changed' WHERE id = 1")
+        db.commit()
+
+    response = client.get('/api/posts', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+def test_compressed(app, client, posts):
+    headers = {'Accept-Encoding': 'gzip'}
+
+    # Small responses aren't worth compressing
+    response = client.get('/api/posts', headers=headers)
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.vary
+
+    app.config['COMPRESS_MIN_SIZE'] = 100
+    response = client.get('/api/posts', headers=headers)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert (
+        gzip.decompress(response.data)
+        == client.get('/api/posts').data
+    )
@@ -0,0 +1,173 @@
+import asyncio
+import urllib.parse
+
+import pytest
+
+# The ASGI app needs the optional "async" dependencies
+pytest.importorskip('aiosqlite')
+pytest.importorskip('a2wsgi')
+
+from flaskr import aiodb
+from flaskr.aioviews import AsyncViews
+from flaskr.db import PoolTimeout, get_db
+
+@pytest.fixture
+def asgi_app(app):
+    asgi_app = AsyncViews(app)
+    yield asgi_app
+    # Each aiosqlite connection has a thread, stopped when it's closed
+    asyncio.run(aiodb.close_pools(app))
+
+def request(asgi_app, method, path, headers=(), data=None):
+    """
+        Makes a request to the ASGI app, as an ASGI server would, and returns
+        its (status, headers, body)
+    """
+    path, _, query = path.partition('?')
+    body = urllib.parse.urlencode(data).encode() if data else b''
+    headers = [(b'host', b'localhost')] + [
+        (name.lower().encode(), value.encode()) for name, value in headers
+    ]
+    if data:
+        headers.append((b'content-type', b'application/x-www-form-urlencoded'))
+        headers.append((b'content-length', str(len(body)).encode()))
+
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': headers,
+        'client': ('127.0.0.1', 50000),
+        'server': ('localhost', 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+
+    start = messages[0]
+    return (
+        start['status'],
+        {name.decode(): value.decode() for name, value in start['headers']},
+        b''.join(m.get('body', b'') for m in messages[1:])
+    )
+
+def test_async_index(app, asgi_app):
+    status, headers, body = request(asgi_app, 'GET', '/')
+    assert status == 200
+    assert b'test title' in body
+    assert b'by test on 2018-01-01' in body
+
+    # The page was read by the async views (the sync pools weren't used),
+    # and their queries are counted like the sync ones
+    assert 'flaskr.db.read_pool' not in app.extensions
+    assert aiodb.get_pool(True, app).stats() == {
+        'open': 1, 'in_use': 0, 'idle': 1
+    }
+    assert 'desc="2 queries"' in headers['server-timing']
+
+    # Conditional requests are answered the same way as by the sync view
+    status, _, body = request(
+        asgi_app, 'GET', '/', [('If-None-Match', headers['etag'])]
+    )
+    assert status == 304
+    assert body == b''
+
+def test_async_index_pagination(app, asgi_app):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id, created)'
+            ' VALUES (?, ?, 1, ?)',
+            [(f'post {i}', '', f'2018-01-0{i} 00:00:00') for i in range(2, 4)]
+        )
+        db.commit()
+
+    app.config['POSTS_PER_PAGE'] = 2
+
+    _, _, body = request(asgi_app, 'GET', '/')
+    assert b'post 3' in body
+    assert b'/?before=2018-01-02+00:00:00_2' in body
+
+    _, _, body = request(asgi_app, 'GET', '/?before=2018-01-02 00:00:00_2')
+    assert b'test title' in body
+
+def test_async_detail(asgi_app):
+    status, _, body = request(asgi_app, 'GET', '/1')
+    assert status == 200
+    assert b'test title' in body
+
+    # Errors are handled by the app's error handlers
+    assert request(asgi_app, 'GET', '/2')[0] == 404
+
+def test_sync_views(app, asgi_app):
+    # The other requests go to the WSGI app, e.g. logging in...
+    status, headers, _ = request(
+        asgi_app, 'POST', '/auth/login',
+        data={'username': 'test', 'password': 'test'}
+    )
+    assert status == 302
+    cookie = headers['set-cookie'].split(';', 1)[0]
+
+    # ... and the async views see the same session, and load its user
+    _, _, body = request(asgi_app, 'GET', '/', [('Cookie', cookie)])
+    assert b'Log Out' in body
+    assert b'/1/update' in body
+
+    status, _, body = request(asgi_app, 'GET', '/create', [('Cookie', cookie)])
+    assert status == 200
+    assert b'New Post' in body
+
+def test_async_pool_waits():
+    async def run():
+        pool = aiodb.AsyncConnectionPool(':memory:', size=1, timeout=0.05)
+        db = await pool.acquire()
+
+        # The pool is full: the next request waits for the connection...
+        waiting = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+
+        pool.release(db)
+        assert await waiting is db
+
+        # ... but not forever
+        with pytest.raises(PoolTimeout):
+            await pool.acquire()
+
+        pool.release(db)
+        await pool.close()
+        assert pool.stats()['open'] == 0
+
+    asyncio.run(run())
+
+def test_lifespan_closes_pools(app, asgi_app):
+    request(asgi_app, 'GET', '/')
+    assert 'flaskr.aiodb.pools' in app.extensions
+
+    messages = iter([
+        {'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}
+    ])
+    sent = []
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(asgi_app({'type': 'lifespan'}, receive, send))
+
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    assert 'flaskr.aiodb.pools' not in app.extensions
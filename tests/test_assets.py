@@ -0,0 +1,111 @@
+import gzip
+
+import pytest
+from flask import url_for
+from flaskr import create_app
+from flaskr.db import get_db
+
+@pytest.fixture
+def assets_dir(app, tmp_path):
+    app.config['ASSETS_DIR'] = str(tmp_path)
+    return tmp_path
+
+def test_fingerprinted_url(app, client):
+    with app.test_request_context():
+        url = url_for('static', filename='style.css')
+
+    # e.g. "/static/style.235fb30be27d.css"
+    assert url.startswith('/static/style.')
+    assert url != '/static/style.css'
+
+    # The pages link to the fingerprinted URL
+    assert url.encode() in client.get('/').data
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/css'
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    assert response.cache_control.immutable
+    assert not response.cache_control.no_cache
+
+    # The plain URL is still served as before
+    response = client.get('/static/style.css')
+    assert response.status_code == 200
+    assert not response.cache_control.immutable
+
+def test_outdated_fingerprint(app, client):
+    # A page cached before a deploy links to the previous stylesheet
+    response = client.get('/static/style.0123456789ab.css')
+
+    # The current one is served, but not kept for long
+    assert response.status_code == 200
+    assert response.data == client.get('/static/style.css').data
+    assert response.cache_control.max_age == 5 * 60
+    assert not response.cache_control.immutable
+
+    assert client.get('/static/missing.0123456789ab.css').status_code == 404
+
+def test_build_etags(app, client):
+    etags = [client.get(path).headers['ETag'] for path in ('/', '/1')]
+    etags.append(client.get('/api/posts').headers['ETag'])
+
+    # After a deploy changing the templates or the static files, the pages
+    # and the API responses kept by the browsers don't match anymore
+    app.extensions['flaskr.build'] = 'next'
+    for path, etag in zip(('/', '/1', '/api/posts'), etags):
+        response = client.get(path, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'].startswith('W/"next-')
+
+def test_build_id():
+    # The same templates and static files give the same build id, unless
+    # it's set
+    builds = [
+        create_app({'TESTING': True, **config}).extensions['flaskr.build']
+        for config in ({}, {}, {'BUILD_ID': 'v1'})
+    ]
+    assert builds[0] == builds[1]
+    assert builds[2] == 'v1'
+
+def test_fingerprints_disabled():
+    app = create_app({'TESTING': True, 'STATIC_FINGERPRINTS': False})
+
+    with app.test_request_context():
+        assert url_for('static', filename='style.css') == '/static/style.css'
+
+def test_build_assets(app, client, runner, assets_dir):
+    with app.test_request_context():
+        url = url_for('static', filename='style.css')
+
+    result = runner.invoke(args=['build-assets'])
+    assert 'style.css' in result.output
+    assert list(assets_dir.glob('style.*.css.gz'))
+
+    # The compressed copy is sent to the clients accepting it...
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert response.cache_control.immutable
+    assert gzip.decompress(response.data) == client.get(url).data
+
+    # ...and the original file to the other ones
+    assert 'Content-Encoding' not in client.get(url).headers
+
+def test_compressed_pages(app, client):
+    # Makes the index big enough to be compressed
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id) VALUES (?, ?, 1)',
+            [(f'post {i}', 'body ' * 100) for i in range(5)]
+        )
+        db.commit()
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == client.get('/').data
+
+    # Pages smaller than "COMPRESS_MIN_SIZE" aren't compressed
+    app.config['COMPRESS_MIN_SIZE'] = 100000
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
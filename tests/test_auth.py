@@ -1,6 +1,8 @@
 import pytest
 from flask import g, session
+from flaskr.auth import forget_user, get_user
 from flaskr.db import get_db
+from flaskr.passwords import HashPoolFull, get_hasher
 
 def test_register(client, app):
     
@@ -83,4 +85,79 @@ def test_logout(client, auth):
     with client:
         auth.logout()
         # Tests if the "user_id" is not defined after the logout
-        assert 'user_id' not in session
\ No newline at end of file
+        assert 'user_id' not in session
+
+def test_get_user_cached(app):
+    with app.app_context():
+        user = get_user(1)
+        # The password hash is never loaded
+        assert user == {'id': 1, 'username': 'test'}
+
+        # The user is now cached, so a change made behind the app's back is
+        # only seen after the user is removed from the cache
+        db = get_db()
+        db.execute("UPDATE user SET username = 'changed' WHERE id = 1")
+        db.commit()
+        assert get_user(1)['username'] == 'test'
+
+        forget_user(1)
+        assert get_user(1)['username'] == 'changed'
+
+        assert get_user(3) is None
+
+def test_user_loaded_lazily(client, auth, monkeypatch):
+    auth.login()
+    loaded = []
+
+    def fake_get_user(user_id):
+        loaded.append(user_id)
+        return {'id': user_id, 'username': 'test'}
+
+    monkeypatch.setattr('flaskr.auth.get_user', fake_get_user)
+
+    # A view that never uses "g.user" doesn't load it
+    client.get('/hello')
+    assert loaded == []
+
+    # Using it (here, the index template) loads it once per request
+    client.get('/')
+    assert loaded == [1]
+
+def test_deleted_user_is_logged_out(app, client, auth):
+    auth.login()
+
+    with app.app_context():
+        db = get_db()
+        db.execute('DELETE FROM user WHERE id = 1')
+        db.commit()
+        forget_user(1)
+
+    # The session still has the "user_id", but the user doesn't exist anymore
+    assert client.get('/create').headers['Location'] == '/auth/login'
+
+def test_login_rehash(app, auth):
+    # The hash of the "test" user (see "tests/data.sql") is now outdated
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+
+    assert auth.login().headers['Location'] == '/'
+
+    # Logging in replaced it with a hash made with the new method, which
+    # still matches the password
+    with app.app_context():
+        pwhash = get_db().execute(
+            'SELECT password FROM user WHERE id = 1'
+        ).fetchone()[0]
+    assert pwhash.startswith('pbkdf2:sha256:1000$')
+    assert auth.login().headers['Location'] == '/'
+
+def test_login_hash_pool_full(app, auth, monkeypatch):
+    def full(*args):
+        raise HashPoolFull()
+
+    with app.app_context():
+        monkeypatch.setattr(get_hasher(), 'verify', full)
+
+    # When no password can be checked, the login fails fast with a 503
+    response = auth.login()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
@@ -1,5 +1,6 @@
 import pytest
-from flaskr.db import get_db
+from flaskr.cache import get_page_cache
+from flaskr.db import get_db, get_read_pool
 
 
 def test_index(client, auth):
@@ -33,6 +34,249 @@ def test_index(client, auth):
 
 
 
+# The pages are the same whether they're streamed or not
+@pytest.mark.parametrize('stream', (False, True))
+def test_index_pagination(app, client, stream):
+    # Inserts 4 more posts (the first one was inserted by the "tests/data.sql"
+    # script), all of them newer than the first one.
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id, created)'
+            ' VALUES (?, ?, 1, ?)',
+            [(f'post {i}', '', f'2018-01-0{i} 00:00:00') for i in range(2, 6)]
+        )
+        db.commit()
+
+    app.config['POSTS_PER_PAGE'] = 2
+    app.config['STREAM_INDEX'] = stream
+
+    # The first page shows the 2 newest posts and only the "Older" link.
+    response = client.get('/')
+    assert b'post 5' in response.data
+    assert b'post 4' in response.data
+    assert b'post 3' not in response.data
+    assert b'Newer' not in response.data
+    assert b'/?before=2018-01-04+00:00:00_4' in response.data
+
+    # Following the "Older" link shows the next 2 posts and both links.
+    response = client.get('/?before=2018-01-04 00:00:00_4')
+    assert b'post 3' in response.data
+    assert b'post 2' in response.data
+    assert b'post 4' not in response.data
+    assert b'/?after=2018-01-03+00:00:00_3' in response.data
+    assert b'/?before=2018-01-02+00:00:00_2' in response.data
+
+    # The last page only has the "Newer" link.
+    response = client.get('/?before=2018-01-02 00:00:00_2')
+    assert b'test title' in response.data
+    assert b'Older' not in response.data
+
+    # Going back to newer posts shows the same posts as the first page.
+    response = client.get('/?after=2018-01-03 00:00:00_3')
+    assert b'post 5' in response.data
+    assert b'post 4' in response.data
+    assert b'Newer' not in response.data
+
+def test_index_streamed(app, client, auth):
+    auth.login()
+    page = client.get('/').data
+
+    # A streamed page is the same as a rendered one
+    app.config['STREAM_INDEX'] = True
+    client.post('/1/update', data={'title': 'test title', 'body': 'test\nbody'})
+    response = client.get('/')
+    assert response.is_streamed
+    assert response.data == page
+    assert 'ETag' in response.headers
+
+    # but isn't cached
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'changed' WHERE id = 1")
+        db.commit()
+    assert b'changed' in client.get('/').data
+
+def test_index_streamed_connection(app, client):
+    app.config['STREAM_INDEX'] = True
+    pool = get_read_pool(app)
+
+    # The posts are read while the page is sent, so the connection isn't
+    # given back to the pool (and to another request) before...
+    response = client.get('/', buffered=False)
+    assert pool.stats()['in_use'] == 1
+    assert b'test title' in response.get_data()
+
+    # ... the response is closed
+    response.close()
+    assert pool.stats() == {'open': 1, 'in_use': 0, 'idle': 1}
+
+    # even if the client went away before the page was sent
+    response = client.get('/', buffered=False)
+    assert pool.stats()['in_use'] == 1
+    response.close()
+    assert pool.stats()['in_use'] == 0
+
+def test_index_cached(app, client, auth):
+    assert b'test title' in client.get('/').data
+
+    # The second request gets the cached page
+    assert b'test title' in client.get('/').data
+    assert get_page_cache(app).backend.hits == 1
+
+    # Pages are cached for the posts version they were read at, so even a
+    # change made behind the app's back (which still changes the version,
+    # see migrations/0003_blog_state.sql) isn't hidden by the cache
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'changed' WHERE id = 1")
+        db.commit()
+    assert b'changed' in client.get('/').data
+
+    # Logged in users don't get the anonymous page (it has no "Edit" links)
+    auth.login()
+    response = client.get('/')
+    assert b'changed' in response.data
+    assert b'href="/1/update"' in response.data
+
+def test_index_cache_invalidation(app, client, auth):
+    auth.login()
+    client.get('/')
+
+    # Creating, updating and deleting posts drops the cached pages showing
+    # them
+    client.post('/create', data={'title': 'created', 'body': ''})
+    assert b'created' in client.get('/').data
+
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    assert b'updated' in client.get('/').data
+
+    client.post('/1/delete')
+    assert b'updated' not in client.get('/').data
+
+def test_index_cache_disabled(app, client):
+    app.config['PAGE_CACHE_SIZE'] = 0
+    client.get('/')
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'changed' WHERE id = 1")
+        db.commit()
+    assert b'changed' in client.get('/').data
+
+def test_index_not_modified(app, client, auth):
+    response = client.get('/')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+
+    # Sending the validators back gets an empty "304 Not Modified"
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    response = client.get('/', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+
+    # The page of a logged in user has another ETag
+    auth.login()
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    etag = response.headers['ETag']
+
+    # Any change to the posts changes the ETag
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'updated' in response.data
+
+def test_detail(client, auth):
+    response = client.get('/1')
+    assert b'test title' in response.data
+    assert b'by test on 2018-01-01' in response.data
+    assert b'href="/1/update"' not in response.data
+
+    # The author sees the "Edit" link
+    auth.login()
+    assert b'href="/1/update"' in client.get('/1').data
+
+    assert client.get('/2').status_code == 404
+
+def test_detail_not_modified(client, auth):
+    etag = client.get('/1').headers['ETag']
+    response = client.get('/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    # Updating the post changes its ETag
+    auth.login()
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    auth.logout()
+    response = client.get('/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'updated' in response.data
+
+def test_search(app, client, auth):
+    # The post inserted by "tests/data.sql" is found by any of its words, with
+    # them highlighted
+    response = client.get('/search?q=body')
+    assert b'href="/1"' in response.data
+    assert b'<mark>body</mark>' in response.data
+
+    assert b'No posts match' in client.get('/search?q=nothing').data
+
+    # The search index follows the changes made to the posts
+    auth.login()
+    client.post('/create', data={'title': 'second', 'body': 'some <b>body</b>'})
+    client.post('/1/update', data={'title': 'renamed', 'body': 'other'})
+
+    response = client.get('/search?q=body')
+    assert b'href="/2"' in response.data
+    assert b'href="/1"' not in response.data
+    # The post body is escaped, only the matches are marked
+    assert b'&lt;b&gt;<mark>body</mark>&lt;/b&gt;' in response.data
+
+    client.post('/2/delete')
+    assert b'href="/2"' not in client.get('/search?q=body').data
+
+def test_search_ranking(app, client):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id) VALUES (?, ?, 1)',
+            [('other', 'word in the body'), ('word', 'in the title')]
+        )
+        db.commit()
+
+    app.config['POSTS_PER_PAGE'] = 1
+
+    # Matches in the title come first, and the results are paginated
+    response = client.get('/search?q=word')
+    assert b'href="/3"' in response.data
+    assert b'href="/2"' not in response.data
+    assert b'/search?q=word&amp;page=2' in response.data
+
+    response = client.get('/search?q=word&page=2')
+    assert b'href="/2"' in response.data
+    assert b'Next' not in response.data
+
+# FTS5 operators typed by the user are searched as plain words
+@pytest.mark.parametrize('q', ('"', 'body AND', 'title:test', 'NEAR(', '*'))
+def test_search_operators(client, q):
+    assert client.get('/search', query_string={'q': q}).status_code == 200
+
+# A cursor that can't be decoded is a bad request
+@pytest.mark.parametrize('query', (
+    '?before=nonsense',
+    '?after=2018-01-01_x',
+    # The timestamp must be one
+    '?before=zzz_1',
+    '?before=2018-13-01 00:00:00_1',
+    '?before=2018-01-01T00:00:00%2B02:00_1',
+))
+def test_index_invalid_cursor(client, query):
+    assert client.get('/' + query).status_code == 400
+
+
 # "@pytest.mark.parametrize" tells Pytest to run the same test function with
 # different arguments. This is useful here so writting the same code multiple
 # times isn't needed. Here, the "test_login_required" is called 3 times, and
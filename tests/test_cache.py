@@ -0,0 +1,82 @@
+from flaskr.cache import LRUCache, PageCache
+
+def test_lru_cache_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+
+    # Reading "a" makes "b" the least recently used value, so it's the one
+    # dropped when "c" is stored
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+def test_lru_cache_ttl(monkeypatch):
+    now = [100.0]
+    # "monkeypatch.setattr" replaces the clock used by the cache, so the test
+    # doesn't need to wait for the values to expire
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+
+    cache = LRUCache(ttl=10)
+    cache.set('a', 1)
+    now[0] += 9
+    assert cache.get('a') == 1
+
+    # After "ttl" seconds the value is treated as missing
+    now[0] += 1
+    assert cache.get('a') is None
+
+def test_page_cache_invalidate():
+    cache = PageCache(LRUCache())
+    cache.set('page 1', 'one', [('post', 1), 'newest'])
+    cache.set('page 2', 'two', [('post', 2)])
+
+    # Only the pages with the invalidated tag are dropped
+    cache.invalidate(('post', 1))
+    assert cache.get('page 1') is None
+    assert cache.get('page 2') == 'two'
+
+    cache.clear()
+    assert cache.get('page 2') is None
+
+def test_page_cache_forgets_tags():
+    cache = PageCache(LRUCache(maxsize=2))
+    for i in range(100):
+        cache.set(f'page {i}', i, [('post', i), 'newest'])
+
+    # The tags of the pages dropped by the backend are forgotten with them
+    assert len(cache) == 2
+    assert cache._tags == {
+        ('post', 98): {'page 98'}, ('post', 99): {'page 99'},
+        'newest': {'page 98', 'page 99'},
+    }
+
+    # A page stored again only keeps its new tags
+    cache.set('page 99', 99, [('post', 1)])
+    assert ('post', 99) not in cache._tags
+
+    cache.invalidate('newest')
+    assert len(cache) == 1
+    assert cache._tags == {('post', 1): {'page 99'}}
+
+def test_page_cache_max_keys(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+
+    backend = LRUCache(maxsize=10, ttl=10)
+    cache = PageCache(backend, max_keys=2)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, key, ['tag'])
+
+    # The oldest page is removed along with its tags, as it could never be
+    # invalidated anymore
+    assert len(cache) == 2
+    assert backend.get('a') is None
+    assert cache._tags == {'tag': {'b', 'c'}}
+
+    # So are the pages found expired
+    now[0] += 10
+    assert cache.get('b') is None
+    assert cache._tags == {'tag': {'c'}}
@@ -1,9 +1,19 @@
+import io
 import sqlite3
+import threading
+from datetime import datetime
 
 import pytest
-from flaskr.db import get_db
+from flaskr.db import (
+    MIGRATIONS, ConnectionPool, GroupCommitWriter, PoolTimeout, WriteTimeout,
+    close_pool, execute_write, get_db, get_read_db, get_schema_version,
+    get_writer, migrate, retry_on_busy
+)
 
 def test_get_close_db(app):
+    # Disables the pool, so every app context opens its own connection
+    app.config['DATABASE_POOL_SIZE'] = 0
+
     with app.app_context():
         db = get_db()
         # With an app context, "get_db" should return the same connection each
@@ -20,6 +30,387 @@ def test_get_close_db(app):
     # After the app context, the connection should be closed
     assert 'closed' in str(e.value)
 
+def test_get_db_pooled(app):
+    with app.app_context():
+        db = get_db()
+
+    # After the app context, the connection goes back to the pool and is
+    # still open, so the next app context (on the same thread) reuses it
+    with app.app_context():
+        assert get_db() is db
+        assert db.execute('SELECT 1').fetchone()[0] == 1
+
+def test_pool_timeout(app):
+    pool = ConnectionPool(app.config['DATABASE'], size=1, timeout=0.01)
+    db = pool.acquire()
+
+    # The only connection is checked out, so the next checkout times out
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    # Once released, it can be checked out again
+    pool.release(db)
+    assert pool.acquire() is db
+    pool.close()
+
+def test_pool_per_thread(app):
+    pool = ConnectionPool(app.config['DATABASE'], size=2)
+    used = {}
+
+    # Each thread checks out a connection twice, releasing it in between
+    def worker(name, barrier):
+        first = pool.acquire()
+        barrier.wait()
+        pool.release(first)
+        barrier.wait()
+        used[name] = (first, pool.acquire())
+
+    barrier = threading.Barrier(2)
+    threads = [
+        threading.Thread(target=worker, args=(name, barrier))
+        for name in ('a', 'b')
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Both threads got back the connection they had used before
+    assert used['a'][0] is used['a'][1]
+    assert used['b'][0] is used['b'][1]
+    assert used['a'][0] is not used['b'][0]
+    pool.close()
+
+def test_pool_health_check(app):
+    pool = ConnectionPool(app.config['DATABASE'], size=1)
+    db = pool.acquire()
+    pool.release(db)
+
+    # A broken connection is replaced by a new one on checkout
+    db.close()
+    new_db = pool.acquire()
+    assert new_db is not db
+    assert new_db.execute('SELECT 1').fetchone()[0] == 1
+    pool.close()
+
+# GET requests read from read-only connections, other requests (and code
+# outside of requests) from the primary ones
+def test_read_only_connections(app):
+    with app.test_request_context('/'):
+        db = get_read_db()
+        assert db is not get_db()
+        assert db.execute('SELECT title FROM post').fetchone()[0] == 'test title'
+
+        with pytest.raises(sqlite3.OperationalError, match='readonly'):
+            db.execute("UPDATE post SET title = 'changed'")
+
+    with app.test_request_context('/1/update', method='POST'):
+        assert get_read_db() is get_db()
+
+    with app.app_context():
+        assert get_read_db() is get_db()
+
+    app.config['DATABASE_READS'] = 'primary'
+    with app.test_request_context('/'):
+        assert get_read_db() is get_db()
+
+@pytest.fixture
+def replica_app(app, tmp_path):
+    app.config.update(
+        DATABASE_READS='replica',
+        DATABASE_REPLICA=str(tmp_path / 'replica.sqlite'),
+        DATABASE_REPLICA_INTERVAL=60
+    )
+    return app
+
+def count_posts():
+    return get_read_db().execute('SELECT COUNT(*) FROM post').fetchone()[0]
+
+def test_replica(replica_app):
+    with replica_app.test_request_context('/'):
+        assert count_posts() == 1
+
+    with replica_app.app_context():
+        execute_write(
+            "INSERT INTO post (title, body, author_id) VALUES ('new', '', 1)"
+        )
+
+    # The replica is only copied again after "DATABASE_REPLICA_INTERVAL"
+    with replica_app.test_request_context('/'):
+        assert count_posts() == 1
+
+    replica = replica_app.extensions['flaskr.db.replica']
+    replica.refreshed -= 60
+    with replica_app.test_request_context('/'):
+        assert count_posts() == 2
+
+    # Without changes, the database isn't copied again
+    assert not replica.refresh()
+
+def test_replica_reads_own_writes(replica_app, client, auth):
+    auth.login()
+    client.get('/')
+    client.post('/create', data={'title': 'created', 'body': ''})
+
+    # The replica doesn't have the new post, but the user who wrote it reads
+    # from the primary connections for a while
+    assert b'created' in client.get('/').data
+
+    # Other users read the replica
+    other = replica_app.test_client()
+    assert b'created' not in other.get('/').data
+
+def test_replica_page_cache(replica_app, client, auth):
+    other = replica_app.test_client()
+    other.get('/')
+
+    # A post is created, dropping the cached pages showing the newest posts
+    auth.login()
+    client.post('/create', data={'title': 'created', 'body': ''})
+
+    # Reading the lagging replica caches the old page again...
+    response = other.get('/')
+    assert b'created' not in response.data
+
+    # ...but only for the old version, so once the replica is refreshed the
+    # page and its ETag are both new
+    replica_app.extensions['flaskr.db.replica'].refreshed -= 60
+    refreshed = other.get(
+        '/', headers={'If-None-Match': response.headers['ETag']}
+    )
+    assert refreshed.status_code == 200
+    assert b'created' in refreshed.data
+
+def test_replica_new_user(replica_app, client, auth):
+    client.get('/')
+    client.post(
+        '/auth/register', data={'username': 'new', 'password': 'new'}
+    )
+    auth.login('new', 'new')
+
+    # The new user isn't in the replica, but is still logged in
+    assert b'Log Out' in client.get('/').data
+
+# The pragmas of the chosen profile are applied to every new connection
+@pytest.mark.parametrize(('profile', 'synchronous'), (
+    ('durable', 2),
+    ('fast', 1),
+))
+def test_pragma_profiles(app, profile, synchronous):
+    app.config['DATABASE_POOL_SIZE'] = 0
+    app.config['DATABASE_PRAGMAS'] = profile
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA synchronous').fetchone()[0] == synchronous
+
+def test_retry_on_busy(app, monkeypatch):
+    # Doesn't wait between retries
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    calls = []
+
+    # Fails with "database is locked" the first 2 times it's called
+    def locked_twice():
+        calls.append(1)
+        if len(calls) <= 2:
+            raise sqlite3.OperationalError('database is locked')
+        return 'done'
+
+    with app.app_context():
+        assert retry_on_busy(locked_twice) == 'done'
+        assert len(calls) == 3
+
+        # Gives up (raising the error) after the configured retries
+        calls.clear()
+        app.config['DATABASE_BUSY_RETRIES'] = 1
+        with pytest.raises(sqlite3.OperationalError):
+            retry_on_busy(locked_twice)
+        assert len(calls) == 2
+
+        # ...or when the next wait would go past the deadline
+        calls.clear()
+        app.config['DATABASE_BUSY_RETRIES'] = 5
+        app.config['DATABASE_BUSY_DEADLINE'] = 0.01
+        with pytest.raises(sqlite3.OperationalError):
+            retry_on_busy(locked_twice)
+        assert len(calls) == 1
+
+    # Any other error is raised right away
+    def broken():
+        calls.append(1)
+        raise sqlite3.OperationalError('no such table: nothing')
+
+    calls.clear()
+    with app.app_context():
+        with pytest.raises(sqlite3.OperationalError):
+            retry_on_busy(broken)
+    assert len(calls) == 1
+
+def test_execute_write_locked(app):
+    # New connections don't wait for locks by themselves
+    app.config['DATABASE_POOL_SIZE'] = 0
+    app.config['DATABASE_PRAGMAS'] = {'busy_timeout': 0}
+    app.config['DATABASE_BUSY_BACKOFF'] = 0.05
+
+    # Another connection holds the write lock for a moment
+    other = sqlite3.connect(app.config['DATABASE'], check_same_thread=False)
+    other.execute('BEGIN IMMEDIATE')
+    timer = threading.Timer(0.1, other.commit)
+    timer.start()
+
+    # The write keeps retrying until the lock is released
+    with app.app_context():
+        execute_write("UPDATE post SET title = 'locked' WHERE id = 1")
+        title = get_db().execute('SELECT title FROM post').fetchone()[0]
+        assert title == 'locked'
+
+    timer.join()
+    other.close()
+
+def test_group_commit(app):
+    # A long window, so the writes below all make it into the same batch
+    writer = GroupCommitWriter(app.config['DATABASE'], window=0.5)
+    futures = [
+        writer.submit(
+            'INSERT INTO user (username, password) VALUES (?, ?)',
+            (username, 'x')
+        )
+        for username in ('a', 'b', 'test', 'c')
+    ]
+
+    # The "test" user already exists: only its write fails...
+    assert isinstance(futures[2].exception(), sqlite3.IntegrityError)
+
+    # ...and the others are committed together, each with its own result
+    ids = [futures[i].result().lastrowid for i in (0, 1, 3)]
+    assert writer.commits == 1
+    assert writer.writes == 4
+    writer.close()
+
+    with app.app_context():
+        rows = get_db().execute(
+            'SELECT id, username FROM user WHERE id IN (?, ?, ?) ORDER BY id',
+            ids
+        ).fetchall()
+        assert [row['username'] for row in rows] == ['a', 'b', 'c']
+
+def test_group_commit_locked(app):
+    app.config['DATABASE_GROUP_COMMIT'] = True
+    app.config['DATABASE_PRAGMAS'] = {'busy_timeout': 0}
+    app.config['DATABASE_BUSY_BACKOFF'] = 0.05
+
+    other = sqlite3.connect(app.config['DATABASE'], check_same_thread=False)
+    other.execute('BEGIN IMMEDIATE')
+    timer = threading.Timer(0.1, other.commit)
+    timer.start()
+
+    # The whole batch fails while the lock is held, and the request retries
+    with app.app_context():
+        execute_write("UPDATE post SET title = 'locked' WHERE id = 1")
+        title = get_db().execute('SELECT title FROM post').fetchone()[0]
+        assert title == 'locked'
+
+    timer.join()
+    other.close()
+
+    # Closing the app's pool stops the writer thread
+    writer = get_writer(app)
+    close_pool(app)
+    assert writer._thread is None
+    assert 'flaskr.db.writer' not in app.extensions
+
+def test_group_commit_writer_fails(app, tmp_path, monkeypatch):
+    # The writer thread can't even open its connection
+    writer = GroupCommitWriter(str(tmp_path / 'missing' / 'db'))
+    future = writer.submit("UPDATE post SET title = 'x'")
+    assert isinstance(future.exception(timeout=5), sqlite3.OperationalError)
+    assert writer._thread is None
+
+    # The next write starts a new thread
+    writer.database = app.config['DATABASE']
+    assert writer.submit("UPDATE post SET title = 'x'").result(5).rowcount == 1
+
+    # A failure outside of a commit fails the writes of the batch and the
+    # queued ones, instead of leaving them waiting
+    started = threading.Event()
+    failing = threading.Event()
+
+    def commit(db, batch):
+        started.set()
+        failing.wait(5)
+        raise RuntimeError('writer failed')
+
+    monkeypatch.setattr(writer, '_commit', commit)
+    futures = [writer.submit("UPDATE post SET title = 'y'")]
+    started.wait(5)
+    futures.append(writer.submit("UPDATE post SET title = 'z'"))
+    failing.set()
+
+    for future in futures:
+        assert isinstance(future.exception(timeout=5), RuntimeError)
+    writer.close()
+
+def test_group_commit_timeout(app, monkeypatch):
+    app.config['DATABASE_GROUP_COMMIT'] = True
+    app.config['DATABASE_BUSY_DEADLINE'] = 0.1
+    writer = get_writer(app)
+
+    # The writer thread is stuck on a first write...
+    stuck = threading.Event()
+    commit = writer._commit
+
+    def slow_commit(db, batch):
+        stuck.wait(5)
+        commit(db, batch)
+
+    monkeypatch.setattr(writer, '_commit', slow_commit)
+    first = writer.submit("UPDATE post SET title = 'first' WHERE id = 1")
+
+    # ... so the request gives its write up after the deadline
+    with app.app_context():
+        with pytest.raises(WriteTimeout):
+            execute_write("UPDATE post SET title = 'given up' WHERE id = 1")
+
+    # and the writer doesn't commit it afterwards
+    stuck.set()
+    first.result(5)
+    writer.close()
+
+    with app.app_context():
+        title = get_db().execute('SELECT title FROM post').fetchone()[0]
+        assert title == 'first'
+
+def test_group_commit_register(app):
+    app.config['DATABASE_GROUP_COMMIT'] = True
+
+    # Registrations from concurrent requests, one of them a duplicate
+    results = {}
+
+    def register(username):
+        response = app.test_client().post(
+            '/auth/register', data={'username': username, 'password': 'a'}
+        )
+        results[username] = response
+
+    threads = [
+        threading.Thread(target=register, args=(username,))
+        for username in ('u1', 'u2', 'test', 'u3')
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert b'already registered' in results['test'].data
+    for username in ('u1', 'u2', 'u3'):
+        assert results[username].headers['Location'] == '/auth/login'
+
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM user').fetchone()[0] == 5
+
+    close_pool(app)
+
 
 # "runner" is a fixture defined in the "conftest" module
 # "monkeypatch" is a fixture from Pytest
@@ -46,3 +437,223 @@ def test_init_db_command(runner, monkeypatch):
     # Tests if the "fake_init_db" is indeed called by the "init-db" command
     assert Recorder.called
 
+
+def test_rebuild_search_index(app, runner):
+    # Empties the search index behind the triggers' back
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO post_search (post_search) VALUES ('delete-all')")
+        db.commit()
+
+    result = runner.invoke(args=['rebuild-search-index'])
+    assert 'Rebuilt' in result.output
+
+    with app.app_context():
+        found = get_db().execute(
+            "SELECT rowid FROM post_search WHERE post_search MATCH 'test'"
+        ).fetchall()
+        assert [row[0] for row in found] == [1]
+
+def test_post_authors(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute(
+            'SELECT author_username FROM post WHERE id = 1'
+        ).fetchone()[0] == 'test'
+
+        # Posts given to another author or of a renamed author follow them
+        execute_write('UPDATE post SET author_id = 2 WHERE id = 1')
+        execute_write("UPDATE user SET username = 'renamed' WHERE id = 2")
+        assert db.execute(
+            'SELECT author_username FROM post WHERE id = 1'
+        ).fetchone()[0] == 'renamed'
+
+# A database created by the first "schema.sql", before the migrations
+LEGACY_SCHEMA = """
+DROP TABLE post_search;
+DROP TABLE post;
+DROP TABLE user;
+DROP TABLE blog_state;
+DROP TABLE schema_version;
+
+CREATE TABLE user (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  username TEXT UNIQUE NOT NULL,
+  password TEXT NOT NULL
+);
+
+CREATE TABLE post (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  author_id INTEGER NOT NULL,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  title TEXT NOT NULL,
+  body TEXT NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id)
+);
+
+INSERT INTO user (username, password) VALUES ('test', 'hash');
+INSERT INTO post (title, body, author_id, created)
+VALUES ('old title', 'old body', 1, '2018-01-01 00:00:00');
+"""
+
+def test_migrate_legacy(app, runner):
+    with app.app_context():
+        get_db().executescript(LEGACY_SCHEMA)
+
+    result = runner.invoke(args=['migrate', '--dry-run'])
+    assert 'Pending 0002_post_created_id.' in result.output
+    assert 'Applied' not in result.output
+    assert 'version 1' in result.output
+
+    result = runner.invoke(args=['migrate'])
+    assert 'Applied 0001_initial' not in result.output
+    for name in ('0002_post_created_id', '0003_blog_state',
+                 '0004_post_search', '0005_post_authors',
+                 '0006_post_body_html', '0007_user_renamed_state'):
+        assert f'Applied {name} in' in result.output
+    assert f'version {len(MIGRATIONS)}' in result.output
+
+    # The old post has everything added by the migrations
+    with app.app_context():
+        post = get_db().execute(
+            'SELECT updated, author_username FROM post WHERE id = 1'
+        ).fetchone()
+        assert post['updated'] == datetime(2018, 1, 1)
+        assert post['author_username'] == 'test'
+        assert get_db().execute(
+            "SELECT rowid FROM post_search WHERE post_search MATCH 'old'"
+        ).fetchone()[0] == 1
+
+    # Nothing is left to apply
+    result = runner.invoke(args=['migrate'])
+    assert 'Applied' not in result.output
+
+def test_migrate_target(app, runner):
+    with app.app_context():
+        get_db().executescript(LEGACY_SCHEMA)
+
+    result = runner.invoke(args=['migrate', '--target', '3'])
+    assert 'Applied 0003_blog_state' in result.output
+    assert '0004' not in result.output
+    assert 'version 3' in result.output
+
+def test_migrate_created_without_versions(app):
+    # A database with the whole schema, created before "schema_version"
+    with app.app_context():
+        get_db().execute('DROP TABLE schema_version')
+
+        assert get_schema_version() == len(MIGRATIONS)
+        assert list(migrate()) == []
+
+def test_migrate_failure(app, monkeypatch):
+    # A migration that fails halfway leaves no trace
+    monkeypatch.setattr(
+        'flaskr.db.MIGRATIONS', MIGRATIONS + (('0008_broken', None),)
+    )
+
+    def open_resource(name):
+        return io.BytesIO(b'CREATE TABLE half (id);\nNOT SQL;')
+
+    monkeypatch.setattr(app, 'open_resource', open_resource)
+
+    with app.app_context():
+        with pytest.raises(sqlite3.OperationalError):
+            list(migrate())
+
+        assert get_schema_version() == len(MIGRATIONS)
+        assert get_db().execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'half'"
+        ).fetchone() is None
+
+# Exporting the posts and importing them back creates a copy of each of them
+@pytest.mark.parametrize('filename', ('posts.jsonl', 'posts.csv'))
+def test_export_import_posts(app, runner, tmp_path, filename):
+    path = str(tmp_path / filename)
+
+    # The line breaks of the bodies are kept as they are (browsers send
+    # "\r\n")
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET body = 'line1\r\nline2' WHERE id = 1")
+        db.commit()
+
+    result = runner.invoke(args=['export-posts', path])
+    assert 'Exported 1 posts' in result.output
+
+    result = runner.invoke(args=['import-posts', path, '--batch-size', '1'])
+    assert 'Imported 1 posts' in result.output
+
+    with app.app_context():
+        posts = get_db().execute(
+            'SELECT title, body, author_id, created FROM post ORDER BY id'
+        ).fetchall()
+    assert len(posts) == 2
+    assert tuple(posts[0]) == tuple(posts[1])
+
+def test_import_posts_batches(app, runner):
+    posts = ''.join(
+        f'{{"title": "post {i}", "body": "", "author": "other"}}\n'
+        for i in range(5)
+    )
+
+    result = runner.invoke(
+        args=['import-posts', '-', '--batch-size', '2'], input=posts
+    )
+    assert 'Imported 5 posts' in result.output
+
+    with app.app_context():
+        count = get_db().execute(
+            'SELECT COUNT(*) FROM post WHERE author_id = 2'
+        ).fetchone()[0]
+    assert count == 5
+
+def test_import_posts_unknown_author(runner):
+    result = runner.invoke(
+        args=['import-posts', '-'],
+        input='{"title": "t", "body": "", "author": "nobody"}\n'
+    )
+    assert result.exit_code != 0
+    assert 'Unknown author nobody' in result.output
+
+# The times are stored the way sqlite writes them, in UTC
+@pytest.mark.parametrize(('created', 'stored'), (
+    ('2020-01-01 10:00:00', datetime(2020, 1, 1, 10)),
+    ('2020-01-01T10:00:00Z', datetime(2020, 1, 1, 10)),
+    ('2020-01-01T12:00:00+02:00', datetime(2020, 1, 1, 10)),
+    ('2020-01-01', datetime(2020, 1, 1)),
+))
+def test_import_posts_created(app, client, runner, created, stored):
+    result = runner.invoke(args=['import-posts', '-'], input=(
+        f'{{"title": "t", "body": "", "author": "test",'
+        f' "created": "{created}"}}\n'
+    ))
+    assert 'Imported 1 posts' in result.output
+
+    with app.app_context():
+        assert get_db().execute(
+            'SELECT created FROM post WHERE id = 2'
+        ).fetchone()[0] == stored
+
+    # The post can still be read
+    assert client.get('/').status_code == 200
+
+@pytest.mark.parametrize(('args', 'input', 'message'), (
+    ([], '{"title": "t", "author": "test", "created": "yesterday"}\n',
+     "Invalid created time 'yesterday'"),
+    ([], '{"title": "t", "author": "test"}\n\n{"title": \n',
+     'Line 3: Expecting value'),
+    ([], '["t"]\n', 'Line 1: not a JSON object'),
+    (['--format', 'csv'], 'title,author\n"t,test\n',
+     'Line 2: unexpected end of data'),
+    (['--format', 'csv'], 'title,author\nt,test\n"t"x,test\n',
+     "Line 3: ',' expected after"),
+))
+def test_import_posts_invalid(app, runner, args, input, message):
+    result = runner.invoke(args=['import-posts', '-', *args], input=input)
+    assert result.exit_code != 0
+    assert message in result.output
+
+    # Nothing was imported, and there's no traceback
+    assert result.exception is None or isinstance(result.exception, SystemExit)
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM post').fetchone()[0] == 1
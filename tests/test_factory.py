@@ -2,6 +2,9 @@
 # config. If the config is not passed, there should be some default
 # configuration, otherwise the configuration should be overridden.
 
+import logging
+
+import flaskr
 from flaskr import create_app
 
 def test_config():
@@ -22,3 +25,44 @@ def test_config():
 def test_hello(client):
     response = client.get('/hello')
     assert response.data == b'Hello, World!'
+
+def test_no_app_on_import():
+    # Importing the package doesn't create an app, only "flaskr.wsgi" does
+    assert not hasattr(flaskr, 'app')
+
+def test_startup_timings(caplog):
+    # "caplog" is a fixture from Pytest that captures the logged records
+    with caplog.at_level(logging.DEBUG, logger='flaskr'):
+        app = create_app({'TESTING': True})
+
+    assert 'Created the app in' in caplog.text
+    assert set(app.extensions['flaskr.startup']) == {
+        'config', 'db', 'blueprints', 'templates', 'assets', 'admission'
+    }
+
+def test_template_cache(tmp_path):
+    # The compiled templates are written to "TEMPLATE_CACHE_DIR"...
+    cache = tmp_path / 'templates'
+    app = create_app({'TESTING': True, 'TEMPLATE_CACHE_DIR': str(cache)})
+    result = app.test_cli_runner().invoke(args=['precompile-templates'])
+
+    assert 'Compiled' in result.output
+    assert len(list(cache.iterdir())) == len(
+        [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    )
+
+    # ...and loaded from there by the next apps, which can also compile every
+    # template on startup
+    app = create_app({
+        'TESTING': True,
+        'TEMPLATE_CACHE_DIR': str(cache),
+        'PRECOMPILE_TEMPLATES': True,
+    })
+    # (jinja's in-memory cache is keyed by loader and template name)
+    assert 'blog/index.html' in [
+        name for _, name in app.jinja_env.cache.keys()
+    ]
+
+def test_template_cache_disabled(app):
+    # The "app" fixture keeps the compiled templates in memory only
+    assert app.jinja_env.bytecode_cache is None
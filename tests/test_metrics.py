@@ -0,0 +1,88 @@
+import threading
+
+from flaskr.metrics import Metrics
+
+def test_metrics_endpoint(client):
+    client.get('/')
+    client.get('/')
+    client.get('/nothing')
+
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+
+    # Both index requests were counted, in the histograms and the responses
+    assert 'flaskr_request_duration_seconds_count{endpoint="blog.index"} 2' in text
+    assert 'flaskr_request_db_seconds_count{endpoint="blog.index"} 2' in text
+    assert 'flaskr_responses_total{endpoint="blog.index",status="2xx"} 2' in text
+    assert 'flaskr_responses_total{endpoint="none",status="4xx"} 1' in text
+
+    # The "/metrics" request itself is being handled
+    assert 'flaskr_requests_in_flight 1' in text
+
+    # The pool and cache stats (the second index request was a cache hit)
+    assert 'flaskr_db_connections{pool="primary",state="idle"}' in text
+    # The GET requests read from the read-only pool (see "DATABASE_READS")
+    assert 'flaskr_db_connections{pool="readonly",state="in_use"} 0' in text
+    assert 'flaskr_cache_requests_total{cache="page",result="hit"} 1' in text
+
+def test_histogram_buckets():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.started()
+    metrics.finished('a', 200, 0.05, 0.0)
+    metrics.started()
+    metrics.finished('a', 500, 0.5, 0.0)
+    metrics.started()
+    metrics.finished('a', 200, 5.0, 0.0)
+
+    text = metrics.render()
+    # The buckets are cumulative
+    assert 'flaskr_request_duration_seconds_bucket{endpoint="a",le="0.1"} 1' in text
+    assert 'flaskr_request_duration_seconds_bucket{endpoint="a",le="1.0"} 2' in text
+    assert 'flaskr_request_duration_seconds_bucket{endpoint="a",le="+Inf"} 3' in text
+    assert 'flaskr_request_duration_seconds_sum{endpoint="a"} 5.55' in text
+    assert 'flaskr_responses_total{endpoint="a",status="5xx"} 1' in text
+    assert 'flaskr_requests_in_flight 0' in text
+
+def test_metrics_threads():
+    metrics = Metrics()
+
+    # Each thread records in its own shard, and the totals add them up
+    def record():
+        for _ in range(1000):
+            metrics.started()
+            metrics.finished('a', 200, 0.001, 0.0)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert metrics.collect()['responses'][('a', '2xx')] == 4000
+
+def test_metrics_retired_threads():
+    metrics = Metrics()
+
+    # A thread per request, as with "flask run"
+    for _ in range(100):
+        thread = threading.Thread(
+            target=lambda: metrics.finished('a', 200, 0.001, 0.0)
+        )
+        thread.start()
+        thread.join()
+
+    # The shards of the threads that ended were added up and dropped
+    assert len(metrics._shards) == 0
+    assert metrics.collect()['responses'][('a', '2xx')] == 100
+
+def test_metrics_replica_pool(app, client, tmp_path):
+    app.config.update(
+        DATABASE_READS='replica',
+        DATABASE_REPLICA=str(tmp_path / 'replica.sqlite'),
+    )
+    client.get('/')
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'flaskr_db_connections{pool="replica",state="idle"} 1' in text
+    assert 'pool="readonly"' not in text
@@ -0,0 +1,51 @@
+import os
+import signal
+
+import pytest
+from flaskr.passwords import HashPoolFull, PasswordHasher, get_hasher
+
+def test_hash_in_workers():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+
+    # The hash is computed by a worker process, with the configured method
+    pwhash = hasher.hash('secret')
+    assert pwhash.startswith('pbkdf2:sha256:1000$')
+    assert hasher.verify(pwhash, 'secret')
+    assert not hasher.verify(pwhash, 'wrong')
+    hasher.shutdown()
+
+def test_hash_pool_full():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, queue_size=0)
+
+    # Takes the only slot, as if another request were hashing
+    hasher._slots.acquire()
+    with pytest.raises(HashPoolFull):
+        hasher.hash('secret')
+
+    hasher._slots.release()
+    assert hasher.verify(hasher.hash('secret'), 'secret')
+    hasher.shutdown()
+
+def test_hash_worker_killed():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+    pwhash = hasher.hash('secret')
+
+    # The worker dies (e.g. killed when the machine runs out of memory)
+    for pid in list(hasher._executor._processes):
+        os.kill(pid, signal.SIGKILL)
+
+    # The broken pool is replaced by a new one
+    assert hasher.verify(pwhash, 'secret')
+    assert hasher.verify(hasher.hash('secret'), 'secret')
+    hasher.shutdown()
+
+def test_needs_rehash():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=0)
+    assert not hasher.needs_rehash(hasher.hash('secret'))
+    assert hasher.needs_rehash('pbkdf2:sha256:50000$salt$hash')
+    assert hasher.needs_rehash('scrypt:32768:8:1$salt$hash')
+
+def test_get_hasher(app):
+    with app.app_context():
+        assert get_hasher() is get_hasher()
+        assert get_hasher().method == 'pbkdf2:sha256:50000'
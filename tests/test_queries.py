@@ -0,0 +1,89 @@
+import logging
+
+from flaskr.db import get_db
+from flaskr.queries import get_stats, normalize_sql
+
+def test_server_timing(client):
+    response = client.get('/')
+    # e.g. 'db;dur=0.31;desc="2 queries"'
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('db;dur=')
+    assert 'queries"' in timing
+
+    # "/hello" doesn't touch the database
+    timing = client.get('/hello').headers['Server-Timing']
+    assert timing == 'db;dur=0.00;desc="0 queries"'
+
+def test_slow_query_log(app, caplog):
+    # Every query is "slow"
+    app.config['SLOW_QUERY_MS'] = 0
+
+    with caplog.at_level(logging.WARNING, logger='flaskr'):
+        with app.app_context():
+            get_db().execute('SELECT * FROM post WHERE id = ?', (1,))
+
+    # The statement is logged with its query plan
+    assert 'Slow query' in caplog.text
+    assert 'SELECT * FROM post WHERE id = ?' in caplog.text
+    assert 'SEARCH post USING INTEGER PRIMARY KEY' in caplog.text
+
+def test_query_stats(app, client):
+    get_stats(app).clear()
+    client.get('/')
+    client.get('/')
+
+    # Each statement is counted once per request
+    stats = {s['sql']: s for s in get_stats(app).summary()}
+    state = stats['SELECT version, modified FROM blog_state WHERE id = 1']
+    assert state['count'] == 2
+    assert state['max_ms'] <= state['total_ms']
+
+    # The connections' setup and the pool's health checks aren't counted
+    assert not [sql for sql in stats if sql.startswith(('PRAGMA', 'SELECT 1'))]
+
+def test_cached_page_queries(client):
+    client.get('/')
+
+    # The cached page only reads the posts version
+    timing = client.get('/').headers['Server-Timing']
+    assert timing.endswith('desc="1 queries"')
+
+def test_admin_queries(app, client, auth):
+    # Anonymous users are sent to the login page
+    assert client.get('/admin/queries').headers['Location'] == '/auth/login'
+
+    # Only admins can see the stats
+    auth.login()
+    assert client.get('/admin/queries').status_code == 403
+
+    app.config['ADMIN_USERS'] = ('test',)
+    response = client.get('/admin/queries')
+    assert response.status_code == 200
+    assert any(
+        'FROM "user"' in s['sql'] for s in response.get_json()['queries']
+    )
+
+def test_query_stats_normalized(app, client):
+    get_stats(app).clear()
+
+    # The number of ids and the order of the fields come from the client...
+    client.get('/api/posts?ids=1&fields=title,id')
+    client.get('/api/posts?ids=1,2,3&fields=id,title,id')
+
+    # ...but the statement is counted as one
+    stats = [s for s in get_stats(app).summary() if 'IN (' in s['sql']]
+    assert len(stats) == 1
+    assert stats[0]['count'] == 2
+    assert stats[0]['sql'].endswith('WHERE p.id IN (?, ...)')
+
+def test_normalize_sql():
+    assert normalize_sql(
+        'UPDATE post SET body_html = CASE id WHEN ? THEN ? WHEN ? THEN ? END'
+        ' WHERE id IN (?, ?)'
+    ) == (
+        'UPDATE post SET body_html = CASE id WHEN ? THEN ? ... END'
+        ' WHERE id IN (?, ...)'
+    )
+    assert normalize_sql('WHERE id IN (?)') == 'WHERE id IN (?, ...)'
+    # Other parameters are left as they are
+    assert normalize_sql('VALUES (?, ?)') == 'VALUES (?, ?)'
@@ -0,0 +1,63 @@
+from flaskr.db import get_db
+from flaskr.rendering import RENDER_VERSION
+
+def get_post(app, id):
+    with app.app_context():
+        return get_db().execute(
+            'SELECT body_html, render_version FROM post WHERE id = ?', (id,)
+        ).fetchone()
+
+def test_rendered_on_write(app, client, auth):
+    auth.login()
+    client.post('/create', data={'title': 'created', 'body': '<b>bold</b>'})
+
+    post = get_post(app, 2)
+    assert post['body_html'] == '&lt;b&gt;bold&lt;/b&gt;'
+    assert post['render_version'] == RENDER_VERSION
+
+    client.post('/2/update', data={'title': 'created', 'body': 'a & b'})
+    assert get_post(app, 2)['body_html'] == 'a &amp; b'
+
+    # The stored HTML is shown as is, not escaped again
+    for page in (client.get('/').data, client.get('/2').data):
+        assert b'a &amp; b' in page
+        assert b'&amp;amp;' not in page
+
+def test_render_posts(app, runner, monkeypatch):
+    # The post of "tests/data.sql" was never rendered, but is still shown
+    assert get_post(app, 1)['body_html'] is None
+    assert b'test\nbody' in app.test_client().get('/').data
+
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id) VALUES (?, ?, 1)',
+            [(f'post {i}', f'body {i}') for i in range(4)]
+        )
+        db.commit()
+        version = db.execute('SELECT version FROM blog_state').fetchone()[0]
+
+    result = runner.invoke(args=['render-posts', '--batch-size', '2'])
+    assert 'Rendered 5 posts' in result.output
+
+    assert get_post(app, 1)['body_html'] == 'test\nbody'
+    assert get_post(app, 5)['body_html'] == 'body 3'
+
+    # The pages showing them changed
+    with app.app_context():
+        assert get_db().execute(
+            'SELECT version FROM blog_state'
+        ).fetchone()[0] > version
+
+    # Nothing is left to render...
+    result = runner.invoke(args=['render-posts'])
+    assert 'Rendered 0 posts' in result.output
+
+    # ...until the renderer changes
+    monkeypatch.setattr('flaskr.rendering.RENDER_VERSION', RENDER_VERSION + 1)
+    monkeypatch.setattr('flaskr.rendering.render_body', str.upper)
+
+    result = runner.invoke(args=['render-posts'])
+    assert 'Rendered 5 posts' in result.output
+    assert get_post(app, 5)['body_html'] == 'BODY 3'
+    assert get_post(app, 5)['render_version'] == RENDER_VERSION + 1
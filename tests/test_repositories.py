@@ -0,0 +1,142 @@
+import os
+import time
+
+import pytest
+from flaskr.backends import close_backend, get_backend
+from flaskr.db import init_db
+from flaskr.repositories import MATCH_END, MATCH_START, get_posts, get_users
+
+# Every test runs on both backends. The "postgresql" one needs a server (e.g.
+# a local one started with "docker run -e POSTGRES_PASSWORD=test -p 5432:5432
+# postgres") given by FLASKR_TEST_POSTGRES_URL, and is skipped otherwise.
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def backend_app(request, app):
+    if request.param == 'postgresql':
+        url = os.environ.get('FLASKR_TEST_POSTGRES_URL')
+        if not url:
+            pytest.skip('FLASKR_TEST_POSTGRES_URL is not set')
+        pytest.importorskip('psycopg2')
+
+        app.config.update(DATABASE_BACKEND='postgresql', DATABASE_URL=url)
+        with app.app_context():
+            init_db()
+
+    yield app
+
+    close_backend(app)
+
+def add_user(username):
+    get_users().create(username, 'hash')
+    return get_users().get_by_username(username)['id']
+
+def test_backend(backend_app):
+    with backend_app.app_context():
+        assert get_backend().name == backend_app.config['DATABASE_BACKEND']
+
+def test_users(backend_app):
+    with backend_app.app_context():
+        users = get_users()
+        id = add_user('alice')
+
+        assert dict(users.get(id)) == {'id': id, 'username': 'alice'}
+        assert users.get_by_username('alice')['password'] == 'hash'
+        assert users.get(id + 100) is None
+
+        users.set_password(id, 'new hash')
+        assert users.get_by_username('alice')['password'] == 'new hash'
+
+        # Usernames are unique
+        with pytest.raises(users.IntegrityError):
+            users.create('alice', 'hash')
+
+        # The failed insert doesn't break the following queries
+        assert users.get(id)['username'] == 'alice'
+
+def test_posts(backend_app):
+    with backend_app.app_context():
+        posts = get_posts()
+        author_id = add_user('alice')
+        version = posts.get_state()['version']
+
+        posts.create('first', 'body', author_id)
+        assert posts.get_state()['version'] > version
+
+        newest = posts.page(limit=1)[0]
+        assert newest['title'] == 'first'
+        assert newest['username'] == 'alice'
+
+        post = posts.get(newest['id'])
+        assert post['body'] == 'body'
+        assert posts.get_updated(post['id'])['updated'] is not None
+        version = posts.get_state()['version']
+
+        posts.update(post['id'], 'changed', 'new body')
+        assert posts.get(post['id'])['title'] == 'changed'
+        assert posts.get_state()['version'] > version
+
+        posts.delete(post['id'])
+        assert posts.get(post['id']) is None
+        assert posts.get_updated(post['id']) is None
+
+def test_renamed_author(backend_app):
+    # The posts show their author's username, so renaming the author changes
+    # the posts' validators and the blog's version
+    with backend_app.app_context():
+        posts = get_posts()
+        author_id = add_user('alice')
+        posts.create('first', 'body', author_id)
+        id = posts.page(limit=1)[0]['id']
+
+        version = posts.get_state()['version']
+        updated = posts.get_updated(id)['updated']
+        # "updated" has a precision of milliseconds
+        time.sleep(0.01)
+
+        get_backend().write(
+            'UPDATE "user" SET username = ? WHERE id = ?', ('bob', author_id)
+        )
+        assert posts.get(id)['username'] == 'bob'
+        assert posts.get_state()['version'] > version
+        assert posts.get_updated(id)['updated'] > updated
+
+def test_page(backend_app):
+    with backend_app.app_context():
+        posts = get_posts()
+        author_id = add_user('alice')
+
+        for i in range(3):
+            posts.create(f'post {i}', 'body', author_id)
+
+        # Posts created in the same second are ordered by id
+        newest = posts.page(limit=3)
+        assert [post['title'] for post in newest] == [
+            'post 2', 'post 1', 'post 0'
+        ]
+
+        key = (newest[0]['created'], newest[0]['id'])
+        older = posts.page(before=key, limit=2)
+        assert [post['title'] for post in older] == ['post 1', 'post 0']
+
+        # Newer posts come oldest first (see "page_query")
+        key = (newest[2]['created'], newest[2]['id'])
+        newer = posts.page(after=key, limit=2)
+        assert [post['title'] for post in newer] == ['post 1', 'post 2']
+
+def test_search(backend_app):
+    with backend_app.app_context():
+        posts = get_posts()
+        author_id = add_user('alice')
+        posts.create('apples', 'about pears', author_id)
+        posts.create('pears', 'about apples', author_id)
+
+        results = posts.search('pears')
+
+        # Matches in the title rank first
+        assert [post['excerpt'] for post in results] == [
+            'about apples', f'about {MATCH_START}pears{MATCH_END}'
+        ]
+        assert results[0]['title'] == f'{MATCH_START}pears{MATCH_END}'
+        assert posts.search('pears', limit=1, offset=1)[0]['excerpt'] == (
+            f'about {MATCH_START}pears{MATCH_END}'
+        )
+        assert posts.search('plums') == []